@@ -14,6 +14,19 @@ import pandas as pd
 import hashlib
 import os
 from hijri_converter import Hijri, Gregorian
+from modules.activity_log import (
+    ADMIN_MESSAGE_STATUS, append_log, count_logs, delete_log, get_all_user_stats, get_logs,
+    get_user_stats, update_log,
+)
+from modules.campaign_export import EXPORT_FORMATS, export_campaign_contacts
+from modules.json_store import write_json
+from modules.llm import (
+    DEFAULT_CONCURRENCY, DEFAULT_MAX_TOKENS, DEFAULT_MODEL, DEFAULT_TEMPERATURE, MAX_BATCH_JOBS,
+    build_batch_jobs, build_messages, build_scenario_prompt, generate_batch,
+)
+from modules.llm_cache import cached_chat, stream_chat
+from modules.llm_quota import QuotaExceeded
+from modules.snapshot import get_snapshot, update_snapshot
 
 # إعداد الصفحة
 st.set_page_config(
@@ -236,43 +249,32 @@ def verify_password(password, hashed):
     return hash_password(password) == hashed
 
 # ============================================
-# 🧩 تحميل الملفات الأساسية مع معالجة الأخطاء
+# 🧩 حفظ الملفات الأساسية مع معالجة الأخطاء
 # ============================================
-@st.cache_data(ttl=300)  # Cache لمدة 5 دقائق
-def load_json(path):
-    """تحميل ملف JSON مع معالجة أفضل للأخطاء (cached)"""
-    try:
-        if not os.path.exists(path):
-            # إنشاء ملف فارغ إذا لم يكن موجوداً
-            default_data = [] if path.endswith('.json') and 'logs' in path else {}
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(default_data, f, ensure_ascii=False, indent=2)
-            return default_data
-        
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        st.error(f"⚠️ خطأ في قراءة الملف: {path}")
-        return [] if 'logs' in path else {}
-    except Exception as e:
-        st.error(f"⚠️ خطأ غير متوقع: {e}")
-        return [] if 'logs' in path else {}
-
 def save_json(path, data):
-    """حفظ البيانات إلى ملف JSON مع معالجة الأخطاء"""
+    """حفظ البيانات إلى ملف JSON (كتابة ذرية تحت قفل)"""
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        write_json(path, data)
         return True
     except Exception as e:
         st.error(f"⚠️ فشل حفظ البيانات: {e}")
         return False
 
-# تحميل البيانات
-USERS = load_json("users.json")
-OPTIONS = load_json("options.json")
-LOGS = load_json("user_logs.json")
-CAMPAIGNS = load_json("campaigns.json")
+def append_moraselaty_campaign(campaign):
+    """إضافة حملة إلى moraselaty_campaigns.json (قراءة + إضافة + حفظ داخل قفل واحد)، وإرجاع معرّفها"""
+    new_ids = []
+    def add(campaigns_data):
+        new_ids.append(len(campaigns_data["campaigns"]) + 1)
+        campaigns_data["campaigns"].append({"id": new_ids[-1], **campaign})
+    
+    if update_snapshot("moraselaty_campaigns.json", add, default={"campaigns": []}) is None:
+        return None
+    return new_ids[-1]
+
+# تحميل البيانات (لقطات مشتركة بين الجلسات - للقراءة فقط، التعديل عبر update_snapshot)
+USERS = get_snapshot("users.json", {})
+OPTIONS = get_snapshot("options.json", {})
+CAMPAIGNS = get_snapshot("campaigns.json", [])
 
 
 # ============================================
@@ -421,8 +423,8 @@ def home():
     st.markdown("<br>", unsafe_allow_html=True)
     
     # إحصائيات سريعة
-    user_logs = [x for x in LOGS if x.get("user") == st.session_state.user]
-    total_scripts = len(user_logs)
+    my_stats = get_user_stats(st.session_state.user)
+    total_scripts = my_stats["scripts_count"] + my_stats["messages_count"]
     total_campaigns = len(CAMPAIGNS)
     
     col1, col2, col3, col4 = st.columns(4)
@@ -560,94 +562,178 @@ def generator():
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
         generate_btn = st.button("✨ توليد السيناريو الآن", use_container_width=True, type="primary")
+        fresh_script = st.checkbox("🔄 نص جديد (تجاهل النسخة المحفوظة)", key="fresh_script")
+    
+    def render_script_card(container, text):
+        """بطاقة السيناريو (تُحدَّث مع كل جزء يصل أثناء التوليد)"""
+        container.markdown(f"""
+            <div style='background: white; padding: 1.5rem; border-radius: 12px; 
+                        border-right: 4px solid #667eea; box-shadow: 0 3px 10px rgba(0,0,0,0.1);'>
+                {text.replace(chr(10), '<br>')}
+            </div>
+        """, unsafe_allow_html=True)
+    
+    # زر الإيقاف يعيد تشغيل الصفحة فيقطع التوليد: عرض ما وصل قبل الإيقاف
+    if st.session_state.pop('script_stopped', False) and st.session_state.get('partial_script'):
+        st.warning("⏹️ تم إيقاف التوليد، هذا ما وصل قبل الإيقاف:")
+        render_script_card(st.empty(), st.session_state.partial_script)
     
     if generate_btn:
         if not all([offer, product, platform, scenario]):
             st.error("❌ يرجى ملء جميع الحقول المطلوبة")
             return
         
-        with st.spinner("🔄 جارٍ توليد السيناريو... يرجى الانتظار"):
-            try:
-                # بناء الـ Prompt
-                sfda_rules = ""
-                if sfda_compliance == "نعم":
-                    sfda_rules = """
-                    ✅ طبق اشتراطات هيئة الغذاء والدواء السعودية (SFDA):
-                    - يمنع أي ادعاء طبي مثل "يعالج"، "يشفي"، "يقضي على"، "يوقف"، "يمنع"، "يصلح"، "يُجدد".
-                    - استخدم بدائل قانونية مثل: "يساعد"، "يساهم"، "يدعم"، "يعزز"، "يمنح إحساسًا بـ".
-                    - لا تُظهر المنتج كعلاج أو بديل طبي.
-                    - لا تستخدم صور أو عبارات توحي بنتائج مضمونة أو قبل/بعد.
-                    - لا تقلل من شأن المنافسين أو تدّعي أن المنتج "الأفضل".
-                    - لا تذكر أمراض، أعضاء جسمية، أو مصطلحات طبية.
-                    - ركّز على التجربة الحسية والفوائد الواقعية.
-                    """
-                
-                prompt = f"""
-اكتب سكربت تسويقي احترافي باللهجة السعودية لمنتج {product} على منصة {platform}.
-
-**تفاصيل السيناريو:**
-- السيناريو: {scenario}
-- النبرة: {tone}
-- العرض: {offer}
-- التوصيل: {shipping}
-- الهدية: {gift}
-- الكاش باك: {cashback}
-
-**تعليمات إضافية:** {inst if inst else "لا توجد"}
-
-{sfda_rules}
-
-**المطلوب:**
-- اكتب سكربت جذاب ومقنع
-- استخدم اللهجة السعودية بشكل طبيعي
-- اجعل النص مناسب لمنصة {platform}
-- ركز على الفوائد والقيمة المضافة
-"""
-                
-                response = openai.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {
-                            "role": "system", 
-                            "content": "أنت كاتب محتوى تسويقي سعودي محترف ومطلع على سياسات الإعلانات لمنصات التواصل الاجتماعي واشتراطات SFDA."
-                        },
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.8,
-                    max_tokens=1000
-                )
-                
-                script = response.choices[0].message.content.strip()
-                
-                # عرض النتيجة
-                st.success("✅ تم توليد السيناريو بنجاح!")
-                st.balloons()
-                
-                st.markdown("### 📜 السيناريو الناتج")
-                st.markdown(f"""
-                    <div style='background: white; padding: 1.5rem; border-radius: 12px; 
-                                border-right: 4px solid #667eea; box-shadow: 0 3px 10px rgba(0,0,0,0.1);'>
-                        {script.replace(chr(10), '<br>')}
-                    </div>
-                """, unsafe_allow_html=True)
-                
-                # خيارات إضافية
-                st.markdown("<br>", unsafe_allow_html=True)
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    if st.button("💾 حفظ السيناريو", use_container_width=True):
-                        save_log(st.session_state.user, product, scenario, platform)
-                        st.success("✅ تم حفظ السيناريو في حسابك")
-                
-                with col2:
-                    if st.button("📋 نسخ النص", use_container_width=True):
-                        st.code(script, language=None)
-                        st.info("💡 يمكنك نسخ النص من الصندوق أعلاه")
-                
-            except Exception as e:
-                st.error(f"❌ حدث خطأ أثناء توليد السيناريو: {str(e)}")
-                st.info("💡 يرجى التحقق من اتصال الإنترنت ومفتاح OpenAI API")
+        try:
+            # بناء الـ Prompt
+            prompt = build_scenario_prompt(
+                product, platform, scenario, tone=tone, offer=offer, shipping=shipping,
+                gift=gift, cashback=cashback, inst=inst, sfda=sfda_compliance == "نعم"
+            )
+            
+            st.button("⏹️ إيقاف التوليد", key="stop_script",
+                      on_click=lambda: st.session_state.update(script_stopped=True))
+            st.markdown("### 📜 السيناريو الناتج")
+            card = st.empty()
+            card.info("🔄 جارٍ توليد السيناريو...")
+            
+            def on_token(delta, text):
+                st.session_state.partial_script = text
+                render_script_card(card, text + " ▌")
+            
+            # النص يظهر كلمة بكلمة أثناء التوليد
+            response = stream_chat(
+                build_messages(prompt),
+                model=DEFAULT_MODEL,
+                temperature=DEFAULT_TEMPERATURE,
+                max_tokens=DEFAULT_MAX_TOKENS,
+                on_token=on_token,
+                refresh=fresh_script,
+                context={"user": st.session_state.user, "feature": "سيناريو",
+                         "product": product, "platform": platform}
+            )
+            
+            script = response['content']
+            st.session_state.pop('partial_script', None)
+            render_script_card(card, script)
+            
+            # عرض النتيجة
+            st.success("✅ تم توليد السيناريو بنجاح!")
+            if response['source'] != 'api':
+                st.caption("♻️ نفس الطلب وُلّد سابقاً، تم استخدام النسخة المحفوظة (فعّل \"نص جديد\" لتوليد نسخة أخرى)")
+            else:
+                st.caption(f"⚡ أول كلمة بعد {response['ttft'] or response['elapsed']:.2f} ث • "
+                           f"الزمن الكلي {response['elapsed']:.1f} ث")
+            st.balloons()
+            
+            # خيارات إضافية
+            st.markdown("<br>", unsafe_allow_html=True)
+            col1, col2 = st.columns(2)
+            
+            with col1:
+                if st.button("💾 حفظ السيناريو", use_container_width=True):
+                    save_log(st.session_state.user, product, scenario, platform)
+                    st.success("✅ تم حفظ السيناريو في حسابك")
+            
+            with col2:
+                if st.button("📋 نسخ النص", use_container_width=True):
+                    st.code(script, language=None)
+                    st.info("💡 يمكنك نسخ النص من الصندوق أعلاه")
+            
+        except QuotaExceeded as e:
+            st.warning(str(e))
+        except Exception as e:
+            st.error(f"❌ حدث خطأ أثناء توليد السيناريو: {str(e)}")
+            st.info("💡 يرجى التحقق من اتصال الإنترنت ومفتاح OpenAI API")
+    
+    # ============================================
+    # 📦 التوليد الدفعي (تقويم محتوى)
+    # ============================================
+    st.markdown("---")
+    st.markdown("### 📦 التوليد الدفعي (تقويم محتوى)")
+    st.caption("اختر عدة منتجات ومنصات وسيناريوهات، وسيتم توليدها بالتوازي بنفس التفاصيل الإضافية أعلاه.")
+    
+    col_b1, col_b2, col_b3 = st.columns(3)
+    with col_b1:
+        batch_products = st.multiselect("🧴 المنتجات:", OPTIONS.get("product", []),
+                                        default=[product] if product else [], key="batch_products")
+    with col_b2:
+        batch_platforms = st.multiselect("📱 المنصات:", OPTIONS.get("platform", []),
+                                         default=[platform] if platform else [], key="batch_platforms")
+    with col_b3:
+        batch_scenarios = st.multiselect("🎬 السيناريوهات:", OPTIONS.get("scenario", []),
+                                         default=[scenario] if scenario else [], key="batch_scenarios")
+    
+    batch_jobs = build_batch_jobs(
+        batch_products, batch_platforms, batch_scenarios, tone=tone, offer=offer, shipping=shipping,
+        gift=gift, cashback=cashback, inst=inst, sfda=sfda_compliance == "نعم"
+    )
+    concurrency = st.slider("⚡ عدد الطلبات المتزامنة:", 1, 8, DEFAULT_CONCURRENCY, key="batch_concurrency")
+    batch_fresh = st.checkbox("🔄 توليد نصوص جديدة (تجاهل النسخ المحفوظة)", key="batch_fresh")
+    
+    if len(batch_jobs) > MAX_BATCH_JOBS:
+        st.warning(f"⚠️ عدد التركيبات {len(batch_jobs)} أكبر من الحد الأقصى ({MAX_BATCH_JOBS}) للدفعة الواحدة")
+    else:
+        st.info(f"📊 سيتم توليد {len(batch_jobs)} سيناريو")
+    
+    def render_batch_result(container, result):
+        """عرض نتيجة مهمة واحدة من الدفعة"""
+        title = f"{result['product']} | {result['platform']} | {result['scenario']}"
+        with container.container():
+            if result['error']:
+                st.error(f"❌ {title}: {result['error']}")
+            else:
+                source = "♻️ محفوظ" if result.get('cached') else f"{result['elapsed']:.1f} ث"
+                with st.expander(f"✅ {title} ({source})"):
+                    st.markdown(result['script'])
+    
+    batch_btn = st.button("🚀 توليد الدفعة", use_container_width=True,
+                          disabled=not batch_jobs or len(batch_jobs) > MAX_BATCH_JOBS)
+    
+    if batch_btn:
+        progress_bar = st.progress(0.0, text="⏳ جارٍ التوليد...")
+        slots = [st.empty() for _ in batch_jobs]
+        finished = []
+        
+        def on_result(index, result):
+            # تُستدعى فور انتهاء كل سيناريو (بترتيب الانتهاء وليس بترتيب الطلب)
+            finished.append(index)
+            progress_bar.progress(len(finished) / len(batch_jobs),
+                                  text=f"⏳ تم {len(finished)} / {len(batch_jobs)}")
+            render_batch_result(slots[index], result)
+        
+        try:
+            st.session_state.batch_results = generate_batch(batch_jobs, on_result=on_result,
+                                                            concurrency=concurrency,
+                                                            use_cache=not batch_fresh,
+                                                            context={"user": st.session_state.user,
+                                                                     "feature": "دفعة سيناريوهات"})
+            failed = sum(1 for r in st.session_state.batch_results if r['error'])
+            progress_bar.progress(1.0, text=f"✅ اكتملت الدفعة ({failed} فشل)" if failed else "✅ اكتملت الدفعة")
+        except Exception as e:
+            st.error(f"❌ حدث خطأ أثناء توليد الدفعة: {str(e)}")
+            st.info("💡 يرجى التحقق من اتصال الإنترنت ومفتاح OpenAI API")
+    elif st.session_state.get('batch_results'):
+        for result in st.session_state.batch_results:
+            render_batch_result(st.empty(), result)
+    
+    batch_results = [r for r in st.session_state.get('batch_results') or [] if not r['error']]
+    if batch_results:
+        col_d1, col_d2 = st.columns(2)
+        with col_d1:
+            df_batch = pd.DataFrame(batch_results)[['product', 'platform', 'scenario', 'script']]
+            df_batch.columns = ['المنتج', 'المنصة', 'السيناريو', 'النص']
+            st.download_button(
+                "📥 تحميل الدفعة (CSV)",
+                df_batch.to_csv(index=False, encoding='utf-8-sig'),
+                file_name=f"scenarios_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.csv",
+                mime="text/csv",
+                use_container_width=True
+            )
+        with col_d2:
+            if st.button("💾 حفظ الكل في حسابي", use_container_width=True):
+                for result in batch_results:
+                    save_log(st.session_state.user, result['product'], result['scenario'], result['platform'])
+                st.success(f"✅ تم حفظ {len(batch_results)} سيناريو في حسابك")
 
 # ============================================
 # 💾 حفظ سجل النشاط (محسّن)
@@ -666,11 +752,7 @@ def save_log(user, product, scenario, platform, campaign="لا توجد حملة
             "campaign": campaign
         }
         
-        LOGS.append(log_entry)
-        
-        if save_json("user_logs.json", LOGS):
-            return True
-        return False
+        return append_log(**log_entry) is not None
     except Exception as e:
         st.error(f"⚠️ فشل حفظ السجل: {e}")
         return False
@@ -690,13 +772,10 @@ def account_page():
     """, unsafe_allow_html=True)
     
     # التحقق من الرسائل الإدارية
-    admin_msgs = [
-        x for x in LOGS
-        if x.get("user") == st.session_state.user and x.get("status") == "رسالة من الأدمن"
-    ]
+    admin_msgs = get_logs(user=st.session_state.user, status=ADMIN_MESSAGE_STATUS, limit=1, newest_first=True)
     
     if admin_msgs:
-        latest_msg = admin_msgs[-1]
+        latest_msg = admin_msgs[0]
         st.markdown(f"""
             <div style='background: #fff3cd; border-left: 4px solid #ffc107; 
                         padding: 1rem; border-radius: 8px; margin-bottom: 1.5rem;'>
@@ -707,7 +786,7 @@ def account_page():
         """, unsafe_allow_html=True)
     
     # سجل النشاط
-    user_logs = [x for x in LOGS if x.get("user") == st.session_state.user and x.get("status") != "رسالة من الأدمن"]
+    user_logs = get_logs(user=st.session_state.user, exclude_status=ADMIN_MESSAGE_STATUS)
     
     if not user_logs:
         st.info("📝 لم تُنتج أي سيناريوهات بعد. ابدأ الآن بإنشاء سيناريو جديد!")
@@ -721,17 +800,17 @@ def account_page():
     st.markdown("### 📊 إحصائيات سريعة")
     col1, col2, col3 = st.columns(3)
     
+    my_stats = get_user_stats(st.session_state.user)
+    
     with col1:
-        st.metric("📝 إجمالي السيناريوهات", len(user_logs))
+        st.metric("📝 إجمالي السيناريوهات", my_stats["scripts_count"])
     
     with col2:
-        campaigns_count = len(set([x.get("campaign", "لا توجد حملة") for x in user_logs if x.get("campaign") != "لا توجد حملة"]))
-        st.metric("📦 الحملات المشاركة", campaigns_count)
+        st.metric("📦 الحملات المشاركة", my_stats["campaigns_count"])
     
     with col3:
-        if user_logs:
-            last_date = user_logs[-1].get("timestamp", "غير محدد").split()[0]
-            st.metric("📅 آخر نشاط", last_date)
+        last_date = (my_stats["last_script_at"] or "غير محدد").split()[0]
+        st.metric("📅 آخر نشاط", last_date)
     
     st.markdown("<br>", unsafe_allow_html=True)
     
@@ -754,7 +833,7 @@ def account_page():
     # إدارة السيناريوهات
     st.markdown("### 🛠️ إدارة السيناريوهات")
     
-    for i, row in enumerate(user_logs):
+    for row in user_logs:
         with st.expander(f"🎬 {row.get('product', 'غير محدد')} | {row.get('scenario', 'غير محدد')} | {row.get('timestamp', 'غير محدد')}"):
             col1, col2 = st.columns([2, 1])
             
@@ -763,39 +842,81 @@ def account_page():
                     "📦 اختر الحملة الإعلانية:",
                     ["لا توجد حملة"] + CAMPAIGNS,
                     index=(["لا توجد حملة"] + CAMPAIGNS).index(row.get("campaign", "لا توجد حملة")) if row.get("campaign", "لا توجد حملة") in (["لا توجد حملة"] + CAMPAIGNS) else 0,
-                    key=f"campaign_{i}"
+                    key=f"campaign_{row['id']}"
                 )
                 
-                if st.button(f"💾 حفظ التعديل", key=f"save_{i}"):
-                    # البحث عن الفهرس الصحيح في LOGS
-                    for idx, log in enumerate(LOGS):
-                        if (log.get("user") == row.get("user") and 
-                            log.get("timestamp") == row.get("timestamp") and
-                            log.get("product") == row.get("product")):
-                            LOGS[idx]["campaign"] = selected_campaign
-                            break
-                    
-                    if save_json("user_logs.json", LOGS):
+                if st.button(f"💾 حفظ التعديل", key=f"save_{row['id']}"):
+                    if update_log(row["id"], campaign=selected_campaign):
                         st.success("✅ تم حفظ التعديل بنجاح")
                         st.rerun()
             
             with col2:
-                if st.button(f"🗑️ حذف السيناريو", key=f"delete_{i}", type="secondary"):
-                    # حذف من LOGS الأصلي
-                    for idx, log in enumerate(LOGS):
-                        if (log.get("user") == row.get("user") and 
-                            log.get("timestamp") == row.get("timestamp") and
-                            log.get("product") == row.get("product")):
-                            LOGS.pop(idx)
-                            break
-                    
-                    if save_json("user_logs.json", LOGS):
+                if st.button(f"🗑️ حذف السيناريو", key=f"delete_{row['id']}", type="secondary"):
+                    if delete_log(row["id"]):
                         st.success("🗑️ تم حذف السيناريو")
                         st.rerun()
 
 # ============================================
 # 🧭 لوحة التحكم الإدارية (محسّنة)
 # ============================================
+def render_inventory(snapshot_id, page_size=50):
+    """عرض لقطة جرد: الإجماليات المحسوبة مسبقاً + تنبيهات + جدول مقسم إلى صفحات"""
+    from modules.inventory import LOW_STOCK_THRESHOLD, count_inventory_items, get_inventory_page, get_low_stock, get_snapshots
+    
+    snapshot = next((s for s in get_snapshots() if s["id"] == snapshot_id), None)
+    if snapshot is None:
+        st.warning("⚠️ لقطة الجرد غير موجودة")
+        return
+    
+    # إحصائيات سريعة
+    st.markdown("إحصائيات الجرد")
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        st.metric("📦 إجمالي المنتجات", snapshot["items_count"])
+    
+    with col2:
+        st.metric("📊 إجمالي الكمية", f"{snapshot['total_quantity']:,.0f}")
+    
+    with col3:
+        st.metric("⚠️ منتجات قليلة المخزون", snapshot["low_stock_count"])
+    
+    # تنبيهات المخزون القليل
+    if snapshot["low_stock_count"]:
+        low_stock = get_low_stock(snapshot_id, limit=10)
+        st.warning(
+            f"⚠️ {snapshot['low_stock_count']} منتج أقل من {LOW_STOCK_THRESHOLD}: "
+            + "، ".join(f"{item['اسم المنتج']} ({item['كميته']:,.0f})" for item in low_stock)
+            + (" ..." if snapshot["low_stock_count"] > len(low_stock) else "")
+        )
+    
+    st.markdown("<br>", unsafe_allow_html=True)
+    
+    # عرض الجدول
+    st.markdown("جدول الجرد الكامل")
+    
+    col_f1, col_f2 = st.columns([2, 1])
+    with col_f1:
+        search = st.text_input("🔍 بحث عن منتج:", key=f"inventory_search_{snapshot_id}")
+    with col_f2:
+        low_stock_only = st.checkbox("⚠️ المخزون القليل فقط", key=f"inventory_low_{snapshot_id}")
+    
+    total = count_inventory_items(snapshot_id, low_stock_only, search or None)
+    pages = max((total + page_size - 1) // page_size, 1)
+    page = st.number_input(f"الصفحة (من {pages})", min_value=1, max_value=pages, value=1,
+                           key=f"inventory_page_{snapshot_id}")
+    
+    rows = get_inventory_page(snapshot_id, int(page), page_size, low_stock_only, search or None)
+    st.dataframe(pd.DataFrame(rows), use_container_width=True, height=400)
+    
+    # ملاحظة
+    st.info("""
+        💡 **ملاحظة:** 
+        - 🟢 **جيد**: مخزون جيد (500+)
+        - 🔵 **متوسط**: مخزون متوسط (100-499)
+        - 🟠 **قليل**: مخزون قليل (<100)
+    """)
+
 def admin_dashboard():
     load_custom_css()
     
@@ -817,14 +938,14 @@ def admin_dashboard():
         st.metric("👥 عدد المستخدمين", total_users)
     
     with col2:
-        total_scripts = len([x for x in LOGS if x.get("status") != "رسالة من الأدمن"])
+        total_scripts = count_logs(exclude_status=ADMIN_MESSAGE_STATUS)
         st.metric("📝 إجمالي السيناريوهات", total_scripts)
     
     with col3:
         st.metric("📦 الحملات النشطة", len(CAMPAIGNS))
     
     with col4:
-        today_scripts = len([x for x in LOGS if x.get("timestamp", "").startswith(datetime.datetime.now().strftime("%Y-%m-%d"))])
+        today_scripts = count_logs(date=datetime.datetime.now().strftime("%Y-%m-%d"))
         st.metric("📅 سيناريوهات اليوم", today_scripts)
     
     st.markdown("<br>", unsafe_allow_html=True)
@@ -832,27 +953,18 @@ def admin_dashboard():
     # جدول المستخدمين
     st.markdown("### 👥 نشاط المستخدمين")
     
-    df = pd.DataFrame(LOGS)
-    if not df.empty:
-        users = list(USERS.keys())
+    user_stats = get_all_user_stats()
+    if user_stats:
         table = []
         
-        for u in users:
-            user_df = df[df["user"] == u]
-            if not user_df.empty:
-                last_activity = user_df["timestamp"].max()
-                total_scripts = len(user_df[user_df["status"] != "رسالة من الأدمن"])
-                last_product = user_df[user_df["status"] != "رسالة من الأدمن"].iloc[-1]["product"] if total_scripts > 0 else "-"
-            else:
-                last_activity = "-"
-                total_scripts = 0
-                last_product = "-"
+        for u in USERS:
+            stats = user_stats.get(u, {})
             
             table.append({
                 "المستخدم": u,
-                "آخر نشاط": last_activity,
-                "عدد السيناريوهات": total_scripts,
-                "آخر منتج": last_product,
+                "آخر نشاط": stats.get("last_activity") or "-",
+                "عدد السيناريوهات": stats.get("scripts_count", 0),
+                "آخر منتج": stats.get("last_product") or "-",
                 "النوع": USERS[u].get("role", "user")
             })
         
@@ -876,18 +988,7 @@ def admin_dashboard():
     
     if st.button("📤 إرسال التوجيه", use_container_width=True, type="primary"):
         if note.strip():
-            LOGS.append({
-                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "user": selected_user,
-                "status": "رسالة من الأدمن",
-                "note": note,
-                "product": "-",
-                "scenario": "-",
-                "platform": "-",
-                "campaign": "-"
-            })
-            
-            if save_json("user_logs.json", LOGS):
+            if append_log(selected_user, status=ADMIN_MESSAGE_STATUS, note=note, campaign="-"):
                 st.success(f"✅ تم إرسال التوجيه إلى {selected_user}")
         else:
             st.warning("⚠️ يرجى كتابة التوجيه قبل الإرسال")
@@ -901,6 +1002,8 @@ def admin_dashboard():
     # الجرد المحدث
     st.markdown("الجرد المحدث")
     
+    from modules.inventory import get_snapshots, import_inventory_file, sync_inventory_files
+    
     # رفع ملف Excel
     uploaded_file = st.file_uploader(
         "📄 ارفع ملف الجرد (Excel):",
@@ -912,67 +1015,23 @@ def admin_dashboard():
     if uploaded_file:
         try:
             # حفظ الملف
-            import os
             os.makedirs("inventory_files", exist_ok=True)
             
             file_path = f"inventory_files/{uploaded_file.name}"
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            # الكتابة والاستيراد مرة واحدة لكل رفع، وليس في كل إعادة تشغيل للصفحة
+            if st.session_state.get("inventory_upload_id") != uploaded_file.file_id:
+                with open(file_path, "wb") as f:
+                    f.write(uploaded_file.getbuffer())
+                
+                # استيراد الملف كلقطة جرد (مرة واحدة لكل محتوى، وعملية استيراد لكل رفع)
+                st.session_state.inventory_upload_snapshot = import_inventory_file(file_path)
+                st.session_state.inventory_upload_id = uploaded_file.file_id
             
             st.success(f"✅ تم رفع الملف: {uploaded_file.name}")
             
-            # قراءة وعرض البيانات
-            df = pd.read_excel(file_path)
-            
-            # إحصائيات سريعة
-            st.markdown("إحصائيات الجرد")
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                st.metric("📦 إجمالي المنتجات", len(df))
-            
-            with col2:
-                if "كميته" in df.columns:
-                    total_qty = df["كميته"].sum()
-                    st.metric("📊 إجمالي الكمية", f"{total_qty:,.0f}")
-                else:
-                    st.metric("📊 إجمالي الكمية", "-")
-            
-            with col3:
-                if "كميته" in df.columns:
-                    low_stock = len(df[df["كميته"] < 100])
-                    st.metric("⚠️ منتجات قليلة المخزون", low_stock)
-                else:
-                    st.metric("⚠️ منتجات قليلة المخزون", "-")
-            
-            st.markdown("<br>", unsafe_allow_html=True)
-            
-            # عرض الجدول
-            st.markdown("جدول الجرد الكامل")
-            
-            # تنسيق الجدول
-            if "كميته" in df.columns:
-                # تلوين الصفوف حسب الكمية
-                def highlight_low_stock(row):
-                    if row["كميته"] < 100:
-                        return ['background-color: #fff3cd'] * len(row)
-                    elif row["كميته"] < 500:
-                        return ['background-color: #d1ecf1'] * len(row)
-                    else:
-                        return ['background-color: #d4edda'] * len(row)
-                
-                styled_df = df.style.apply(highlight_low_stock, axis=1)
-                st.dataframe(styled_df, use_container_width=True, height=400)
-            else:
-                st.dataframe(df, use_container_width=True, height=400)
-            
-            # ملاحظة
-            st.info("""
-                💡 **ملاحظة:** 
-                - 🟡 **أخضر**: مخزون جيد (500+)
-                - 🔵 **أزرق**: مخزون متوسط (100-499)
-                - 🟠 **أصفر**: مخزون قليل (<100)
-            """)
+            snapshot_id = st.session_state.inventory_upload_snapshot
+            if snapshot_id is not None:
+                render_inventory(snapshot_id)
             
             # حفظ مسار الملف للاستخدام اللاحق
             st.session_state.current_inventory_file = file_path
@@ -982,37 +1041,24 @@ def admin_dashboard():
     
     # عرض آخر ملف محفوظ
     else:
-        # التأكد من وجود المجلد
-        os.makedirs("inventory_files", exist_ok=True)
-        
-        if os.path.exists("inventory_files"):
-            files = [f for f in os.listdir("inventory_files") if f.endswith(('.xlsx', '.xls'))]
-        else:
-            files = []
-        
-        if files:
-            latest_file = max([f"inventory_files/{f}" for f in files], key=os.path.getmtime)
-            
-            st.info(f"📁 آخر ملف محفوظ: {os.path.basename(latest_file)}")
+        # الملفات الجديدة فقط تُستورد، والباقي يُعرف من بصمته
+        sync_inventory_files("inventory_files")
+        snapshots = get_snapshots()
+        
+        if snapshots:
+            labels = {s["id"]: f"{s['source_file']} ({s['imported_at']})" for s in snapshots}
+            snapshot_id = st.selectbox(
+                "📁 لقطة الجرد:",
+                list(labels),
+                format_func=labels.get,
+                key="inventory_snapshot"
+            )
+            render_inventory(snapshot_id)
             
-            if st.button("👁️ عرض الملف المحفوظ", use_container_width=True):
-                try:
-                    df = pd.read_excel(latest_file)
-                    
-                    # إحصائيات
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("📦 إجمالي المنتجات", len(df))
-                    with col2:
-                        if "كميته" in df.columns:
-                            st.metric("📊 إجمالي الكمية", f"{df['كميته'].sum():,.0f}")
-                    with col3:
-                        if "كميته" in df.columns:
-                            st.metric("⚠️ منتجات قليلة", len(df[df["كميته"] < 100]))
-                    
-                    st.dataframe(df, use_container_width=True, height=400)
-                except Exception as e:
-                    st.error(f"❌ خطأ: {str(e)}")
+            if len(snapshots) > 1:
+                with st.expander("📈 تطور إجمالي المخزون"):
+                    history = pd.DataFrame(list(reversed(snapshots)))
+                    st.line_chart(history.set_index("imported_at")[["total_quantity", "low_stock_count"]])
         else:
             st.warning("⚠️ لا توجد ملفات جرد محفوظة. ارفع ملف Excel للبدء.")
     
@@ -1103,6 +1149,134 @@ def admin_dashboard():
                 st.info("💭 لا توجد نسخ احتياطية محفوظة")
         except Exception as e:
             st.error(f"❌ خطأ: {str(e)}")
+    
+    # إحصائيات الـ cache
+    with st.expander("⚡ إحصائيات الـ cache"):
+        from modules.cache import get_cache_stats, reset_cache_stats
+        cache_stats = get_cache_stats()
+        if cache_stats:
+            df_cache = pd.DataFrame(cache_stats).rename(columns={
+                "function": "الدالة",
+                "tags": "يعتمد على",
+                "calls": "الاستدعاءات",
+                "hits": "إصابات",
+                "misses": "إخفاقات",
+                "evictions": "إزالات",
+                "hit_rate": "نسبة الإصابة %"
+            })
+            st.dataframe(df_cache.round(1), use_container_width=True, hide_index=True)
+        else:
+            st.info("💭 لا توجد إحصائيات بعد")
+        if st.button("🔄 تصفير العدادات", key="reset_cache_stats"):
+            reset_cache_stats()
+            st.rerun()
+    
+    # cache ردود الذكاء الاصطناعي
+    with st.expander("🤖 cache ردود الذكاء الاصطناعي"):
+        from modules.llm_cache import clear_llm_cache, get_cache_stats as get_llm_cache_stats, get_latency_stats
+        try:
+            llm_stats = get_llm_cache_stats()
+            col_l1, col_l2, col_l3, col_l4 = st.columns(4)
+            with col_l1:
+                st.metric("📦 الردود المحفوظة", llm_stats['entries'])
+            with col_l2:
+                st.metric("🎯 نسبة الإصابة", f"{llm_stats['hit_rate']:.1f}%")
+            with col_l3:
+                st.metric("💰 Tokens موفّرة", f"{llm_stats['saved_tokens']:,}")
+            with col_l4:
+                st.metric("🔗 طلبات مدمجة", llm_stats['coalesced'])
+            latency = get_latency_stats()
+            if latency:
+                st.markdown("**⏱️ زمن الاستجابة (آخر 500 استدعاء، بالثواني)**")
+                df_latency = pd.DataFrame(latency).rename(columns={
+                    "model": "النموذج",
+                    "source": "المصدر",
+                    "calls": "الاستدعاءات",
+                    "cancelled": "أُوقفت",
+                    "ttft_p50": "أول كلمة (p50)",
+                    "ttft_p95": "أول كلمة (p95)",
+                    "elapsed_p50": "الإجمالي (p50)",
+                    "elapsed_p95": "الإجمالي (p95)"
+                })
+                st.dataframe(df_latency.round(2), use_container_width=True, hide_index=True)
+            if st.button("🗑️ مسح الردود المحفوظة", key="clear_llm_cache"):
+                clear_llm_cache(reset_stats=True)
+                st.rerun()
+        except Exception as e:
+            st.error(f"❌ خطأ: {str(e)}")
+    
+    # استهلاك الذكاء الاصطناعي وحصص المستخدمين
+    with st.expander("💰 استهلاك الذكاء الاصطناعي والحصص"):
+        from modules.llm_quota import (
+            DEFAULT_DAILY_TOKENS, get_bucket_state, get_daily_usage, get_spend, get_user_quota, set_user_quota,
+        )
+        try:
+            spend_groups = {
+                "المستخدم": "username",
+                "الميزة": "feature",
+                "المنتج": "product",
+                "المنصة": "platform",
+                "النموذج": "model",
+                "اليوم": "day"
+            }
+            col_s1, col_s2 = st.columns([2, 1])
+            with col_s1:
+                group_label = st.radio("📊 التجميع حسب:", list(spend_groups), horizontal=True, key="spend_group")
+            with col_s2:
+                spend_days = st.number_input("📅 آخر (يوم):", min_value=1, max_value=365, value=30, key="spend_days")
+            
+            spend = get_spend(spend_groups[group_label], days=int(spend_days))
+            if spend:
+                df_spend = pd.DataFrame(spend)
+                col_s1, col_s2, col_s3 = st.columns(3)
+                with col_s1:
+                    st.metric("💵 التكلفة", f"${df_spend['cost'].sum():,.4f}")
+                with col_s2:
+                    st.metric("🔢 Tokens", f"{int(df_spend['prompt_tokens'].sum() + df_spend['completion_tokens'].sum()):,}")
+                with col_s3:
+                    st.metric("📞 الاستدعاءات", int(df_spend['calls'].sum()))
+                df_spend = df_spend.rename(columns={
+                    spend_groups[group_label]: group_label,
+                    "calls": "الاستدعاءات",
+                    "prompt_tokens": "Tokens الطلب",
+                    "completion_tokens": "Tokens الرد",
+                    "cost": "التكلفة ($)",
+                    "avg_latency": "متوسط الزمن (ث)",
+                    "failed": "فشل / إيقاف"
+                })
+                st.dataframe(df_spend.round({"التكلفة ($)": 4, "متوسط الزمن (ث)": 2}),
+                             use_container_width=True, hide_index=True)
+            else:
+                st.info("💭 لا توجد استدعاءات في هذه الفترة")
+            
+            bucket = get_bucket_state()
+            if bucket['paused_for'] > 0:
+                st.warning(f"⏳ الطلبات متوقفة مؤقتاً ({bucket['paused_for']:.0f} ث) بعد 429 من OpenAI")
+            
+            st.markdown("**🎫 الحصص اليومية (tokens)**")
+            usage_today = get_daily_usage()
+            df_quota = pd.DataFrame([
+                {"المستخدم": username, "المستخدم اليوم": usage_today.get(username, 0), "الحصة": get_user_quota(username)}
+                for username in sorted(set(USERS) | set(usage_today))
+            ])
+            if not df_quota.empty:
+                st.dataframe(df_quota, use_container_width=True, hide_index=True)
+            
+            col_q1, col_q2, col_q3 = st.columns([2, 2, 1])
+            with col_q1:
+                quota_user = st.selectbox("👤 المستخدم:", sorted(USERS), key="quota_user")
+            with col_q2:
+                quota_value = st.number_input("الحصة اليومية:", min_value=0, step=10000,
+                                              value=get_user_quota(quota_user) if quota_user else DEFAULT_DAILY_TOKENS,
+                                              key=f"quota_value_{quota_user}")
+            with col_q3:
+                st.markdown("<br>", unsafe_allow_html=True)
+                if st.button("💾 حفظ", key="save_quota", disabled=not quota_user):
+                    set_user_quota(quota_user, None if quota_value == DEFAULT_DAILY_TOKENS else quota_value)
+                    st.success("✅ تم تحديث الحصة")
+                    st.rerun()
+        except Exception as e:
+            st.error(f"❌ خطأ: {str(e)}")
 
 # ============================================
 # 📅 صفحة تخطيط الحملات (محسَّنة ومتقدمة v5.1)
@@ -1827,8 +2001,7 @@ def monthly_revenue_tracking():
                 # إعادة ترتيب الأشهر (الأحدث أولاً)
                 revenue_data = {k: revenue_data[k] for k in sorted(revenue_data.keys(), reverse=True)}
                 
-                with open("revenue_data.json", "w", encoding="utf-8") as f:
-                    json.dump(revenue_data, f, ensure_ascii=False, indent=2)
+                save_json("revenue_data.json", revenue_data)
                 
                 st.success(f"✅ تم إضافة الشهر: {new_month_name}")
                 st.rerun()
@@ -1933,8 +2106,7 @@ def monthly_revenue_tracking():
                             "revenues": revenues_to_keep
                         }
                         
-                        with open("revenue_data.json", "w", encoding="utf-8") as f:
-                            json.dump(revenue_data, f, ensure_ascii=False, indent=2)
+                        save_json("revenue_data.json", revenue_data)
                         
                         st.success(f"✅ تم تحديث الشهر: {selected_month}")
                         st.rerun()
@@ -1943,8 +2115,7 @@ def monthly_revenue_tracking():
                     if st.button("🗑️ حذف الشهر", use_container_width=True, type="secondary"):
                         del revenue_data[selected_month]
                         
-                        with open("revenue_data.json", "w", encoding="utf-8") as f:
-                            json.dump(revenue_data, f, ensure_ascii=False, indent=2)
+                        save_json("revenue_data.json", revenue_data)
                         
                         st.warning(f"⚠️ تم حذف الشهر: {selected_month}")
                         st.rerun()
@@ -2018,38 +2189,25 @@ def create_moraselaty_campaign():
     """, unsafe_allow_html=True)
     
     # تحميل بيانات العملاء من SQLite أو JSON
-    try:
-        # محاولة التحميل من SQLite أولاً
-        from modules.database import get_all_orders
-        from datetime import datetime as dt
-        orders = get_all_orders()
-        last_updated = dt.now().strftime("%Y-%m-%d")
-    except Exception as e:
-        # إذا فشل، حاول التحميل من JSON
-        try:
-            if os.path.exists("moraselaty_customers.json"):
-                with open("moraselaty_customers.json", "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    orders = data.get("orders", [])
-                    last_updated = data.get("last_updated", datetime.datetime.now().strftime("%Y-%m-%d"))
-            else:
-                orders = []
-                last_updated = datetime.datetime.now().strftime("%Y-%m-%d")
-        except Exception as json_error:
-            st.error(f"❌ خطأ في تحميل بيانات العملاء: {json_error}")
-            orders = []
-            last_updated = datetime.datetime.now().strftime("%Y-%m-%d")
+    # الطلبات تُحمَّل من SQLite مرة واحدة كـ DataFrame (حتى يتغير جدول orders) وتُفلتر في الذاكرة؛
+    # جمهور الحملة المحفوظة يُحسب داخل قاعدة البيانات (materialize_segment)
+    from modules.database import get_last_change_time
+    from modules.segmentation import (
+        ensure_campaign_segment, filters_to_query, get_filter_options, is_legacy_campaign, load_orders_frame,
+        segment_metrics, segment_orders,
+    )
+    orders_frame = load_orders_frame()
+    overview = segment_metrics(orders_frame)
+    last_updated = get_last_change_time() or datetime.datetime.now().strftime("%Y-%m-%d")
     
     # إحصائيات سريعة (يتم تحديثها تلقائياً عند تحميل البيانات)
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("📊 إجمالي الطلبات", f"{len(orders):,}")
+        st.metric("📊 إجمالي الطلبات", f"{overview['total_customers']:,}")
     with col2:
-        unique_customers = len(set([o.get('رقم الهاتف', '') for o in orders if o.get('رقم الهاتف')]))
-        st.metric("👥 عدد العملاء", f"{unique_customers:,}")
+        st.metric("👥 عدد العملاء", f"{overview['unique_phones']:,}")
     with col3:
-        cities_count = len(set([o.get('المدينة', '') for o in orders if o.get('المدينة')]))
-        st.metric("🏙️ عدد المدن", f"{cities_count}")
+        st.metric("🏙️ عدد المدن", f"{overview['cities']}")
     with col4:
         st.metric("📅 آخر تحديث", last_updated.split()[0] if ' ' in last_updated else last_updated)
     
@@ -2062,50 +2220,63 @@ def create_moraselaty_campaign():
         st.markdown("### 📤 رفع ملف بيانات العملاء")
         st.info("💡 يمكنك رفع ملف Excel يحتوي على بيانات الطلبات. سيتم دمجها مع البيانات الموجودة مع منع التكرار.")
         
+        # تقرير آخر عملية دمج
+        last_report = st.session_state.pop('last_upload_report', None)
+        if last_report:
+            st.success(
+                f"🆕 جديد: {last_report['inserted']:,} | ✏️ محدّث: {last_report['updated']:,} | "
+                f"✔️ بدون تغيير: {last_report['unchanged']:,} | ⏭️ متجاهل: {last_report['skipped']:,}"
+            )
+        
         uploaded_file = st.file_uploader("اختر ملف Excel", type=['xlsx', 'xls'], key="moraselaty_upload")
         
         if uploaded_file:
             try:
-                df_new = pd.read_excel(uploaded_file)
+                from modules.ingest import count_excel_rows, ingest_orders_excel, preview_excel
                 
-                st.success(f"✅ تم قراءة {len(df_new)} طلب من الملف")
+                # المعاينة والعدد بدون قراءة الملف كاملاً
+                rows_count = count_excel_rows(uploaded_file)
+                if rows_count is not None:
+                    st.success(f"✅ الملف يحتوي على {rows_count:,} طلب تقريباً")
                 
                 # عرض عينة
                 with st.expander("👁️ معاينة البيانات (أول 5 صفوف)"):
-                    st.dataframe(df_new.head())
+                    st.dataframe(preview_excel(uploaded_file))
                 
                 if st.button("💾 حفظ ودمج البيانات", type="primary"):
-                    # دمج مع البيانات الموجودة
-                    df_existing = pd.DataFrame(orders)
-                    df_all = pd.concat([df_existing, df_new], ignore_index=True)
-                    
-                    # إزالة التكرار
-                    df_unique = df_all.drop_duplicates(subset=['رقم الطلب'], keep='first')
-                    df_unique = df_unique.fillna("")
-                    
-                    # حفظ في JSON
-                    customers_data_new = {
-                        "last_updated": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "total_orders": len(df_unique),
-                        "orders": df_unique.to_dict('records')
-                    }
-                    
-                    with open("moraselaty_customers.json", "w", encoding="utf-8") as f:
-                        json.dump(customers_data_new, f, ensure_ascii=False, indent=2)
-                    
-                    # حفظ في SQLite أيضاً
-                    try:
-                        from modules.database import save_orders
-                        save_orders(df_unique.to_dict('records'))
-                    except Exception as db_error:
-                        # إذا فشل الحفظ في SQLite، لا بأس لأن البيانات محفوظة في JSON
-                        pass
+                    # الدمج ومنع التكرار حسب رقم الطلب داخل SQLite على دفعات
+                    progress_bar = st.progress(0.0, text="⏳ جارٍ حفظ الطلبات...")
+                    report = ingest_orders_excel(
+                        uploaded_file,
+                        progress_callback=lambda done, total: progress_bar.progress(
+                            min(done / total, 1.0) if total else 1.0,
+                            text=f"⏳ تمت معالجة {done:,} / {total:,}"
+                        )
+                    )
                     
-                    st.success(f"✅ تم الدمج بنجاح! الإجمالي الآن: {len(df_unique)} طلب")
-                    st.rerun()
+                    if report is not None:
+                        from modules.database import get_orders_count, refresh_segments
+                        # جماهير الحملات المحفوظة: إعادة فحص الطلبات المتغيرة فقط
+                        refresh_segments()
+                        st.success(f"✅ تم الدمج بنجاح! الإجمالي الآن: {get_orders_count()} طلب")
+                        st.session_state.last_upload_report = report
+                        st.rerun()
                     
             except Exception as e:
                 st.error(f"❌ خطأ في قراءة الملف: {str(e)}")
+        
+        # تصدير JSON اختياري: يُعاد توليده فقط إذا تغيرت الطلبات منذ آخر تصدير
+        with st.expander("📦 تصدير الطلبات (JSON)"):
+            if st.button("🔄 تجهيز ملف JSON", key="moraselaty_export_json"):
+                from modules.ingest import ensure_orders_json_export
+                with st.spinner("⏳ جارٍ التصدير..."):
+                    regenerated = ensure_orders_json_export("moraselaty_customers.json")
+                st.success("✅ تم تحديث الملف" if regenerated else "✔️ الملف محدّث بالفعل")
+            
+            if os.path.exists("moraselaty_customers.json"):
+                with open("moraselaty_customers.json", "rb") as f:
+                    st.download_button("📥 تحميل moraselaty_customers.json", f,
+                                       file_name="moraselaty_customers.json", mime="application/json")
     
     with tab2:
         st.markdown("### 🎯 إنشاء حملة جديدة")
@@ -2116,6 +2287,7 @@ def create_moraselaty_campaign():
         st.markdown("#### 🔍 تحديد العملاء المستهدفين")
         
         # الفلاتر
+        filter_options = get_filter_options(orders_frame)
         col_f1, col_f2 = st.columns(2)
         
         # تهيئة المتغيرات لتجنب UnboundLocalError
@@ -2143,7 +2315,7 @@ def create_moraselaty_campaign():
         
         with col_f2:
             st.markdown("##### 🏙️ المدينة")
-            cities = sorted(set([o.get('المدينة', '') for o in orders if o.get('المدينة')]))
+            cities = filter_options['cities']
             city_filter = st.multiselect(
                 "اختر المدن:",
                 ["كامل السعودية"] + cities,
@@ -2155,7 +2327,7 @@ def create_moraselaty_campaign():
         
         with col_f3:
             st.markdown("##### 📦 حالة الطلب")
-            statuses = sorted(set([o.get('حالة الطلب', '') for o in orders if o.get('حالة الطلب')]))
+            statuses = filter_options['statuses']
             status_filter = st.multiselect(
                 "اختر الحالات:",
                 ["الكل"] + statuses,
@@ -2165,7 +2337,7 @@ def create_moraselaty_campaign():
         
         with col_f4:
             st.markdown("##### 💳 طريقة الدفع")
-            payments = sorted(set([o.get(' طريقة الدفع', '') for o in orders if o.get(' طريقة الدفع')]))
+            payments = filter_options['payments']
             payment_filter = st.multiselect(
                 "اختر طرق الدفع:",
                 ["الكل"] + payments,
@@ -2175,30 +2347,20 @@ def create_moraselaty_campaign():
         
         # تطبيق الفلاتر
         if st.button("🔍 تطبيق الفلاتر وعرض النتائج", type="primary", use_container_width=True):
-            filtered_orders = orders.copy()
-            
-            # فلتر السعر
-            if price_filter_type == "أكثر من":
-                filtered_orders = [o for o in filtered_orders if float(o.get('المبلغ الاجمالي', 0) or 0) > min_price]
-            elif price_filter_type == "أقل من":
-                filtered_orders = [o for o in filtered_orders if float(o.get('المبلغ الاجمالي', 0) or 0) < max_price]
-            elif price_filter_type == "بين":
-                filtered_orders = [o for o in filtered_orders if min_price <= float(o.get('المبلغ الاجمالي', 0) or 0) <= max_price]
-            
-            # فلتر المدينة
-            if "كامل السعودية" not in city_filter:
-                filtered_orders = [o for o in filtered_orders if o.get('المدينة', '') in city_filter]
-            
-            # فلتر الحالة
-            if "الكل" not in status_filter:
-                filtered_orders = [o for o in filtered_orders if o.get('حالة الطلب', '') in status_filter]
-            
-            # فلتر طريقة الدفع
-            if "الكل" not in payment_filter:
-                filtered_orders = [o for o in filtered_orders if o.get(' طريقة الدفع', '') in payment_filter]
+            segment = segment_orders(
+                orders_frame,
+                min_amount=min_price if price_filter_type in ("أكثر من", "بين") else None,
+                max_amount=max_price if price_filter_type in ("أقل من", "بين") else None,
+                inclusive=price_filter_type == "بين",
+                cities=None if "كامل السعودية" in city_filter else city_filter,
+                statuses=None if "الكل" in status_filter else status_filter,
+                payments=None if "الكل" in payment_filter else payment_filter,
+            )
+            filtered_orders = segment['contacts']
             
             # حفظ في session_state
             st.session_state.filtered_customers = filtered_orders
+            st.session_state.filtered_metrics = segment['metrics']
             
             st.success(f"✅ تم العثور على {len(filtered_orders)} عميل مطابق للفلاتر!")
         
@@ -2212,20 +2374,17 @@ def create_moraselaty_campaign():
             st.markdown("---")
             st.markdown(f"### 📊 النتائج: {len(filtered)} عميل")
             
-            # إحصائيات
+            # إحصائيات (محسوبة مع الفلترة)
+            metrics = st.session_state.get('filtered_metrics') or {}
             col_s1, col_s2, col_s3, col_s4 = st.columns(4)
             with col_s1:
-                total_value = sum([float(o.get('المبلغ الاجمالي', 0) or 0) for o in filtered])
-                st.metric("💰 إجمالي القيمة", f"{total_value:,.0f} ر.س")
+                st.metric("💰 إجمالي القيمة", f"{metrics.get('total_value', 0):,.0f} ر.س")
             with col_s2:
-                unique_phones = len(set([o.get('رقم الهاتف', '') for o in filtered if o.get('رقم الهاتف')]))
-                st.metric("📱 أرقام فريدة", f"{unique_phones:,}")
+                st.metric("📱 أرقام فريدة", f"{metrics.get('unique_phones', 0):,}")
             with col_s3:
-                avg_order = total_value / len(filtered) if filtered else 0
-                st.metric("📊 متوسط الطلب", f"{avg_order:,.0f} ر.س")
+                st.metric("📊 متوسط الطلب", f"{metrics.get('avg_order', 0):,.0f} ر.س")
             with col_s4:
-                cities_in_result = len(set([o.get('المدينة', '') for o in filtered if o.get('المدينة')]))
-                st.metric("🏙️ المدن", f"{cities_in_result}")
+                st.metric("🏙️ المدن", f"{metrics.get('cities', 0)}")
             
             # عرض الجدول
             with st.expander("👁️ عرض تفاصيل العملاء"):
@@ -2254,36 +2413,30 @@ def create_moraselaty_campaign():
                 elif not campaign_message:
                     st.error("❌ يرجى كتابة نص الرسالة!")
                 else:
-                    # تحميل الحملات الموجودة
-                    try:
-                        with open("moraselaty_campaigns.json", "r", encoding="utf-8") as f:
-                            campaigns_data = json.load(f)
-                    except:
-                        campaigns_data = {"campaigns": []}
-                    
-                    # إنشاء الحملة
+                    # إنشاء الحملة (المعرّف يُحدد عند الحفظ داخل القفل)
                     new_campaign = {
-                        "id": len(campaigns_data["campaigns"]) + 1,
                         "name": campaign_name,
                         "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                         "created_by": st.session_state.username,
                         "message": campaign_message,
                         "filters": {
                             "price_type": price_filter_type,
+                            "min_price": min_price,
+                            "max_price": max_price,
                             "cities": city_filter,
                             "statuses": status_filter,
                             "payments": payment_filter
                         },
                         "total_customers": len(filtered),
-                        "unique_phones": unique_phones,
-                        "total_value": total_value,
-                        "customers": filtered
+                        "unique_phones": metrics.get('unique_phones', 0),
+                        "total_value": metrics.get('total_value', 0)
                     }
                     
-                    campaigns_data["campaigns"].append(new_campaign)
-                    
-                    with open("moraselaty_campaigns.json", "w", encoding="utf-8") as f:
-                        json.dump(campaigns_data, f, ensure_ascii=False, indent=2)
+                    # قائمة العملاء تُحفظ في SQLite (campaign_members) بدلاً من ملف JSON
+                    campaign_id = append_moraselaty_campaign(new_campaign)
+                    if campaign_id is not None:
+                        from modules.database import materialize_segment
+                        materialize_segment(campaign_id, query=filters_to_query(new_campaign["filters"]))
                     
                     st.success(f"✅ تم حفظ الحملة: {campaign_name}")
                     st.balloons()
@@ -2294,15 +2447,50 @@ def create_moraselaty_campaign():
         st.markdown("### 📋 الحملات السابقة")
         
         try:
-            with open("moraselaty_campaigns.json", "r", encoding="utf-8") as f:
-                campaigns_data = json.load(f)
-            campaigns = campaigns_data.get("campaigns", [])
+            campaigns = get_snapshot("moraselaty_campaigns.json", {}).get("campaigns", [])
         except:
             campaigns = []
         
         if not campaigns:
             st.info("📭 لا توجد حملات محفوظة بعد.")
         else:
+            from modules.database import get_segment_overlap, get_segments_info, refresh_segment
+            
+            # الجماهير المحفوظة باستعلام واحد؛ التحديث عند رفع الطلبات (refresh_segments) أو عند الطلب
+            segments_info = get_segments_info()
+            # جمهور حملة قديمة بُني من الفلاتر يحتاج إعادة بناء من القائمة المحفوظة
+            for c in campaigns:
+                if c['id'] in segments_info and is_legacy_campaign(c) and segments_info[c['id']]['filters'] is not None:
+                    del segments_info[c['id']]
+            audience_campaigns = {c['id']: c['name'] for c in campaigns if c['id'] in segments_info}
+            missing_audience = [c for c in campaigns if c['id'] not in segments_info
+                                and (c.get('filters') is not None or c.get('customers'))]
+            if missing_audience:
+                if st.button(f"🎯 تجهيز جمهور {len(missing_audience)} حملة (للتداخل والتصدير)", key="prepare_segments"):
+                    with st.spinner("جاري تجهيز الجمهور..."):
+                        for campaign in missing_audience:
+                            ensure_campaign_segment(campaign)
+                    st.rerun()
+            
+            # التداخل بين جمهوري حملتين (حسب رقم الجوال)
+            if len(audience_campaigns) >= 2:
+                with st.expander("🔀 التداخل بين الحملات"):
+                    ids = list(audience_campaigns)
+                    col_o1, col_o2 = st.columns(2)
+                    with col_o1:
+                        campaign_a = st.selectbox("الحملة الأولى", ids, format_func=audience_campaigns.get, key="overlap_a")
+                    with col_o2:
+                        campaign_b = st.selectbox("الحملة الثانية", ids, index=1, format_func=audience_campaigns.get, key="overlap_b")
+                    # تحديث الحملتين المختارتين فقط (لا شيء إن لم تتغير الطلبات)
+                    refresh_segment(campaign_a)
+                    refresh_segment(campaign_b)
+                    overlap = get_segment_overlap(campaign_a, campaign_b)
+                    col_o1, col_o2, col_o3 = st.columns(3)
+                    col_o1.metric("📱 أرقام مشتركة", f"{overlap['shared']:,}")
+                    col_o2.metric("📱 الأولى فقط", f"{overlap['a'] - overlap['shared']:,}")
+                    col_o3.metric("📱 الثانية فقط", f"{overlap['b'] - overlap['shared']:,}")
+                    st.caption(f"نسبة التشابه: {overlap['jaccard']:.1%}")
+            
             for campaign in reversed(campaigns):
                 with st.expander(f"📱 {campaign['name']} - {campaign['created_at'].split()[0]}"):
                     col_c1, col_c2 = st.columns([2, 1])
@@ -2313,19 +2501,33 @@ def create_moraselaty_campaign():
                         st.markdown(f"**👥 العملاء:** {campaign['total_customers']:,}")
                         st.markdown(f"**📱 أرقام فريدة:** {campaign['unique_phones']:,}")
                         st.markdown(f"**💰 إجمالي القيمة:** {campaign['total_value']:,.0f} ر.س")
+                        if campaign['id'] in segments_info:
+                            st.markdown(f"**🎯 الجمهور الحالي:** {segments_info[campaign['id']]['members_count']:,} طلب")
                     
                     with col_c2:
-                        if st.button("📥 تصدير Excel", key=f"export_{campaign['id']}"):
-                            # تصدير عمودين فقط: اسم العميل ورقم الجوال
-                            df_export = pd.DataFrame(campaign['customers'])
-                            df_export_filtered = df_export[['اسم العميل', 'رقم الهاتف']].copy()
-                            df_export_filtered.columns = ['اسم العميل', 'رقم الجوال']
-                            st.download_button(
-                                "⬇️ تحميل",
-                                df_export_filtered.to_csv(index=False, encoding='utf-8-sig'),
-                                f"campaign_{campaign['id']}_contacts.csv",
-                                "text/csv"
-                            )
+                        # الملف يُولَّد عند الطلب فقط (عمودان: اسم العميل ورقم الجوال)
+                        export_key = f"export_path_{campaign['id']}"
+                        export_format = st.radio(
+                            "الصيغة", list(EXPORT_FORMATS), horizontal=True,
+                            key=f"export_format_{campaign['id']}"
+                        )
+                        if st.button("📥 تصدير جهات الاتصال", key=f"export_{campaign['id']}"):
+                            with st.spinner("جاري تجهيز الملف..."):
+                                try:
+                                    st.session_state[export_key] = export_campaign_contacts(campaign, export_format)
+                                except Exception as e:
+                                    st.error(f"⚠️ فشل التصدير: {e}")
+                        
+                        export_path = st.session_state.get(export_key)
+                        if export_path and export_path.endswith(f".{export_format}") and os.path.exists(export_path):
+                            with open(export_path, "rb") as export_file:
+                                st.download_button(
+                                    "⬇️ تحميل",
+                                    export_file,
+                                    f"campaign_{campaign['id']}_contacts.{export_format}",
+                                    EXPORT_FORMATS[export_format],
+                                    key=f"download_{campaign['id']}"
+                                )
                     
                     st.markdown("**✍️ نص الرسالة:**")
                     st.text_area("", campaign['message'], height=100, key=f"msg_{campaign['id']}", disabled=True)
@@ -2334,14 +2536,8 @@ def create_moraselaty_campaign():
         st.markdown("### ✍️ إنشاء حملة تسويقية بالذكاء الاصطناعي")
         st.info("🤖 سيتم استخدام ChatGPT لإعادة صياغة فكرتك بشكل احترافي ومختصر")
         
-        # تحميل قائمة المنتجات
-        try:
-            with open("options.json", "r", encoding="utf-8") as f:
-                options_data = json.load(f)
-            products_list = options_data.get("product", [])
-        except:
-            products_list = []
-            st.error("❌ خطأ في تحميل قائمة المنتجات")
+        # قائمة المنتجات
+        products_list = OPTIONS.get("product", [])
         
         st.markdown("#### 1️⃣ اختر المنتجات المشاركة")
         selected_products = st.multiselect(
@@ -2426,17 +2622,19 @@ def create_moraselaty_campaign():
                         
                         # استدعاء API
                         client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-                        response = client.chat.completions.create(
-                            model="gpt-4-turbo",
-                            messages=[
+                        response = cached_chat(
+                            [
                                 {"role": "system", "content": "أنت مسوق محترف لمنتجات العناية والتجميل."},
                                 {"role": "user", "content": prompt}
                             ],
+                            model="gpt-4-turbo",
                             temperature=0.7,
-                            max_tokens=500
+                            max_tokens=500,
+                            client=client,
+                            context={"user": st.session_state.user, "feature": "حملة مراسلاتي"}
                         )
                         
-                        generated_text = response.choices[0].message.content.strip()
+                        generated_text = response['content']
                         
                         # بناء النص النهائي
                         final_text = "أرجو اعتماد الحملة التالية من ميتا وتجهيزها:\n\n"
@@ -2459,6 +2657,8 @@ def create_moraselaty_campaign():
                         
                         st.success("✅ تم توليد النص بنجاح!")
                         
+                    except QuotaExceeded as e:
+                        st.warning(str(e))
                     except Exception as e:
                         st.error(f"❌ خطأ في توليد النص: {str(e)}")
                         st.info("💡 تأكد من إعداد OPENAI_API_KEY في secrets.toml")
@@ -2484,14 +2684,7 @@ def create_moraselaty_campaign():
             with col_action2:
                 if st.button("💾 حفظ كحملة", type="primary", use_container_width=True):
                     # حفظ الحملة التسويقية
-                    try:
-                        with open("moraselaty_campaigns.json", "r", encoding="utf-8") as f:
-                            campaigns_data = json.load(f)
-                    except:
-                        campaigns_data = {"campaigns": []}
-                    
                     new_campaign = {
-                        "id": len(campaigns_data["campaigns"]) + 1,
                         "name": f"حملة تسويقية - {datetime.datetime.now().strftime('%Y-%m-%d')}",
                         "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                         "created_by": st.session_state.get('username', 'مجهول'),
@@ -2504,10 +2697,7 @@ def create_moraselaty_campaign():
                         "message": st.session_state.get('generated_campaign_text', '')
                     }
                     
-                    campaigns_data["campaigns"].append(new_campaign)
-                    
-                    with open("moraselaty_campaigns.json", "w", encoding="utf-8") as f:
-                        json.dump(campaigns_data, f, ensure_ascii=False, indent=2)
+                    append_moraselaty_campaign(new_campaign)
                     
                     st.success("✅ تم حفظ الحملة التسويقية بنجاح!")
                     st.balloons()
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+fixtures مشتركة بين ملفات الاختبار
+"""
+
+import json
+
+import pytest
+
+from modules.pricing_engine import catalogue_frame
+
+
+@pytest.fixture
+def frame():
+    """كتالوج products_pricing.json كـ DataFrame مع تكاليف مختلفة (بعضها أعلى من السعر)"""
+    with open('products_pricing.json', 'r', encoding='utf-8') as f:
+        products = json.load(f)
+    # تكلفة معروفة لبعض المنتجات، والباقي بالتكلفة الافتراضية
+    costs = {name: product['after_code'] * ratio
+             for (name, product), ratio in zip(products.items(), [0.3, 0.6, 0.8, 0.95, 1.1] * len(products))
+             if ratio != 0.6}
+    return catalogue_frame(products, costs)
@@ -19,6 +19,10 @@ def create_database():
     if os.path.exists(db_path):
         os.remove(db_path)
         print(f"✅ تم حذف قاعدة البيانات القديمة")
+    # ملفات WAL المرافقة (journal_mode=WAL) لا يجب أن تبقى مع قاعدة جديدة
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
     
     # إنشاء الاتصال
     conn = sqlite3.connect(db_path)
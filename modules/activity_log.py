@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة سجل النشاط (السيناريوهات ورسائل الإدارة)
+Argan Smart Generator
+
+بديل user_logs.json: كل سجل صف في جدول activity_logs، فالإضافة O(1) بدلاً من
+إعادة كتابة الملف كاملاً، والتعديل والحذف بالمعرّف (id) داخل معاملة بدلاً من
+البحث الخطي في القائمة، ولا تطغى جلستان متزامنتان على تعديلات بعضهما.
+"""
+
+import json
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import streamlit as st
+
+from modules.cache import invalidate, tagged_cache
+from modules.connection import get_connection
+
+
+DB_PATH = 'database/activity.db'
+LEGACY_JSON_PATH = 'user_logs.json'
+
+ADMIN_MESSAGE_STATUS = 'رسالة من الأدمن'
+NO_CAMPAIGN = 'لا توجد حملة'
+
+LOG_FIELDS = ['user', 'product', 'scenario', 'platform', 'timestamp', 'status', 'note', 'campaign']
+
+# الحقول القابلة للتعديل بعد الإنشاء
+UPDATABLE_FIELDS = {'status', 'campaign', 'note'}
+
+
+def ensure_activity_schema(conn: sqlite3.Connection):
+    """إنشاء جدول activity_logs وفهارسه، ونقل user_logs.json مرة واحدة إن كان الجدول جديداً"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'activity_logs'")
+    exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS activity_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user TEXT NOT NULL,
+            product TEXT,
+            scenario TEXT,
+            platform TEXT,
+            timestamp TEXT NOT NULL,
+            status TEXT,
+            note TEXT,
+            campaign TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_user ON activity_logs(user, timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_timestamp ON activity_logs(timestamp)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_campaign ON activity_logs(campaign)')
+    _ensure_user_stats(cursor)
+    conn.commit()
+
+    if not exists and os.path.exists(LEGACY_JSON_PATH):
+        migrate_from_json(LEGACY_JSON_PATH, conn)
+
+
+# السجل "سيناريو" إذا لم يكن رسالة من الأدمن، ويُحسب ضمن حملة إذا كان له حملة
+_IS_SCRIPT = "{row}.status IS NOT '" + ADMIN_MESSAGE_STATUS + "'"
+_IS_MESSAGE = "{row}.status IS '" + ADMIN_MESSAGE_STATUS + "'"
+_HAS_CAMPAIGN = "{row}.campaign IS NOT NULL AND {row}.campaign <> '" + NO_CAMPAIGN + "'"
+
+
+def _user_stats_upsert_sql(row: str, sign: str) -> str:
+    """تعديل عدادات المستخدم بسجل واحد (sign = '+' للإضافة و '-' للإزالة)"""
+    is_script = _IS_SCRIPT.format(row=row)
+    is_message = _IS_MESSAGE.format(row=row)
+    if sign == '-':
+        return f'''
+            UPDATE user_activity_stats
+            SET scripts_count = scripts_count - ({is_script}),
+                messages_count = messages_count - ({is_message})
+            WHERE user = {row}.user;
+        '''
+    # السجل الجديد له أكبر id، فهو آخر سيناريو للمستخدم
+    return f'''
+        INSERT INTO user_activity_stats
+            (user, scripts_count, messages_count, last_activity, last_script_at, last_product)
+        VALUES (
+            {row}.user, {is_script}, {is_message}, {row}.timestamp,
+            CASE WHEN {is_script} THEN {row}.timestamp END,
+            CASE WHEN {is_script} THEN {row}.product END
+        )
+        ON CONFLICT(user) DO UPDATE SET
+            scripts_count = scripts_count + excluded.scripts_count,
+            messages_count = messages_count + excluded.messages_count,
+            last_activity = MAX(COALESCE(last_activity, ''), excluded.last_activity),
+            last_script_at = COALESCE(excluded.last_script_at, last_script_at),
+            last_product = CASE WHEN excluded.scripts_count THEN excluded.last_product ELSE last_product END;
+    '''
+
+
+def _user_campaign_upsert_sql(row: str, sign: str) -> str:
+    """تعديل عدد سيناريوهات المستخدم في حملة واحدة"""
+    condition = f"{_IS_SCRIPT.format(row=row)} AND {_HAS_CAMPAIGN.format(row=row)}"
+    return f'''
+        INSERT INTO user_campaign_stats (user, campaign, scripts_count)
+        SELECT {row}.user, {row}.campaign, {sign}1 WHERE {condition}
+        ON CONFLICT(user, campaign) DO UPDATE SET scripts_count = scripts_count {sign} 1;
+        DELETE FROM user_campaign_stats
+        WHERE user = {row}.user AND campaign IS {row}.campaign AND scripts_count <= 0;
+    '''
+
+
+def _user_stats_recompute_sql(user: str) -> str:
+    """
+    إعادة حساب آخر نشاط وآخر سيناريو لمستخدم واحد (بعد حذف أو تعديل)
+
+    لا يمكن طرح "آخر" قيمة كما تُطرح العدادات، لذلك تُقرأ من فهرس المستخدم.
+    """
+    is_script = _IS_SCRIPT.format(row='activity_logs')
+    latest_script = f'''
+        FROM activity_logs WHERE activity_logs.user = {user} AND {is_script}
+        ORDER BY activity_logs.id DESC LIMIT 1
+    '''
+    return f'''
+        UPDATE user_activity_stats SET
+            last_activity = (SELECT MAX(timestamp) FROM activity_logs WHERE activity_logs.user = {user}),
+            last_script_at = (SELECT timestamp {latest_script}),
+            last_product = (SELECT product {latest_script})
+        WHERE user = {user};
+        DELETE FROM user_activity_stats
+        WHERE user = {user} AND scripts_count <= 0 AND messages_count <= 0;
+    '''
+
+
+def _ensure_user_stats(cursor: sqlite3.Cursor):
+    """
+    إنشاء جداول إحصائيات المستخدمين والـ triggers التي تحدّثها
+
+    user_activity_stats: صف لكل مستخدم (العدادات وآخر نشاط وآخر منتج)
+    user_campaign_stats: عدد سيناريوهات كل مستخدم في كل حملة (لعدد الحملات)
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_activity_stats'")
+    created = cursor.fetchone() is None
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_activity_stats (
+            user TEXT PRIMARY KEY,
+            scripts_count INTEGER NOT NULL DEFAULT 0,
+            messages_count INTEGER NOT NULL DEFAULT 0,
+            last_activity TEXT,
+            last_script_at TEXT,
+            last_product TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_campaign_stats (
+            user TEXT NOT NULL,
+            campaign TEXT NOT NULL,
+            scripts_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user, campaign)
+        )
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_activity_stats_insert AFTER INSERT ON activity_logs
+        BEGIN
+            {_user_stats_upsert_sql('new', '+')}
+            {_user_campaign_upsert_sql('new', '+')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_activity_stats_delete AFTER DELETE ON activity_logs
+        BEGIN
+            {_user_stats_upsert_sql('old', '-')}
+            {_user_campaign_upsert_sql('old', '-')}
+            {_user_stats_recompute_sql('old.user')}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_activity_stats_update
+        AFTER UPDATE OF user, product, timestamp, status, campaign ON activity_logs
+        BEGIN
+            {_user_stats_upsert_sql('old', '-')}
+            {_user_campaign_upsert_sql('old', '-')}
+            {_user_stats_upsert_sql('new', '+')}
+            {_user_campaign_upsert_sql('new', '+')}
+            {_user_stats_recompute_sql('old.user')}
+            {_user_stats_recompute_sql('new.user')}
+        END
+    ''')
+
+    if created:
+        _rebuild_user_stats(cursor)
+
+
+def _rebuild_user_stats(cursor: sqlite3.Cursor):
+    """إعادة بناء جداول إحصائيات المستخدمين بالكامل من activity_logs"""
+    is_script = _IS_SCRIPT.format(row='activity_logs')
+    is_message = _IS_MESSAGE.format(row='activity_logs')
+    has_campaign = _HAS_CAMPAIGN.format(row='activity_logs')
+
+    cursor.execute('DELETE FROM user_activity_stats')
+    cursor.execute(f'''
+        INSERT INTO user_activity_stats (user, scripts_count, messages_count, last_activity)
+        SELECT user, SUM({is_script}), SUM({is_message}), MAX(timestamp)
+        FROM activity_logs
+        GROUP BY user
+    ''')
+    # آخر سيناريو لكل مستخدم = أكبر id بين سيناريوهاته
+    cursor.execute(f'''
+        WITH latest AS (
+            SELECT user, MAX(id) AS id FROM activity_logs WHERE {is_script} GROUP BY user
+        )
+        UPDATE user_activity_stats
+        SET last_script_at = activity_logs.timestamp, last_product = activity_logs.product
+        FROM latest JOIN activity_logs ON activity_logs.id = latest.id
+        WHERE user_activity_stats.user = latest.user
+    ''')
+
+    cursor.execute('DELETE FROM user_campaign_stats')
+    cursor.execute(f'''
+        INSERT INTO user_campaign_stats (user, campaign, scripts_count)
+        SELECT user, campaign, COUNT(*)
+        FROM activity_logs
+        WHERE {is_script} AND {has_campaign}
+        GROUP BY user, campaign
+    ''')
+
+
+def get_db_connection() -> sqlite3.Connection:
+    """اتصال الـ thread الحالي بقاعدة بيانات سجل النشاط"""
+    return get_connection(DB_PATH, ensure_activity_schema)
+
+
+def migrate_from_json(path: str = LEGACY_JSON_PATH, conn: Optional[sqlite3.Connection] = None) -> int:
+    """
+    نقل السجلات من ملف JSON القديم (قائمة قواميس) إلى الجدول
+
+    يُنفَّذ تلقائياً عند إنشاء الجدول لأول مرة، ولا يُعيد النقل إن كان الجدول
+    يحتوي سجلات بالفعل.
+
+    Returns:
+        عدد السجلات المنقولة
+    """
+    conn = conn or get_db_connection()
+    if conn.execute('SELECT 1 FROM activity_logs LIMIT 1').fetchone():
+        return 0
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            logs = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"خطأ في قراءة {path}: {e}")
+        return 0
+
+    rows = [
+        tuple((log.get(field) or '') if field == 'timestamp' else log.get(field) for field in LOG_FIELDS)
+        for log in logs
+        if isinstance(log, dict) and log.get('user')
+    ]
+    with conn:
+        conn.executemany(
+            f"INSERT INTO activity_logs ({', '.join(LOG_FIELDS)}) VALUES ({', '.join('?' * len(LOG_FIELDS))})",
+            rows
+        )
+    invalidate('activity_logs')
+    return len(rows)
+
+
+def append_log(user: str, product: str = '-', scenario: str = '-', platform: str = '-',
+               status: str = 'جديد', note: str = '', campaign: str = NO_CAMPAIGN,
+               timestamp: Optional[str] = None) -> Optional[int]:
+    """
+    إضافة سجل جديد
+
+    Returns:
+        معرّف السجل، أو None عند الفشل
+    """
+    timestamp = timestamp or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_db_connection()
+    try:
+        with conn:
+            cursor = conn.execute(
+                f"INSERT INTO activity_logs ({', '.join(LOG_FIELDS)}) VALUES ({', '.join('?' * len(LOG_FIELDS))})",
+                (user, product, scenario, platform, timestamp, status, note, campaign)
+            )
+        invalidate('activity_logs')
+        return cursor.lastrowid
+    except Exception as e:
+        st.error(f"⚠️ فشل حفظ السجل: {e}")
+        return None
+
+
+def _build_filter(user: Optional[str] = None, status: Optional[str] = None,
+                  exclude_status: Optional[str] = None, campaign: Optional[str] = None,
+                  date: Optional[str] = None):
+    """بناء جملة WHERE (date = بادئة التاريخ مثل '2025-10-15')"""
+    conditions, params = [], []
+    if user is not None:
+        conditions.append('user = ?')
+        params.append(user)
+    if status is not None:
+        conditions.append('status = ?')
+        params.append(status)
+    if exclude_status is not None:
+        conditions.append('status IS NOT ?')
+        params.append(exclude_status)
+    if campaign is not None:
+        conditions.append('campaign = ?')
+        params.append(campaign)
+    if date is not None:
+        # نطاق بدلاً من LIKE حتى يُستخدم فهرس timestamp
+        conditions.append('timestamp >= ? AND timestamp < ?')
+        params.extend([date, date + '\uffff'])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return where, params
+
+
+@tagged_cache('activity_logs', ttl=300)
+def get_logs(user: Optional[str] = None, status: Optional[str] = None,
+             exclude_status: Optional[str] = None, campaign: Optional[str] = None,
+             date: Optional[str] = None, limit: Optional[int] = None,
+             newest_first: bool = False) -> List[Dict]:
+    """
+    جلب السجلات المطابقة (بنفس مفاتيح user_logs.json + id)
+
+    Args:
+        user: اسم المستخدم
+        status / exclude_status: حالة مطلوبة / مستبعدة (مثل ADMIN_MESSAGE_STATUS)
+        campaign: اسم الحملة
+        date: بادئة التاريخ 'YYYY-MM-DD'
+        limit: الحد الأقصى للنتائج
+        newest_first: الأحدث أولاً (الافتراضي: بترتيب الإضافة كما في JSON)
+    """
+    where, params = _build_filter(user, status, exclude_status, campaign, date)
+    order = 'DESC' if newest_first else 'ASC'
+    sql = f"SELECT id, {', '.join(LOG_FIELDS)} FROM activity_logs {where} ORDER BY id {order}"
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    try:
+        cursor = get_db_connection().execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    except Exception as e:
+        st.error(f"⚠️ خطأ في قراءة سجل النشاط: {e}")
+        return []
+
+
+@tagged_cache('activity_logs', ttl=300)
+def count_logs(user: Optional[str] = None, status: Optional[str] = None,
+               exclude_status: Optional[str] = None, campaign: Optional[str] = None,
+               date: Optional[str] = None) -> int:
+    """عدد السجلات المطابقة (نفس فلاتر get_logs)"""
+    where, params = _build_filter(user, status, exclude_status, campaign, date)
+    try:
+        return get_db_connection().execute(f'SELECT COUNT(*) FROM activity_logs {where}', params).fetchone()[0]
+    except Exception as e:
+        st.error(f"⚠️ خطأ في قراءة سجل النشاط: {e}")
+        return 0
+
+
+def update_log(log_id: int, **fields) -> bool:
+    """
+    تعديل status / campaign / note لسجل واحد بمعرّفه
+
+    Example:
+        update_log(12, campaign='حملة رمضان')
+    """
+    invalid = set(fields) - UPDATABLE_FIELDS
+    if invalid or not fields:
+        st.error(f"⚠️ حقول غير قابلة للتعديل: {sorted(invalid)}")
+        return False
+
+    assignments = ', '.join(f'{field} = ?' for field in fields)
+    conn = get_db_connection()
+    try:
+        with conn:
+            cursor = conn.execute(f'UPDATE activity_logs SET {assignments} WHERE id = ?',
+                                  (*fields.values(), log_id))
+        invalidate('activity_logs')
+        return cursor.rowcount == 1
+    except Exception as e:
+        st.error(f"⚠️ فشل تعديل السجل: {e}")
+        return False
+
+
+def delete_log(log_id: int) -> bool:
+    """حذف سجل واحد بمعرّفه"""
+    conn = get_db_connection()
+    try:
+        with conn:
+            cursor = conn.execute('DELETE FROM activity_logs WHERE id = ?', (log_id,))
+        invalidate('activity_logs')
+        return cursor.rowcount == 1
+    except Exception as e:
+        st.error(f"⚠️ فشل حذف السجل: {e}")
+        return False
+
+
+_EMPTY_USER_STATS = {
+    'scripts_count': 0,
+    'messages_count': 0,
+    'campaigns_count': 0,
+    'last_activity': None,
+    'last_script_at': None,
+    'last_product': None,
+}
+
+
+@tagged_cache('activity_logs', ttl=300)
+def get_all_user_stats() -> Dict[str, Dict]:
+    """
+    إحصائيات كل المستخدمين في استعلام واحد (لجدول نشاط المستخدمين)
+
+    Returns:
+        {user: {'scripts_count', 'messages_count', 'campaigns_count',
+                'last_activity', 'last_script_at', 'last_product'}}
+        last_activity يشمل رسائل الأدمن، و last_script_at / last_product للسيناريوهات فقط
+    """
+    try:
+        cursor = get_db_connection().execute('''
+            SELECT s.user, s.scripts_count, s.messages_count, COALESCE(c.campaigns_count, 0) AS campaigns_count,
+                   s.last_activity, s.last_script_at, s.last_product
+            FROM user_activity_stats s
+            LEFT JOIN (
+                SELECT user, COUNT(*) AS campaigns_count FROM user_campaign_stats GROUP BY user
+            ) c ON c.user = s.user
+        ''')
+        columns = [column[0] for column in cursor.description]
+        return {row[0]: dict(zip(columns[1:], row[1:])) for row in cursor.fetchall()}
+    except Exception as e:
+        st.error(f"⚠️ خطأ في قراءة إحصائيات المستخدمين: {e}")
+        return {}
+
+
+@tagged_cache('activity_logs', ttl=300)
+def get_user_stats(user: str) -> Dict:
+    """
+    إحصائيات مستخدم واحد (نفس مفاتيح get_all_user_stats، وأصفار لمستخدم بلا سجلات)
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.execute('''
+            SELECT scripts_count, messages_count, last_activity, last_script_at, last_product
+            FROM user_activity_stats WHERE user = ?
+        ''', (user,))
+        row = cursor.fetchone()
+        if row is None:
+            return dict(_EMPTY_USER_STATS)
+        stats = dict(zip([column[0] for column in cursor.description], row))
+        stats['campaigns_count'] = conn.execute(
+            'SELECT COUNT(*) FROM user_campaign_stats WHERE user = ?', (user,)
+        ).fetchone()[0]
+        return stats
+    except Exception as e:
+        st.error(f"⚠️ خطأ في قراءة إحصائيات المستخدم: {e}")
+        return dict(_EMPTY_USER_STATS)
+
+
+def refresh_user_stats() -> bool:
+    """
+    إعادة حساب إحصائيات المستخدمين من الصفر
+
+    غير مطلوبة في الاستخدام العادي (الـ triggers تحدّثها)، لكنها مفيدة بعد
+    تعديل قاعدة البيانات يدوياً.
+    """
+    conn = get_db_connection()
+    try:
+        with conn:
+            _rebuild_user_stats(conn.cursor())
+        invalidate('activity_logs')
+        return True
+    except Exception as e:
+        st.error(f"⚠️ فشل تحديث إحصائيات المستخدمين: {e}")
+        return False
@@ -7,11 +7,12 @@ Argan Smart Generator
 
 import streamlit as st
 import bcrypt
-import json
 import os
 from typing import Optional, Dict
 from datetime import datetime
 
+from modules.json_store import read_json, write_json
+
 
 def hash_password(password: str) -> str:
     """تشفير كلمة المرور باستخدام bcrypt"""
@@ -100,9 +101,8 @@ def require_admin(func):
     return wrapper
 
 
-@st.cache_data(ttl=300)
 def load_users() -> Dict:
-    """تحميل بيانات المستخدمين"""
+    """تحميل بيانات المستخدمين (يُعاد القراءة من القرص فقط إذا تغير الملف)"""
     try:
         if not os.path.exists("users.json"):
             default_users = {
@@ -112,24 +112,19 @@ def load_users() -> Dict:
                     "name": "المدير"
                 }
             }
-            with open("users.json", "w", encoding="utf-8") as f:
-                json.dump(default_users, f, ensure_ascii=False, indent=2)
+            write_json("users.json", default_users)
             return default_users
         
-        with open("users.json", "r", encoding="utf-8") as f:
-            return json.load(f)
+        return read_json("users.json", {})
     except Exception as e:
         st.error(f"⚠️ خطأ في تحميل المستخدمين: {e}")
         return {}
 
 
 def save_users(users: Dict) -> bool:
-    """حفظ بيانات المستخدمين"""
+    """حفظ بيانات المستخدمين (كتابة ذرية تحت قفل)"""
     try:
-        with open("users.json", "w", encoding="utf-8") as f:
-            json.dump(users, f, ensure_ascii=False, indent=2)
-        # مسح الـ cache لإعادة التحميل
-        load_users.clear()
+        write_json("users.json", users)
         return True
     except Exception as e:
         st.error(f"⚠️ فشل حفظ المستخدمين: {e}")
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة الـ cache الموسوم (Tagged Cache)
+Argan Smart Generator
+
+غلاف فوق st.cache_data يسجّل لكل دالة الجداول أو الملفات التي تعتمد عليها
+(tags)، حتى يمسح الكاتب ما يخصه فقط بدلاً من st.cache_data.clear() لكل التطبيق.
+
+- كل tag له رقم جيل (generation) يُمرَّر ضمن مفتاح الـ cache، فزيادته تُبطل
+  النتائج المعتمدة عليه فقط.
+- الـ tags قد تكون ثابتة ('orders') أو مشتقة من المعاملات ('file:users.json').
+- لكل دالة عدادات: استدعاءات، إصابات (hits)، إخفاقات (misses)، وإزالات (evictions).
+"""
+
+import functools
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import streamlit as st
+
+
+_lock = threading.Lock()
+_generations: Dict[str, int] = {}
+_registry: Dict[str, Dict[str, Any]] = {}
+
+
+def file_tag(path: str) -> str:
+    """الـ tag الخاص بملف (مثلاً لـ load_json)"""
+    return f'file:{path}'
+
+
+def _generation(tags: Iterable[str]) -> tuple:
+    return tuple(_generations.get(tag, 0) for tag in tags)
+
+
+def tagged_cache(*tags: str,
+                 ttl: Optional[float] = None,
+                 tags_for: Optional[Callable[..., Iterable[str]]] = None,
+                 **cache_kwargs):
+    """
+    Decorator بديل لـ st.cache_data مع tags للإبطال الانتقائي
+
+    Args:
+        *tags: الجداول/الملفات الثابتة التي تعتمد عليها الدالة
+        ttl: مدة الصلاحية بالثواني (كما في st.cache_data)
+        tags_for: دالة تأخذ نفس معاملات الدالة وتعيد tags إضافية
+        **cache_kwargs: معاملات إضافية لـ st.cache_data (max_entries, show_spinner, ...)
+
+    Example:
+        @tagged_cache('orders', ttl=300)
+        def get_orders_count(): ...
+
+        @tagged_cache(ttl=300, tags_for=lambda path: [file_tag(path)])
+        def load_json(path): ...
+    """
+    def decorator(func: Callable) -> Callable:
+        name = f'{func.__module__}.{func.__qualname__}'
+        stats = {
+            'tags': list(tags),
+            'dynamic_tags': tags_for is not None,
+            'calls': 0,
+            'misses': 0,
+            'evictions': 0,
+            'live': {},  # tags الاستدعاء -> عدد النتائج المخزنة حالياً
+        }
+
+        @functools.wraps(func)
+        def compute(*args, cache_generation: tuple, cache_tags: tuple, **kwargs):
+            result = func(*args, **kwargs)
+            with _lock:
+                stats['misses'] += 1
+                stats['live'][cache_tags] = stats['live'].get(cache_tags, 0) + 1
+            return result
+
+        cached = st.cache_data(ttl=ttl, **cache_kwargs)(compute)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            call_tags = tuple(tags) + (tuple(tags_for(*args, **kwargs)) if tags_for else ())
+            with _lock:
+                stats['calls'] += 1
+                generation = _generation(call_tags)
+            return cached(*args, cache_generation=generation, cache_tags=call_tags, **kwargs)
+
+        def clear():
+            """مسح كل نتائج هذه الدالة"""
+            cached.clear()
+            with _lock:
+                stats['evictions'] += sum(stats['live'].values())
+                stats['live'].clear()
+
+        wrapper.clear = clear
+        wrapper.cache_tags = list(tags)
+        with _lock:
+            _registry[name] = stats
+        return wrapper
+
+    return decorator
+
+
+def invalidate(*tags: str):
+    """
+    إبطال نتائج الدوال المعتمدة على أي من الـ tags فقط
+
+    Args:
+        *tags: مثل 'orders' أو 'expenses' أو file_tag('users.json')
+    """
+    with _lock:
+        for tag in tags:
+            _generations[tag] = _generations.get(tag, 0) + 1
+        for stats in _registry.values():
+            for call_tags in [key for key in stats['live'] if set(key) & set(tags)]:
+                stats['evictions'] += stats['live'].pop(call_tags)
+
+
+def invalidate_all():
+    """إبطال كل الدوال الموسومة (بديل st.cache_data.clear() لزر المسح اليدوي)"""
+    st.cache_data.clear()
+    with _lock:
+        for stats in _registry.values():
+            stats['evictions'] += sum(stats['live'].values())
+            stats['live'].clear()
+
+
+def get_cache_stats() -> List[Dict]:
+    """
+    عدادات الـ cache لكل دالة موسومة (للوحة الإدارة)
+
+    Returns:
+        قائمة قواميس: function, tags, calls, hits, misses, evictions, hit_rate
+    """
+    with _lock:
+        rows = []
+        for name, stats in sorted(_registry.items()):
+            calls = stats['calls']
+            hits = max(calls - stats['misses'], 0)
+            tags = ', '.join(stats['tags'] + (['(حسب المعاملات)'] if stats['dynamic_tags'] else []))
+            rows.append({
+                'function': name,
+                'tags': tags,
+                'calls': calls,
+                'hits': hits,
+                'misses': stats['misses'],
+                'evictions': stats['evictions'],
+                'hit_rate': hits / calls * 100 if calls else 0.0,
+            })
+        return rows
+
+
+def reset_cache_stats():
+    """تصفير العدادات (بدون مسح النتائج المخزنة)"""
+    with _lock:
+        for stats in _registry.values():
+            stats['calls'] = stats['misses'] = stats['evictions'] = 0
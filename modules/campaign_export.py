@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة تصدير جهات اتصال حملات مراسلاتي (CSV / Excel)
+Argan Smart Generator
+
+- التصدير عند الطلب فقط (وليس مع كل عرض للصفحة).
+- جهات الاتصال تُقرأ من جمهور الحملة المحفوظ (iter_segment_orders) على دفعات
+  وتُكتب مباشرة إلى الملف: csv.writer أو openpyxl في وضع write_only، فلا يُبنى
+  DataFrame للحملة.
+- الملف الناتج محفوظ في exports/ باسم يحتوي معرّف الحملة وإصدار بيانات الطلبات،
+  فيُعاد استخدامه حتى تتغير الطلبات.
+"""
+
+import csv
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Iterator, Optional, Tuple
+
+import openpyxl
+
+from modules.database import get_orders_version, iter_segment_orders
+from modules.segmentation import ensure_campaign_segment, is_legacy_campaign
+
+
+EXPORT_DIR = 'exports'
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_HEADERS = ['اسم العميل', 'رقم الجوال']
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def iter_campaign_contacts(campaign: Dict, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[Tuple]:
+    """
+    (اسم العميل, رقم الجوال) لكل طلب في جمهور الحملة
+
+    الجمهور يُقرأ من campaign_members (ensure_campaign_segment) على دفعات. الحملات
+    القديمة (is_legacy_campaign) تُصدَّر من قائمة العملاء المحفوظة معها كما هي.
+    """
+    if is_legacy_campaign(campaign) or not ensure_campaign_segment(campaign):
+        for customer in campaign.get('customers', []):
+            yield customer.get('اسم العميل'), customer.get('رقم الهاتف')
+        return
+
+    for order in iter_segment_orders(campaign['id'], columns=['customer_name', 'phone'], chunk_size=chunk_size):
+        yield order['اسم العميل'], order['رقم الهاتف']
+
+
+def _export_key(campaign: Dict) -> str:
+    """مفتاح الملف: الفلاتر + إصدار بيانات الطلبات"""
+    filters = json.dumps(campaign.get('filters'), ensure_ascii=False, sort_keys=True)
+    digest = hashlib.sha1(filters.encode('utf-8')).hexdigest()[:8]
+    return f'{digest}_v{get_orders_version()}'
+
+
+def _write_csv(path: str, rows: Iterator[Tuple]):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_HEADERS)
+        writer.writerows(rows)
+
+
+def _write_xlsx(path: str, rows: Iterator[Tuple]):
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('جهات الاتصال')
+    worksheet.append(EXPORT_HEADERS)
+    for row in rows:
+        worksheet.append(list(row))
+    workbook.save(path)
+
+
+def export_campaign_contacts(campaign: Dict, fmt: str = 'csv',
+                             directory: str = EXPORT_DIR) -> Optional[str]:
+    """
+    ملف جهات اتصال الحملة (يُولَّد فقط إذا لم يكن موجوداً لنفس إصدار البيانات)
+
+    Args:
+        campaign: الحملة من moraselaty_campaigns.json
+        fmt: 'csv' أو 'xlsx'
+
+    Returns:
+        مسار الملف
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"صيغة غير مدعومة: {fmt}")
+
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.join(directory, f"campaign_{campaign['id']}_")
+    path = f'{prefix}{_export_key(campaign)}.{fmt}'
+    if os.path.exists(path):
+        return path
+
+    fd, temp_path = tempfile.mkstemp(suffix=f'.{fmt}', dir=directory)
+    os.close(fd)
+    try:
+        writer = _write_csv if fmt == 'csv' else _write_xlsx
+        writer(temp_path, iter_campaign_contacts(campaign))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    # حذف ملفات نفس الحملة والصيغة للإصدارات السابقة
+    for stale in glob.glob(f'{glob.escape(prefix)}*.{fmt}'):
+        if stale != path:
+            os.remove(stale)
+    return path
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة إدارة اتصالات SQLite المشتركة
+Argan Smart Generator
+
+اتصال واحد دائم لكل (thread, قاعدة بيانات) بدلاً من فتح وإغلاق اتصال في كل دالة.
+Streamlit يشغّل كل جلسة في thread خاص بها، واتصال sqlite3 لا يُشارك بأمان بين
+الـ threads، لذلك تُحفظ الاتصالات في threading.local.
+
+كل اتصال جديد يُهيَّأ بـ:
+- WAL: القرّاء لا يحجبون الكاتب والعكس
+- synchronous=NORMAL: آمن مع WAL وأسرع بكثير من FULL
+- busy_timeout: الكاتب ينتظر القفل بدلاً من "database is locked"
+- mmap_size / cache_size: قراءة أسرع للقواعد الصغيرة والمتوسطة
+"""
+
+import sqlite3
+import threading
+from typing import Callable, Dict, Optional
+
+
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024   # 256 MB
+CACHE_SIZE_KB = 16 * 1024       # 16 MB (القيمة السالبة في PRAGMA = كيلوبايت)
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_initialized_paths = set()
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    """فتح اتصال جديد وتطبيق إعدادات الأداء"""
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+
+def get_connection(db_path: str,
+                   initializer: Optional[Callable[[sqlite3.Connection], None]] = None) -> sqlite3.Connection:
+    """
+    الحصول على اتصال الـ thread الحالي بقاعدة البيانات
+
+    Args:
+        db_path: مسار ملف قاعدة البيانات
+        initializer: دالة تهيئة المخطط (schema)، تُنفَّذ مرة واحدة لكل مسار في العملية
+
+    Returns:
+        sqlite3.Connection خاص بالـ thread الحالي
+    """
+    connections: Dict[str, sqlite3.Connection] = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_path)
+    if conn is None:
+        conn = connections[db_path] = _connect(db_path)
+
+    if initializer is not None and db_path not in _initialized_paths:
+        with _schema_lock:
+            if db_path not in _initialized_paths:
+                initializer(conn)
+                _initialized_paths.add(db_path)
+
+    return conn
+
+
+def close_connections():
+    """إغلاق اتصالات الـ thread الحالي (مثلاً قبل حذف/استبدال ملف القاعدة)"""
+    connections = getattr(_local, 'connections', None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
+def reset_schema_state(db_path: Optional[str] = None):
+    """إعادة تنفيذ دالة التهيئة عند الطلب القادم (لمسار معين أو للكل)"""
+    with _schema_lock:
+        if db_path is None:
+            _initialized_paths.clear()
+        else:
+            _initialized_paths.discard(db_path)
@@ -5,30 +5,564 @@
 Argan Smart Generator
 """
 
+import itertools
+import json
+import math
+import re
 import sqlite3
 import streamlit as st
-from typing import List, Dict, Optional, Tuple
+from typing import Any, Callable, Iterable, Iterator, List, Dict, Optional, Tuple
 import pandas as pd
 
+from modules.cache import invalidate, tagged_cache
+from modules.connection import get_connection
+from modules.utils import normalize_phone
 
-@st.cache_resource
-def get_db_connection():
-    """إنشاء اتصال بقاعدة البيانات (cached)"""
-    return sqlite3.connect('database/customers.db', check_same_thread=False)
+
+DB_PATH = 'database/customers.db'
+
+# أعمدة جدول الطلبات ومفاتيحها المقابلة في ملفات مراسلاتي (Excel/JSON)
+ORDER_COLUMNS = [
+    ('order_number', ('رقم الطلب',)),
+    ('customer_name', ('اسم العميل',)),
+    ('seller', ('البائع',)),
+    ('order_entry', ('مدخل الطلبيه',)),
+    ('total_amount', ('المبلغ الاجمالي',)),
+    ('currency', ('العملة',)),
+    ('tax', ('الضريبة',)),
+    ('phone', ('رقم الهاتف',)),
+    ('receiver_phone', ('هاتف المستلم',)),
+    ('shipping_address', ('عنوان الشحن',)),
+    ('city', ('المدينة',)),
+    ('country', ('الدولة',)),
+    ('products_total', ('اجمالي المنتجات',)),
+    ('shipping_fees', ('رسوم الشحن',)),
+    ('payment_fees', (' رسوم الدفع', 'رسوم الدفع')),
+    ('status', ('حالة الطلب', 'الحالة')),
+    ('order_date', ('تاريخ الطلب',)),
+    ('shipping_date', ('تاريخ الشحن',)),
+    ('delivery_date', ('تاريخ التسليم',)),
+    ('payment_method', (' طريقة الدفع', 'طريقة الدفع')),
+    ('notes', ('ملاحظات',)),
+]
+
+# مفاتيح الطلب بصيغة JSON القديم (get_all_orders / query_orders)
+LEGACY_COLUMNS = {
+    'order_number': 'رقم الطلب',
+    'customer_name': 'اسم العميل',
+    'phone': 'رقم الهاتف',
+    'city': 'المدينة',
+    'total_amount': 'المبلغ الاجمالي',
+    'status': 'حالة الطلب',
+    'payment_method': ' طريقة الدفع',  # مع المسافة كما في JSON القديم
+    'order_date': 'تاريخ الطلب',
+}
+
+# الأعمدة المسموح بجلب قيمها المميزة (فلاتر الحملات)
+FILTER_COLUMNS = {'city', 'status', 'payment_method'}
+
+ORDERS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        {id_column}
+        order_number INTEGER,
+        customer_name TEXT,
+        seller TEXT,
+        order_entry TEXT,
+        total_amount REAL,
+        currency TEXT,
+        tax INTEGER,
+        phone TEXT,
+        receiver_phone TEXT,
+        shipping_address TEXT,
+        city TEXT,
+        country TEXT,
+        products_total REAL,
+        shipping_fees REAL,
+        payment_fees REAL,
+        status TEXT,
+        order_date TEXT,
+        shipping_date TEXT,
+        delivery_date TEXT,
+        payment_method TEXT,
+        notes TEXT
+        {extra_columns}
+    )
+'''
+
+_NUMERIC_COLUMNS = {'total_amount', 'products_total', 'shipping_fees', 'payment_fees'}
+_TEXT_ID_COLUMNS = {'phone', 'receiver_phone'}
+
+# جداول التجميع المسبق (rollups) للوحات التحليلات:
+# (الجدول, عمود المفتاح, تعبير المفتاح, شرط الصف) - {row} تُستبدل بـ new / old / orders
+ROLLUPS = [
+    ('orders_daily_rollup', 'day', "date({row}.order_date)",
+     "date({row}.order_date) IS NOT NULL"),
+    ('orders_monthly_rollup', 'month', "strftime('%Y-%m', {row}.order_date)",
+     "strftime('%Y-%m', {row}.order_date) IS NOT NULL"),
+    ('orders_city_rollup', 'city', "{row}.city",
+     "{row}.city IS NOT NULL AND {row}.city != ''"),
+    ('orders_customer_rollup', 'customer_name', "{row}.customer_name",
+     "{row}.customer_name IS NOT NULL AND {row}.customer_name != ''"),
+]
+
+# مدينة العميل في orders_customer_rollup = مدينة آخر طلب له فيه مدينة (نفس التعريف
+# في الـ triggers وفي _rebuild_rollups؛ يستخدم فهرس idx_customer_name)
+_CUSTOMER_CITY_SQL = '''
+    UPDATE orders_customer_rollup SET city = (
+        SELECT c.city FROM orders c
+        WHERE c.customer_name = orders_customer_rollup.customer_name AND c.city IS NOT NULL AND c.city != ''
+        ORDER BY c.id DESC LIMIT 1
+    )
+'''
+
+# أعمدة فهرس البحث النصي (FTS5)
+SEARCH_COLUMNS = ['customer_name', 'phone', 'receiver_phone', 'city', 'shipping_address']
+
+# توحيد الحروف العربية: الألف، التاء المربوطة، الياء، التطويل والتشكيل
+_ARABIC_NORMALIZATION = [
+    ('أ', 'ا'), ('إ', 'ا'), ('آ', 'ا'), ('ٱ', 'ا'),
+    ('ة', 'ه'),
+    ('ى', 'ي'), ('ی', 'ي'),
+    ('ـ', ''),
+] + [(chr(code), '') for code in range(0x064B, 0x0653)]
+
+
+def normalize_arabic(text: Optional[str]) -> str:
+    """توحيد النص العربي قبل الفهرسة أو البحث"""
+    text = str(text or '')
+    for source, target in _ARABIC_NORMALIZATION:
+        text = text.replace(source, target)
+    return text.lower()
+
+
+def _normalize_arabic_sql(expression: str) -> str:
+    """نفس normalize_arabic لكن كتعبير SQL (يُستخدم داخل الـ triggers دون دوال Python)"""
+    for source, target in _ARABIC_NORMALIZATION:
+        expression = f"replace({expression}, '{source}', '{target}')"
+    return f"lower(COALESCE({expression}, ''))"
+
+
+def ensure_orders_schema(conn: sqlite3.Connection):
+    """
+    إنشاء جدول الطلبات وفهارسه إذا لم تكن موجودة، وترقية الجداول القديمة
+
+    الجداول المنشأة بواسطة migrate_to_sqlite.py لم يكن فيها قيد UNIQUE على
+    order_number، لذلك تُحذف النسخ المكررة (يُحتفظ بأحدثها) قبل إنشاء الفهرس الفريد.
+    """
+    cursor = conn.cursor()
+    cursor.execute(ORDERS_TABLE_SQL.format(
+        table='orders',
+        id_column='id INTEGER PRIMARY KEY AUTOINCREMENT,',
+        extra_columns=', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP'
+    ))
+
+    cursor.execute('PRAGMA index_list(orders)')
+    indexes = {row[1]: row[2] for row in cursor.fetchall()}
+
+    if not indexes.get('idx_order_number'):
+        # حذف الطلبات المكررة قبل فرض القيد
+        cursor.execute('''
+            DELETE FROM orders
+            WHERE order_number IS NOT NULL
+              AND id NOT IN (
+                  SELECT MAX(id) FROM orders
+                  WHERE order_number IS NOT NULL
+                  GROUP BY order_number
+              )
+        ''')
+        cursor.execute('DROP INDEX IF EXISTS idx_order_number')
+        cursor.execute('CREATE UNIQUE INDEX idx_order_number ON orders(order_number)')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_name ON orders(customer_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_city ON orders(city)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_date ON orders(order_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_total_amount ON orders(total_amount)')
+
+    # فهرس مغطٍّ (covering) لأعمدة صفحات الطلبات: الصفحة تُقرأ من الفهرس فقط
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_orders_page ON orders(
+            id, order_number, customer_name, total_amount, city, order_date, status, phone
+        )
+    ''')
+
+    # عدد الطلبات المحفوظ، يتم تحديثه بواسطة triggers بدلاً من COUNT(*) في كل صفحة
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO orders_stats (name, value)
+        SELECT 'row_count', COUNT(*) FROM orders
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_orders_count_insert AFTER INSERT ON orders
+        BEGIN
+            UPDATE orders_stats SET value = value + 1 WHERE name = 'row_count';
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_orders_count_delete AFTER DELETE ON orders
+        BEGIN
+            UPDATE orders_stats SET value = value - 1 WHERE name = 'row_count';
+        END
+    ''')
+
+    # رقم إصدار البيانات: يزيد مع أي تغيير في orders (يُستخدم كمفتاح للـ cache)
+    cursor.execute("INSERT OR IGNORE INTO orders_stats (name, value) VALUES ('data_version', 0)")
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_orders_version_{event.lower()} AFTER {event} ON orders
+            BEGIN
+                UPDATE orders_stats SET value = value + 1 WHERE name = 'data_version';
+            END
+        ''')
+
+    _ensure_search_index(cursor)
+    _ensure_rollups(cursor)
+    _ensure_change_log(cursor)
+    _ensure_campaign_segments(cursor)
+
+    conn.commit()
+
+
+def _ensure_change_log(cursor: sqlite3.Cursor):
+    """
+    سجل التغييرات (change log) على جدول orders
+
+    صف واحد لكل رقم طلب بآخر عملية عليه ('I' / 'U' / 'D') ورقم تسلسلي يزيد مع
+    كل تغيير، فيبقى حجم السجل بحجم الجدول مهما تكرر الاستيراد. يُستخدم لمعرفة
+    ما تغير منذ آخر تصدير (get_changes_since) ولتاريخ آخر تحديث للبيانات.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders_changes (
+            seq INTEGER PRIMARY KEY,
+            order_number INTEGER UNIQUE,
+            op TEXT NOT NULL,
+            changed_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders_exports (
+            path TEXT PRIMARY KEY,
+            change_seq INTEGER NOT NULL,
+            exported_at TEXT NOT NULL
+        )
+    ''')
+    # الطلب الموجود في السجل ينتقل إلى seq جديد أكبر من كل ما سبقه.
+    # (UPSERT وليس INSERT OR REPLACE: سياسة التعارض في الجملة الخارجية تلغي OR REPLACE داخل الـ trigger)
+    for event, row, op in (('INSERT', 'new', 'I'), ('UPDATE', 'new', 'U'), ('DELETE', 'old', 'D')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_orders_changes_{event.lower()} AFTER {event} ON orders
+            BEGIN
+                INSERT INTO orders_changes (order_number, op) VALUES ({row}.order_number, '{op}')
+                ON CONFLICT(order_number) DO UPDATE SET
+                    seq = (SELECT MAX(seq) + 1 FROM orders_changes),
+                    op = excluded.op,
+                    changed_at = excluded.changed_at;
+            END
+        ''')
+
+
+def _ensure_campaign_segments(cursor: sqlite3.Cursor):
+    """
+    جمهور كل حملة محفوظ كقائمة أرقام طلبات (materialized segment)
+
+    - campaign_segments: معاملات فلترة الحملة (JSON، أو NULL لقائمة ثابتة) وآخر
+      رقم في orders_changes وصلت إليه القائمة.
+    - campaign_members: (campaign_id, order_number, phone) بدون rowid، فالتصدير
+      بحث بالفهرس والتداخل بين حملتين مقارنة أرقام الهاتف من الفهرس.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS campaign_segments (
+            campaign_id INTEGER PRIMARY KEY,
+            filters TEXT,
+            change_seq INTEGER NOT NULL DEFAULT 0,
+            members_count INTEGER NOT NULL DEFAULT 0,
+            refreshed_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS campaign_members (
+            campaign_id INTEGER NOT NULL,
+            order_number INTEGER NOT NULL,
+            phone TEXT,
+            PRIMARY KEY (campaign_id, order_number)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_campaign_members_phone ON campaign_members(campaign_id, phone)')
+
+
+def _rollup_upsert_sql(table: str, key: str, key_expr: str, condition: str, row: str, sign: str) -> str:
+    """جملة SQL لإضافة (sign='+') أو طرح (sign='-') طلب واحد من جدول تجميع"""
+    key_value = key_expr.format(row=row)
+    amount = f"COALESCE({row}.total_amount, 0)"
+
+    city_update = (f'{_CUSTOMER_CITY_SQL} WHERE customer_name = {key_value};'
+                   if table == 'orders_customer_rollup' else '')
+
+    if sign == '-':
+        return f'''
+            UPDATE {table}
+            SET orders_count = orders_count - 1, total_amount = total_amount - {amount}
+            WHERE {key} = {key_value} AND {condition.format(row=row)};
+            DELETE FROM {table} WHERE {key} = {key_value} AND orders_count <= 0;
+            {city_update}
+        '''
+
+    return f'''
+        INSERT INTO {table} ({key}, orders_count, total_amount)
+        SELECT {key_value}, 1, {amount} WHERE {condition.format(row=row)}
+        ON CONFLICT({key}) DO UPDATE SET
+            orders_count = orders_count + 1,
+            total_amount = total_amount + excluded.total_amount;
+        {city_update}
+    '''
+
+
+def _ensure_rollups(cursor: sqlite3.Cursor):
+    """
+    إنشاء جداول التجميع المسبق (يومي / شهري / مدينة / عميل) وتحديثها تلقائياً
+
+    الـ triggers تُحدّث الجداول مع كل إدراج أو تعديل أو حذف في orders، لذلك
+    تبقى لوحات التحليلات سريعة مهما كبر عدد الطلبات.
+    """
+    created = False
+
+    # triggers العملاء القديمة كانت تحفظ مدينة آخر طلب مُدرج ولا تعيد حسابها عند الحذف
+    cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'trg_orders_customer_rollup_delete'")
+    row = cursor.fetchone()
+    if row is not None and 'SET city' not in row[0]:
+        for event in ('insert', 'delete', 'update'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS trg_orders_customer_rollup_{event}')
+        created = True
+
+    for table, key, key_expr, condition in ROLLUPS:
+        cursor.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (table,))
+        if cursor.fetchone() is None:
+            created = True
+
+        city_column = ', city TEXT' if table == 'orders_customer_rollup' else ''
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} TEXT PRIMARY KEY,
+                orders_count INTEGER NOT NULL DEFAULT 0,
+                total_amount REAL NOT NULL DEFAULT 0{city_column}
+            )
+        ''')
+
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_insert AFTER INSERT ON orders
+            BEGIN
+                {_rollup_upsert_sql(table, key, key_expr, condition, 'new', '+')}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_delete AFTER DELETE ON orders
+            BEGIN
+                {_rollup_upsert_sql(table, key, key_expr, condition, 'old', '-')}
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_update
+            AFTER UPDATE OF order_date, city, customer_name, total_amount ON orders
+            BEGIN
+                {_rollup_upsert_sql(table, key, key_expr, condition, 'old', '-')}
+                {_rollup_upsert_sql(table, key, key_expr, condition, 'new', '+')}
+            END
+        ''')
+
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_city_rollup_count ON orders_city_rollup(orders_count)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_customer_rollup_total ON orders_customer_rollup(total_amount)')
+
+    if created:
+        _rebuild_rollups(cursor)
+
+
+def _rebuild_rollups(cursor: sqlite3.Cursor):
+    """إعادة بناء جداول التجميع بالكامل من جدول orders"""
+    for table, key, key_expr, condition in ROLLUPS:
+        key_value = key_expr.format(row='orders')
+
+        cursor.execute(f'DELETE FROM {table}')
+        cursor.execute(f'''
+            INSERT INTO {table} ({key}, orders_count, total_amount)
+            SELECT {key_value}, COUNT(*), COALESCE(SUM(total_amount), 0)
+            FROM orders
+            WHERE {condition.format(row='orders')}
+            GROUP BY {key_value}
+        ''')
+    cursor.execute(_CUSTOMER_CITY_SQL)
+
+
+def refresh_rollups() -> bool:
+    """
+    إعادة حساب جداول التجميع (rollups) من الصفر
+    
+    غير مطلوبة في الاستخدام العادي لأن الـ triggers تحدّثها تلقائياً،
+    لكنها مفيدة بعد تعديل قاعدة البيانات يدوياً أو من أداة خارجية.
+    
+    Returns:
+        True إذا نجحت العملية، False إذا فشلت
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('BEGIN')
+        _rebuild_rollups(cursor)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        st.error(f"خطأ في تحديث جداول التجميع: {e}")
+        return False
+    
+    clear_orders_cache()
+    return True
+
+
+def _ensure_search_index(cursor: sqlite3.Cursor):
+    """
+    إنشاء فهرس البحث النصي orders_fts (FTS5) وربطه بجدول orders عبر triggers
+
+    النص يُخزَّن في الفهرس بعد توحيد الحروف العربية، و rowid = orders.id.
+    إذا كانت نسخة SQLite بدون FTS5 يعمل البحث بـ LIKE كما في السابق.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'orders_fts'")
+    exists = cursor.fetchone() is not None
+
+    if not exists:
+        try:
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE orders_fts USING fts5(
+                    {', '.join(SEARCH_COLUMNS)},
+                    tokenize = 'unicode61 remove_diacritics 2',
+                    prefix = '2 3 4'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            # FTS5 غير متوفر في هذه النسخة من SQLite
+            return
+
+    columns = ', '.join(SEARCH_COLUMNS)
+    new_values = ', '.join(_normalize_arabic_sql(f'new.{col}') for col in SEARCH_COLUMNS)
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_orders_fts_insert AFTER INSERT ON orders
+        BEGIN
+            INSERT INTO orders_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_orders_fts_delete AFTER DELETE ON orders
+        BEGIN
+            DELETE FROM orders_fts WHERE rowid = old.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_orders_fts_update AFTER UPDATE OF {columns} ON orders
+        BEGIN
+            DELETE FROM orders_fts WHERE rowid = old.id;
+            INSERT INTO orders_fts (rowid, {columns}) VALUES (new.id, {new_values});
+        END
+    ''')
+
+    if not exists:
+        # فهرسة الطلبات الموجودة مسبقاً
+        values = ', '.join(_normalize_arabic_sql(col) for col in SEARCH_COLUMNS)
+        cursor.execute(f'INSERT INTO orders_fts (rowid, {columns}) SELECT id, {values} FROM orders')
+
+
+def get_db_connection() -> sqlite3.Connection:
+    """اتصال الـ thread الحالي بقاعدة البيانات (WAL، مع تهيئة المخطط مرة واحدة)"""
+    return get_connection(DB_PATH, ensure_orders_schema)
 
 
 def get_orders_count() -> int:
-    """الحصول على عدد الطلبات الإجمالي"""
+    """الحصول على عدد الطلبات الإجمالي (من العداد المحفوظ)"""
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM orders')
+        cursor.execute("SELECT value FROM orders_stats WHERE name = 'row_count'")
         return cursor.fetchone()[0]
     except Exception as e:
         st.error(f"خطأ في الحصول على عدد الطلبات: {e}")
         return 0
 
 
+def get_orders_version() -> int:
+    """
+    رقم إصدار بيانات الطلبات (يتغير مع أي إدراج أو تعديل أو حذف)
+    
+    يُمرَّر كمعامل للدوال المخزنة مؤقتاً حتى يتجدد الـ cache فقط عند تغير البيانات.
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM orders_stats WHERE name = 'data_version'")
+        return cursor.fetchone()[0]
+    except Exception as e:
+        st.error(f"خطأ في الحصول على إصدار البيانات: {e}")
+        return 0
+
+
+def get_change_seq() -> int:
+    """آخر رقم تسلسلي في سجل التغييرات (0 إذا لم يتغير شيء بعد)"""
+    try:
+        row = get_db_connection().execute('SELECT MAX(seq) FROM orders_changes').fetchone()
+        return row[0] or 0
+    except Exception as e:
+        st.error(f"خطأ في قراءة سجل التغييرات: {e}")
+        return 0
+
+
+def get_last_change_time() -> Optional[str]:
+    """وقت آخر تغيير في الطلبات ('YYYY-MM-DD HH:MM:SS')، أو None"""
+    try:
+        row = get_db_connection().execute(
+            'SELECT changed_at FROM orders_changes ORDER BY seq DESC LIMIT 1'
+        ).fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        st.error(f"خطأ في قراءة سجل التغييرات: {e}")
+        return None
+
+
+def get_changes_since(seq: int = 0, limit: Optional[int] = None) -> List[Dict]:
+    """
+    الطلبات التي تغيرت بعد رقم تسلسلي معين (آخر عملية لكل طلب)
+
+    Returns:
+        قائمة {'seq', 'order_number', 'op', 'changed_at'} بترتيب التغيير
+    """
+    sql = 'SELECT seq, order_number, op, changed_at FROM orders_changes WHERE seq > ? ORDER BY seq'
+    params: list = [seq]
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    cursor = get_db_connection().execute(sql, params)
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def get_export_seq(path: str) -> Optional[int]:
+    """رقم التسلسل الذي صُدِّر عنده الملف آخر مرة (None إن لم يُصدَّر)"""
+    row = get_db_connection().execute('SELECT change_seq FROM orders_exports WHERE path = ?', (path,)).fetchone()
+    return row[0] if row else None
+
+
+def record_export(path: str, seq: int):
+    """تسجيل أن الملف أصبح مطابقاً لقاعدة البيانات حتى seq"""
+    conn = get_db_connection()
+    with conn:
+        conn.execute('''
+            INSERT INTO orders_exports (path, change_seq, exported_at)
+            VALUES (?, ?, datetime('now', 'localtime'))
+            ON CONFLICT(path) DO UPDATE SET change_seq = excluded.change_seq, exported_at = excluded.exported_at
+        ''', (path, seq))
+
+
 def get_customers_count() -> int:
     """الحصول على عدد العملاء الفريدين"""
     try:
@@ -54,11 +588,16 @@ def get_total_revenue() -> float:
         return 0.0
 
 
-@st.cache_data(ttl=300)
+PAGE_COLUMNS = ['رقم الطلب', 'اسم العميل', 'المبلغ', 'المدينة', 'التاريخ', 'الحالة', 'الهاتف']
+
+
+@tagged_cache('orders', ttl=300)
 def get_orders_paginated(page: int = 1, per_page: int = 100) -> Tuple[List[Dict], int]:
     """
     الحصول على الطلبات مع pagination
     
+    للصفحات العميقة يُفضّل استخدام get_orders_page (keyset pagination).
+    
     Args:
         page: رقم الصفحة (يبدأ من 1)
         per_page: عدد الطلبات في الصفحة
@@ -70,23 +609,22 @@ def get_orders_paginated(page: int = 1, per_page: int = 100) -> Tuple[List[Dict]
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # الحصول على العدد الإجمالي
-        cursor.execute('SELECT COUNT(*) FROM orders')
+        # الحصول على العدد الإجمالي (من العداد المحفوظ)
+        cursor.execute("SELECT value FROM orders_stats WHERE name = 'row_count'")
         total = cursor.fetchone()[0]
         
         # الحصول على الطلبات
-        offset = (page - 1) * per_page
-        cursor.execute(f'''
+        offset = (max(page, 1) - 1) * per_page
+        cursor.execute('''
             SELECT 
                 order_number, customer_name, total_amount, city, 
                 order_date, status, phone
             FROM orders
             ORDER BY id DESC
-            LIMIT {per_page} OFFSET {offset}
-        ''')
+            LIMIT ? OFFSET ?
+        ''', (per_page, offset))
         
-        columns = ['رقم الطلب', 'اسم العميل', 'المبلغ', 'المدينة', 'التاريخ', 'الحالة', 'الهاتف']
-        orders = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        orders = [dict(zip(PAGE_COLUMNS, row)) for row in cursor.fetchall()]
         
         return orders, total
     
@@ -95,11 +633,155 @@ def get_orders_paginated(page: int = 1, per_page: int = 100) -> Tuple[List[Dict]
         return [], 0
 
 
-@st.cache_data(ttl=300)
+@tagged_cache('orders', ttl=300)
+def get_orders_page(page_token: Optional[str] = None, per_page: int = 100) -> Dict:
+    """
+    الحصول على صفحة من الطلبات باستخدام keyset pagination على id
+    
+    بدلاً من OFFSET (الذي يزداد بطؤه مع عمق الصفحة) يبدأ الاستعلام مباشرة
+    من آخر id في الصفحة السابقة، لذلك تكلفة أي صفحة ثابتة.
+    
+    Args:
+        page_token: None للصفحة الأولى، أو next_token / prev_token من نتيجة سابقة
+        per_page: عدد الطلبات في الصفحة
+    
+    Returns:
+        {'orders': [...], 'next_token': str أو None, 'prev_token': str أو None, 'total': int}
+    """
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT value FROM orders_stats WHERE name = 'row_count'")
+        total = cursor.fetchone()[0]
+        
+        direction, anchor = 'n', None
+        if page_token:
+            direction, anchor = page_token[0], int(page_token[1:])
+        
+        select = '''
+            SELECT 
+                id, order_number, customer_name, total_amount, city, 
+                order_date, status, phone
+            FROM orders
+        '''
+        
+        # نجلب صفاً إضافياً لمعرفة هل توجد صفحة بعدها
+        if anchor is None:
+            cursor.execute(select + ' ORDER BY id DESC LIMIT ?', (per_page + 1,))
+        elif direction == 'n':
+            cursor.execute(select + ' WHERE id < ? ORDER BY id DESC LIMIT ?', (anchor, per_page + 1))
+        else:
+            cursor.execute(select + ' WHERE id > ? ORDER BY id ASC LIMIT ?', (anchor, per_page + 1))
+        
+        rows = cursor.fetchall()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        
+        if direction == 'p':
+            rows.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, anchor is not None
+        
+        orders = [dict(zip(PAGE_COLUMNS, row[1:])) for row in rows]
+        
+        return {
+            'orders': orders,
+            'next_token': f"n{rows[-1][0]}" if rows and has_next else None,
+            'prev_token': f"p{rows[0][0]}" if rows and has_prev else None,
+            'total': total
+        }
+    
+    except Exception as e:
+        st.error(f"خطأ في الحصول على الطلبات: {e}")
+        return {'orders': [], 'next_token': None, 'prev_token': None, 'total': 0}
+
+
+def _phone_variants(token: str) -> List[str]:
+    """
+    صيغ رقم الجوال كما قد تُخزَّن في الملفات المرفوعة (05xxxxxxxx و 9665xxxxxxxx و 5xxxxxxxx)،
+    وأي نص آخر يُعاد كما هو
+    """
+    digits = token.replace(' ', '').replace('-', '').replace('+', '')
+    if not digits.isdigit() or not digits.startswith(('05', '5', '966')):
+        return [token]
+    national = normalize_phone(digits)[3:]
+    return ['0' + national, '966' + national, national]
+
+
+def _build_fts_query(query: str, columns: Optional[List[str]] = None) -> str:
+    """
+    تحويل نص البحث إلى استعلام FTS5: كل كلمة تُطابق كبادئة (prefix)،
+    وأرقام الجوال تُطابق بالصيغتين المحلية والدولية (05xxxxxxxx أو 9665xxxxxxxx)
+    """
+    terms = []
+    for token in re.findall(r'\w+', normalize_arabic(query)):
+        phrases = ['"' + variant.replace('"', '""') + '"*' for variant in _phone_variants(token)]
+        phrase = phrases[0] if len(phrases) == 1 else '(' + ' OR '.join(phrases) + ')'
+        if columns:
+            phrase = '{' + ' '.join(columns) + '} : ' + phrase
+        terms.append(phrase)
+    return ' AND '.join(terms)
+
+
+def _has_search_index(cursor: sqlite3.Cursor) -> bool:
+    """هل فهرس FTS5 متوفر؟"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'orders_fts'")
+    return cursor.fetchone() is not None
+
+
+@tagged_cache('orders', ttl=300)
+def search_orders_fts(query: str, columns: Optional[List[str]] = None, limit: int = 100) -> List[Dict]:
+    """
+    بحث نصي سريع (FTS5) في الاسم والجوال وهاتف المستلم والمدينة والعنوان
+    
+    يدعم مطابقة بدايات الكلمات وتوحيد الحروف العربية (أ/إ/آ ← ا، ة ← ه، ى ← ي)
+    وحذف التطويل والتشكيل، والنتائج مرتبة حسب الصلة (bm25).
+    
+    Args:
+        query: نص البحث
+        columns: تقييد البحث بأعمدة معينة من SEARCH_COLUMNS (الافتراضي: جميعها)
+        limit: الحد الأقصى للنتائج
+    
+    Returns:
+        قائمة الطلبات المطابقة مرتبة حسب الصلة
+    """
+    try:
+        columns = [col for col in (columns or []) if col in SEARCH_COLUMNS]
+        fts_query = _build_fts_query(query, columns)
+        if not fts_query:
+            return []
+        
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT 
+                o.order_number, o.customer_name, o.total_amount, o.city, 
+                o.order_date, o.status, o.phone
+            FROM orders_fts
+            JOIN orders o ON o.id = orders_fts.rowid
+            WHERE orders_fts MATCH ?
+            ORDER BY orders_fts.rank
+            LIMIT ?
+        ''', (fts_query, limit))
+        
+        return [dict(zip(PAGE_COLUMNS, row)) for row in cursor.fetchall()]
+    
+    except Exception as e:
+        st.error(f"خطأ في البحث: {e}")
+        return []
+
+
+@tagged_cache('orders', ttl=300)
 def search_orders(query: str, search_by: str = 'customer_name') -> List[Dict]:
     """
     البحث في الطلبات
     
+    الاسم والمدينة والعنوان عبر FTS5 (بدايات الكلمات) ثم LIKE إذا لم توجد نتائج،
+    حتى يبقى البحث بجزء من الكلمة يعمل. الجوال دائماً بـ LIKE (أي جزء من الرقم)
+    وبالصيغتين 05xxxxxxxx و 9665xxxxxxxx.
+    
     Args:
         query: نص البحث
         search_by: الحقل المراد البحث فيه (customer_name, phone, city, order_number)
@@ -112,7 +794,7 @@ def search_orders(query: str, search_by: str = 'customer_name') -> List[Dict]:
         cursor = conn.cursor()
         
         if search_by == 'order_number':
-            cursor.execute(f'''
+            cursor.execute('''
                 SELECT 
                     order_number, customer_name, total_amount, city, 
                     order_date, status, phone
@@ -120,18 +802,25 @@ def search_orders(query: str, search_by: str = 'customer_name') -> List[Dict]:
                 WHERE order_number = ?
                 LIMIT 100
             ''', (query,))
-        else:
+        elif search_by in SEARCH_COLUMNS:
+            if search_by not in _TEXT_ID_COLUMNS and _has_search_index(cursor):
+                orders = search_orders_fts(query, columns=[search_by])
+                if orders:
+                    return orders
+            
+            patterns = _phone_variants(query.strip()) if search_by in _TEXT_ID_COLUMNS else [query]
             cursor.execute(f'''
                 SELECT 
                     order_number, customer_name, total_amount, city, 
                     order_date, status, phone
                 FROM orders
-                WHERE {search_by} LIKE ?
+                WHERE {' OR '.join([f'{search_by} LIKE ?'] * len(patterns))}
                 LIMIT 100
-            ''', (f'%{query}%',))
+            ''', [f'%{pattern}%' for pattern in patterns])
+        else:
+            return []
         
-        columns = ['رقم الطلب', 'اسم العميل', 'المبلغ', 'المدينة', 'التاريخ', 'الحالة', 'الهاتف']
-        orders = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        orders = [dict(zip(PAGE_COLUMNS, row)) for row in cursor.fetchall()]
         
         return orders
     
@@ -140,21 +829,19 @@ def search_orders(query: str, search_by: str = 'customer_name') -> List[Dict]:
         return []
 
 
-@st.cache_data(ttl=600)
+@tagged_cache('orders', ttl=600)
 def get_orders_by_city() -> pd.DataFrame:
-    """الحصول على إحصائيات الطلبات حسب المدينة"""
+    """الحصول على إحصائيات الطلبات حسب المدينة (من جدول التجميع)"""
     try:
         conn = get_db_connection()
         query = '''
             SELECT 
                 city as المدينة,
-                COUNT(*) as عدد_الطلبات,
-                SUM(total_amount) as إجمالي_المبيعات,
-                AVG(total_amount) as متوسط_قيمة_الطلب
-            FROM orders
-            WHERE city IS NOT NULL AND city != ''
-            GROUP BY city
-            ORDER BY عدد_الطلبات DESC
+                orders_count as عدد_الطلبات,
+                total_amount as إجمالي_المبيعات,
+                total_amount / orders_count as متوسط_قيمة_الطلب
+            FROM orders_city_rollup
+            ORDER BY orders_count DESC
             LIMIT 20
         '''
         return pd.read_sql_query(query, conn)
@@ -163,20 +850,18 @@ def get_orders_by_city() -> pd.DataFrame:
         return pd.DataFrame()
 
 
-@st.cache_data(ttl=600)
+@tagged_cache('orders', ttl=600)
 def get_orders_by_month() -> pd.DataFrame:
-    """الحصول على إحصائيات الطلبات حسب الشهر"""
+    """الحصول على إحصائيات الطلبات حسب الشهر (من جدول التجميع)"""
     try:
         conn = get_db_connection()
         query = '''
             SELECT 
-                strftime('%Y-%m', order_date) as الشهر,
-                COUNT(*) as عدد_الطلبات,
-                SUM(total_amount) as إجمالي_المبيعات
-            FROM orders
-            WHERE order_date IS NOT NULL AND order_date != ''
-            GROUP BY strftime('%Y-%m', order_date)
-            ORDER BY الشهر DESC
+                month as الشهر,
+                orders_count as عدد_الطلبات,
+                total_amount as إجمالي_المبيعات
+            FROM orders_monthly_rollup
+            ORDER BY month DESC
             LIMIT 12
         '''
         return pd.read_sql_query(query, conn)
@@ -185,24 +870,42 @@ def get_orders_by_month() -> pd.DataFrame:
         return pd.DataFrame()
 
 
-@st.cache_data(ttl=600)
+@tagged_cache('orders', ttl=600)
+def get_orders_by_day(days: int = 30) -> pd.DataFrame:
+    """الحصول على إحصائيات الطلبات اليومية لآخر عدد من الأيام (من جدول التجميع)"""
+    try:
+        conn = get_db_connection()
+        query = '''
+            SELECT 
+                day as اليوم,
+                orders_count as عدد_الطلبات,
+                total_amount as إجمالي_المبيعات
+            FROM orders_daily_rollup
+            ORDER BY day DESC
+            LIMIT ?
+        '''
+        return pd.read_sql_query(query, conn, params=(days,))
+    except Exception as e:
+        st.error(f"خطأ في الحصول على الإحصائيات اليومية: {e}")
+        return pd.DataFrame()
+
+
+@tagged_cache('orders', ttl=600)
 def get_top_customers(limit: int = 10) -> pd.DataFrame:
-    """الحصول على أفضل العملاء"""
+    """الحصول على أفضل العملاء (من جدول التجميع)"""
     try:
         conn = get_db_connection()
-        query = f'''
+        query = '''
             SELECT 
                 customer_name as اسم_العميل,
-                COUNT(*) as عدد_الطلبات,
-                SUM(total_amount) as إجمالي_المشتريات,
+                orders_count as عدد_الطلبات,
+                total_amount as إجمالي_المشتريات,
                 city as المدينة
-            FROM orders
-            WHERE customer_name IS NOT NULL AND customer_name != ''
-            GROUP BY customer_name
-            ORDER BY إجمالي_المشتريات DESC
-            LIMIT {limit}
+            FROM orders_customer_rollup
+            ORDER BY total_amount DESC
+            LIMIT ?
         '''
-        return pd.read_sql_query(query, conn)
+        return pd.read_sql_query(query, conn, params=(limit,))
     except Exception as e:
         st.error(f"خطأ في الحصول على أفضل العملاء: {e}")
         return pd.DataFrame()
@@ -227,8 +930,8 @@ def get_order_details(order_number: int) -> Optional[Dict]:
 
 
 def clear_cache():
-    """مسح الـ cache لجميع الدوال"""
-    st.cache_data.clear()
+    """مسح الـ cache لدوال الطلبات"""
+    clear_orders_cache()
     st.success("✅ تم مسح الـ cache بنجاح!")
 
 
@@ -237,103 +940,589 @@ def clear_cache():
 def get_all_orders() -> List[Dict]:
     """الحصول على جميع الطلبات بصيغة قائمة من القواميس (متوافق مع JSON القديم)"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # جلب جميع الطلبات (استخدام أسماء الأعمدة الصحيحة)
-        cursor.execute('''
-            SELECT 
-                order_number,
-                customer_name,
-                phone,
-                city,
-                total_amount,
-                status,
-                payment_method,
-                order_date
-            FROM orders
-            ORDER BY id DESC
-        ''')
-        
-        rows = cursor.fetchall()
-        
-        # تحويل إلى قائمة من القواميس بنفس أسماء الحقول القديمة
-        orders = []
-        for row in rows:
-            orders.append({
-                'رقم الطلب': row[0],
-                'اسم العميل': row[1],
-                'رقم الهاتف': row[2],
-                'المدينة': row[3],
-                'المبلغ الاجمالي': row[4],
-                'حالة الطلب': row[5],
-                ' طريقة الدفع': row[6],  # مع المسافة كما في JSON القديم
-                'تاريخ الطلب': row[7]
-            })
-        
-        return orders
-        
+        return list(iter_orders())
     except Exception as e:
         st.error(f"خطأ في الحصول على الطلبات: {e}")
         return []
 
 
+def _build_orders_filter(cities: Optional[List[str]] = None,
+                         statuses: Optional[List[str]] = None,
+                         payments: Optional[List[str]] = None,
+                         min_amount: Optional[float] = None,
+                         max_amount: Optional[float] = None,
+                         inclusive: bool = True) -> Tuple[str, list]:
+    """بناء جملة WHERE ومعاملاتها (None أو قائمة فارغة = بدون فلتر)"""
+    conditions = []
+    params: list = []
+
+    for column, values in (('city', cities), ('status', statuses), ('payment_method', payments)):
+        if values:
+            values = list(values)
+            conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
 
+    if min_amount is not None:
+        conditions.append('total_amount >= ?' if inclusive else 'total_amount > ?')
+        params.append(min_amount)
+    if max_amount is not None:
+        conditions.append('total_amount <= ?' if inclusive else 'total_amount < ?')
+        params.append(max_amount)
 
-def save_orders(orders: List[Dict]) -> bool:
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return where, params
+
+
+def _select_columns(columns: Optional[List[str]]) -> List[str]:
+    """التحقق من الأعمدة المطلوبة (الافتراضي: أعمدة JSON القديم)"""
+    if not columns:
+        return list(LEGACY_COLUMNS)
+    allowed = {column for column, _ in ORDER_COLUMNS}
+    invalid = [column for column in columns if column not in allowed]
+    if invalid:
+        raise ValueError(f"أعمدة غير معروفة: {invalid}")
+    return list(columns)
+
+
+def iter_orders(cities: Optional[List[str]] = None,
+                statuses: Optional[List[str]] = None,
+                payments: Optional[List[str]] = None,
+                min_amount: Optional[float] = None,
+                max_amount: Optional[float] = None,
+                inclusive: bool = True,
+                columns: Optional[List[str]] = None,
+                chunk_size: int = 1000) -> Iterator[Dict]:
     """
-    حفظ أو تحديث الطلبات في قاعدة البيانات
+    جلب الطلبات المطابقة للفلاتر صفاً بصف (للتصدير)
+    
+    تُقرأ النتائج على دفعات بـ fetchmany، فالذاكرة تتناسب مع حجم الدفعة
+    وليس مع حجم الجدول.
     
     Args:
-        orders: قائمة من القواميس تحتوي على بيانات الطلبات
+        cities / statuses / payments: القيم المطلوبة (None أو فارغة = الكل)
+        min_amount / max_amount: حدود المبلغ الاجمالي (None = بدون حد)
+        inclusive: هل الحدود شاملة
+        columns: أعمدة جدول orders المطلوبة (الافتراضي: أعمدة JSON القديم)
+        chunk_size: عدد الصفوف في كل دفعة
+    
+    Yields:
+        قاموس لكل طلب بمفاتيح JSON القديم (أو اسم العمود إن لم يكن له مفتاح)
+    """
+    selected = _select_columns(columns)
+    keys = [LEGACY_COLUMNS.get(column, column) for column in selected]
+    where, params = _build_orders_filter(cities, statuses, payments, min_amount, max_amount, inclusive)
+
+    cursor = get_db_connection().cursor()
+    try:
+        cursor.execute(f"SELECT {', '.join(selected)} FROM orders {where} ORDER BY id DESC", params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(keys, row))
+    finally:
+        cursor.close()
+
+
+@tagged_cache('orders', ttl=300)
+def query_orders(cities: Optional[List[str]] = None,
+                 statuses: Optional[List[str]] = None,
+                 payments: Optional[List[str]] = None,
+                 min_amount: Optional[float] = None,
+                 max_amount: Optional[float] = None,
+                 inclusive: bool = True,
+                 columns: Optional[List[str]] = None,
+                 limit: Optional[int] = None) -> List[Dict]:
+    """
+    جلب الطلبات المطابقة للفلاتر فقط (الفلترة داخل SQLite)
+    
+    Args:
+        نفس معاملات iter_orders، و limit: الحد الأقصى لعدد الصفوف (None = الكل)
     
     Returns:
-        True إذا نجحت العملية، False إذا فشلت
+        قائمة من القواميس بمفاتيح JSON القديم
     """
+    try:
+        rows = iter_orders(cities, statuses, payments, min_amount, max_amount, inclusive, columns)
+        if limit is None:
+            return list(rows)
+        return [row for _, row in zip(range(limit), rows)]
+    except Exception as e:
+        st.error(f"خطأ في جلب الطلبات: {e}")
+        return []
+
+
+@tagged_cache('orders', ttl=300)
+def get_orders_summary(cities: Optional[List[str]] = None,
+                       statuses: Optional[List[str]] = None,
+                       payments: Optional[List[str]] = None,
+                       min_amount: Optional[float] = None,
+                       max_amount: Optional[float] = None,
+                       inclusive: bool = True) -> Dict:
+    """
+    مقاييس الطلبات المطابقة للفلاتر في استعلام واحد
+    
+    Returns:
+        {'total_customers', 'total_value', 'unique_phones', 'avg_order', 'cities'}
+    """
+    where, params = _build_orders_filter(cities, statuses, payments, min_amount, max_amount, inclusive)
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        
-        # إنشاء الجدول إذا لم يكن موجوداً
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_number TEXT UNIQUE,
-                customer_name TEXT,
-                phone TEXT,
-                city TEXT,
-                total_amount REAL,
-                status TEXT,
-                payment_method TEXT,
-                order_date TEXT
+        cursor.execute(f'''
+            SELECT
+                COUNT(*),
+                COALESCE(SUM(total_amount), 0),
+                COUNT(DISTINCT NULLIF(phone, '')),
+                COUNT(DISTINCT NULLIF(city, ''))
+            FROM orders {where}
+        ''', params)
+        total, total_value, unique_phones, cities_count = cursor.fetchone()
+        return {
+            'total_customers': total,
+            'total_value': float(total_value),
+            'unique_phones': unique_phones,
+            'avg_order': total_value / total if total else 0.0,
+            'cities': cities_count,
+        }
+    except Exception as e:
+        st.error(f"خطأ في حساب إحصائيات الطلبات: {e}")
+        return {'total_customers': 0, 'total_value': 0.0, 'unique_phones': 0, 'avg_order': 0.0, 'cities': 0}
+
+
+SEGMENT_FILTER_KEYS = ('cities', 'statuses', 'payments', 'min_amount', 'max_amount', 'inclusive')
+
+
+def _segment_filter(query: Optional[Dict]) -> Tuple[str, list]:
+    """شروط جمهور الحملة على orders (مع استبعاد الطلبات بدون رقم)"""
+    where, params = _build_orders_filter(**{key: query[key] for key in SEGMENT_FILTER_KEYS if key in query})
+    return (f'{where} AND order_number IS NOT NULL' if where else 'WHERE order_number IS NOT NULL'), params
+
+
+def _update_segment_row(conn: sqlite3.Connection, campaign_id: int, seq: int):
+    conn.execute('''
+        UPDATE campaign_segments SET
+            change_seq = ?,
+            members_count = (SELECT COUNT(*) FROM campaign_members WHERE campaign_id = ?),
+            refreshed_at = datetime('now', 'localtime')
+        WHERE campaign_id = ?
+    ''', (seq, campaign_id, campaign_id))
+
+
+def materialize_segment(campaign_id: int, query: Optional[Dict] = None,
+                        order_numbers: Optional[Iterable[int]] = None) -> int:
+    """
+    حفظ جمهور حملة في campaign_members (يستبدل أي قائمة سابقة لنفس الحملة)
+
+    Args:
+        campaign_id: معرّف الحملة في moraselaty_campaigns.json
+        query: معاملات الفلترة (cities, statuses, payments, min_amount, max_amount, inclusive)؛
+               الجمهور يُحدَّث لاحقاً مع تغير الطلبات (refresh_segment)
+        order_numbers: قائمة ثابتة من أرقام الطلبات (الحملات القديمة بدون فلاتر)
+
+    Returns:
+        عدد الطلبات في الجمهور
+    """
+    conn = get_db_connection()
+    with conn:
+        # BEGIN IMMEDIATE: لا يتغير orders بين قراءة seq وبناء القائمة
+        conn.execute('BEGIN IMMEDIATE')
+        seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM orders_changes').fetchone()[0]
+        conn.execute('DELETE FROM campaign_members WHERE campaign_id = ?', (campaign_id,))
+        if query is not None:
+            where, params = _segment_filter(query)
+            conn.execute(f'''
+                INSERT INTO campaign_members (campaign_id, order_number, phone)
+                SELECT ?, order_number, phone FROM orders {where}
+            ''', [campaign_id] + params)
+        else:
+            conn.executemany('''
+                INSERT OR IGNORE INTO campaign_members (campaign_id, order_number, phone)
+                SELECT ?, order_number, phone FROM orders WHERE order_number = ?
+            ''', ((campaign_id, number) for number in order_numbers or []))
+        conn.execute('''
+            INSERT INTO campaign_segments (campaign_id, filters, refreshed_at)
+            VALUES (?, ?, datetime('now', 'localtime'))
+            ON CONFLICT(campaign_id) DO UPDATE SET filters = excluded.filters
+        ''', (campaign_id, None if query is None else json.dumps(query, ensure_ascii=False)))
+        _update_segment_row(conn, campaign_id, seq)
+        return conn.execute('SELECT members_count FROM campaign_segments WHERE campaign_id = ?',
+                            (campaign_id,)).fetchone()[0]
+
+
+def refresh_segment(campaign_id: int) -> Optional[int]:
+    """
+    تحديث جمهور حملة بالطلبات التي تغيرت فقط منذ آخر تحديث (من orders_changes)
+
+    الطلبات المتغيرة تُحذف من القائمة ثم يُعاد فحصها بفلاتر الحملة؛ القوائم
+    الثابتة تحذف الطلبات المحذوفة وتحدّث أرقام الهاتف فقط.
+
+    Returns:
+        عدد الطلبات المتغيرة التي أُعيد فحصها، أو None إن لم تكن الحملة محفوظة
+    """
+    conn = get_db_connection()
+    row = conn.execute('SELECT change_seq FROM campaign_segments WHERE campaign_id = ?', (campaign_id,)).fetchone()
+    if row is None:
+        return None
+    if row[0] == get_change_seq():
+        return 0
+
+    with conn:
+        conn.execute('BEGIN IMMEDIATE')
+        filters, since = conn.execute(
+            'SELECT filters, change_seq FROM campaign_segments WHERE campaign_id = ?', (campaign_id,)
+        ).fetchone()
+        seq, changed = conn.execute(
+            'SELECT COALESCE(MAX(seq), 0), COUNT(*) FROM orders_changes WHERE seq > ?', (since,)
+        ).fetchone()
+        changed_orders = 'order_number IN (SELECT order_number FROM orders_changes WHERE seq > ?)'
+
+        if filters is not None:
+            conn.execute(f'DELETE FROM campaign_members WHERE campaign_id = ? AND {changed_orders}',
+                         (campaign_id, since))
+            where, params = _segment_filter(json.loads(filters))
+            conn.execute(f'''
+                INSERT INTO campaign_members (campaign_id, order_number, phone)
+                SELECT ?, order_number, phone FROM orders {where} AND {changed_orders}
+            ''', [campaign_id] + params + [since])
+        else:
+            conn.execute(f'''
+                DELETE FROM campaign_members
+                WHERE campaign_id = ? AND {changed_orders}
+                  AND NOT EXISTS (SELECT 1 FROM orders WHERE orders.order_number = campaign_members.order_number)
+            ''', (campaign_id, since))
+            conn.execute(f'''
+                UPDATE campaign_members SET phone = orders.phone
+                FROM orders
+                WHERE campaign_members.campaign_id = ? AND orders.order_number = campaign_members.order_number
+                  AND campaign_members.{changed_orders}
+            ''', (campaign_id, since))
+        _update_segment_row(conn, campaign_id, seq)
+    return changed
+
+
+def refresh_segments() -> int:
+    """تحديث كل الحملات المحفوظة المتأخرة عن سجل التغييرات (مثلاً بعد رفع ملف طلبات)"""
+    seq = get_change_seq()
+    stale = get_db_connection().execute(
+        'SELECT campaign_id FROM campaign_segments WHERE change_seq < ?', (seq,)
+    ).fetchall()
+    for (campaign_id,) in stale:
+        refresh_segment(campaign_id)
+    return len(stale)
+
+
+def get_segment_info(campaign_id: int) -> Optional[Dict]:
+    """بيانات جمهور الحملة المحفوظ: {'filters', 'change_seq', 'members_count', 'refreshed_at'}، أو None"""
+    cursor = get_db_connection().execute(
+        'SELECT filters, change_seq, members_count, refreshed_at FROM campaign_segments WHERE campaign_id = ?',
+        (campaign_id,)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    info = dict(zip([column[0] for column in cursor.description], row))
+    info['filters'] = json.loads(info['filters']) if info['filters'] else None
+    return info
+
+
+def get_segments_info() -> Dict[int, Dict]:
+    """بيانات كل الجماهير المحفوظة باستعلام واحد: {campaign_id: نفس مفاتيح get_segment_info}"""
+    cursor = get_db_connection().execute(
+        'SELECT campaign_id, filters, change_seq, members_count, refreshed_at FROM campaign_segments'
+    )
+    columns = [column[0] for column in cursor.description][1:]
+    segments = {}
+    for row in cursor.fetchall():
+        info = dict(zip(columns, row[1:]))
+        info['filters'] = json.loads(info['filters']) if info['filters'] else None
+        segments[row[0]] = info
+    return segments
+
+
+def iter_segment_orders(campaign_id: int, columns: Optional[List[str]] = None,
+                        chunk_size: int = 1000) -> Iterator[Dict]:
+    """
+    طلبات جمهور حملة محفوظ (نفس صيغة iter_orders) عبر فهرس campaign_members
+    """
+    selected = _select_columns(columns)
+    keys = [LEGACY_COLUMNS.get(column, column) for column in selected]
+
+    cursor = get_db_connection().cursor()
+    try:
+        cursor.execute(f'''
+            SELECT {', '.join(f'o.{column}' for column in selected)}
+            FROM campaign_members m
+            JOIN orders o ON o.order_number = m.order_number
+            WHERE m.campaign_id = ?
+            ORDER BY o.id DESC
+        ''', (campaign_id,))
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(zip(keys, row))
+    finally:
+        cursor.close()
+
+
+def get_segment_summary(campaign_id: int) -> Dict:
+    """
+    مقاييس جمهور حملة محفوظ (نفس مفاتيح get_orders_summary)
+    """
+    try:
+        cursor = get_db_connection().execute('''
+            SELECT
+                COUNT(*),
+                COALESCE(SUM(o.total_amount), 0),
+                COUNT(DISTINCT NULLIF(o.phone, '')),
+                COUNT(DISTINCT NULLIF(o.city, ''))
+            FROM campaign_members m
+            JOIN orders o ON o.order_number = m.order_number
+            WHERE m.campaign_id = ?
+        ''', (campaign_id,))
+        total, total_value, unique_phones, cities_count = cursor.fetchone()
+        return {
+            'total_customers': total,
+            'total_value': float(total_value),
+            'unique_phones': unique_phones,
+            'avg_order': total_value / total if total else 0.0,
+            'cities': cities_count,
+        }
+    except Exception as e:
+        st.error(f"خطأ في حساب إحصائيات الحملة: {e}")
+        return {'total_customers': 0, 'total_value': 0.0, 'unique_phones': 0, 'avg_order': 0.0, 'cities': 0}
+
+
+def get_segment_overlap(campaign_a: int, campaign_b: int) -> Dict:
+    """
+    التداخل بين جمهوري حملتين حسب رقم الهاتف (من فهرس campaign_members فقط)
+
+    Returns:
+        {'a', 'b', 'shared', 'jaccard'}: الأرقام الفريدة في كل حملة، المشتركة، ونسبة التشابه
+    """
+    phones = "SELECT DISTINCT phone FROM campaign_members WHERE campaign_id = {} AND phone IS NOT NULL AND phone != ''"
+    try:
+        a, b, shared = get_db_connection().execute(f'''
+            SELECT
+                (SELECT COUNT(*) FROM ({phones.format(':a')})),
+                (SELECT COUNT(*) FROM ({phones.format(':b')})),
+                (SELECT COUNT(*) FROM ({phones.format(':a')} INTERSECT {phones.format(':b')}))
+        ''', {'a': campaign_a, 'b': campaign_b}).fetchone()
+        union = a + b - shared
+        return {'a': a, 'b': b, 'shared': shared, 'jaccard': shared / union if union else 0.0}
+    except Exception as e:
+        st.error(f"خطأ في حساب تداخل الحملات: {e}")
+        return {'a': 0, 'b': 0, 'shared': 0, 'jaccard': 0.0}
+
+
+def delete_segment(campaign_id: int):
+    """حذف جمهور حملة محفوظ"""
+    conn = get_db_connection()
+    with conn:
+        conn.execute('DELETE FROM campaign_members WHERE campaign_id = ?', (campaign_id,))
+        conn.execute('DELETE FROM campaign_segments WHERE campaign_id = ?', (campaign_id,))
+
+
+@tagged_cache('orders', ttl=600)
+def get_distinct_values(column: str) -> List[str]:
+    """
+    القيم المميزة لعمود فلتر (city / status / payment_method) مرتبة
+    """
+    if column not in FILTER_COLUMNS:
+        st.error(f"عمود فلتر غير صالح: {column}")
+        return []
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT DISTINCT {column} FROM orders
+            WHERE {column} IS NOT NULL AND {column} != ''
+            ORDER BY {column}
+        """)
+        return [str(row[0]) for row in cursor.fetchall()]
+    except Exception as e:
+        st.error(f"خطأ في جلب قيم الفلتر: {e}")
+        return []
+
+
+def _clean_value(value: Any) -> Any:
+    """تحويل القيم الفارغة (None / NaN / نص فارغ) إلى None"""
+    if value is None:
+        return None
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, str) and not value.strip():
+        return None
+    if hasattr(value, 'isoformat'):
+        # pandas.Timestamp / datetime
+        return str(value)
+    return value
+
+
+def _normalize_order(order: Dict) -> Optional[tuple]:
+    """
+    تحويل قاموس الطلب (بالمفاتيح العربية) إلى صف بترتيب ORDER_COLUMNS
+
+    Returns:
+        صف جاهز للإدراج، أو None إذا لم يكن للطلب رقم
+    """
+    row = []
+    for column, keys in ORDER_COLUMNS:
+        value = None
+        for key in keys:
+            value = _clean_value(order.get(key))
+            if value is not None:
+                break
+
+        if value is not None:
+            if column == 'order_number':
+                try:
+                    value = int(float(value))
+                except (TypeError, ValueError):
+                    value = str(value)
+            elif column in _NUMERIC_COLUMNS:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    value = None
+            elif column in _TEXT_ID_COLUMNS:
+                if isinstance(value, float) and value.is_integer():
+                    value = int(value)
+                value = str(value)
+
+        row.append(value)
+
+    if row[0] is None:
+        return None
+    return tuple(row)
+
+
+def clear_orders_cache():
+    """إبطال الـ cache الخاص بدوال الطلبات فقط (tag: orders) بدون المساس بباقي التطبيق"""
+    invalidate('orders')
+
+
+def bulk_upsert_orders(orders: Iterable[Dict], batch_size: int = 1000,
+                       progress_callback: Optional[Callable[[int, int], None]] = None,
+                       total: Optional[int] = None) -> Optional[Dict]:
+    """
+    إدراج/تحديث الطلبات دفعة واحدة داخل معاملة (transaction) واحدة
+
+    يتم تحميل الطلبات على دفعات (executemany) إلى جدول مؤقت، ثم دمجها مع
+    جدول orders بجملة SQL واحدة حسب order_number. الأعمدة الفارغة في الملف
+    الجديد لا تمسح القيم الموجودة، والطلبات غير المتغيرة لا يُعاد كتابتها.
+
+    Args:
+        orders: قائمة أو أي iterable من القواميس (مثل iter_excel_orders) تُقرأ دفعة دفعة
+        batch_size: عدد الصفوف في كل دفعة
+        progress_callback: دالة تُستدعى بعد كل دفعة (عدد الصفوف المعالجة, الإجمالي)
+        total: العدد المتوقع للتقدم إذا لم تكن orders قائمة (None = غير معروف)
+
+    Returns:
+        تقرير {'inserted', 'updated', 'unchanged', 'skipped', 'total'} أو None عند الفشل
+    """
+    columns = [column for column, _ in ORDER_COLUMNS]
+    column_list = ', '.join(columns)
+    placeholders = ', '.join('?' for _ in columns)
+    data_columns = columns[1:]
+
+    # الطلب يُعتبر متغيراً إذا اختلفت أي قيمة غير فارغة في الملف الجديد
+    changed = ' OR '.join(
+        f'(s.{col} IS NOT NULL AND s.{col} IS NOT o.{col})' for col in data_columns
+    )
+    changed_on_conflict = ' OR '.join(
+        f'(excluded.{col} IS NOT NULL AND excluded.{col} IS NOT orders.{col})' for col in data_columns
+    )
+    assignments = ', '.join(
+        f'{col} = COALESCE(excluded.{col}, orders.{col})' for col in data_columns
+    )
+
+    if total is None and hasattr(orders, '__len__'):
+        total = len(orders)
+    report = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'total': 0}
+    orders = iter(orders)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute('BEGIN')
+        cursor.execute('DROP TABLE IF EXISTS temp.orders_staging')
+        cursor.execute(ORDERS_TABLE_SQL.format(
+            table='temp.orders_staging',
+            id_column='',
+            extra_columns=', UNIQUE (order_number)'
+        ))
+
+        # 1) تحميل الدفعات إلى الجدول المؤقت (أول ظهور للطلب هو المعتمد)
+        processed = 0
+        while True:
+            batch = list(itertools.islice(orders, batch_size))
+            if not batch:
+                break
+            processed += len(batch)
+            rows = [_normalize_order(order) for order in batch]
+            rows = [row for row in rows if row is not None]
+
+            cursor.executemany(
+                f'INSERT OR IGNORE INTO temp.orders_staging ({column_list}) VALUES ({placeholders})',
+                rows
             )
+
+            if progress_callback:
+                progress_callback(processed, max(total or 0, processed))
+        report['total'] = processed
+
+        # 2) حساب التقرير قبل الدمج
+        cursor.execute(f'''
+            SELECT
+                COALESCE(SUM(o.id IS NULL), 0),
+                COALESCE(SUM(o.id IS NOT NULL AND ({changed})), 0),
+                COUNT(*)
+            FROM temp.orders_staging s
+            LEFT JOIN orders o ON o.order_number = s.order_number
         ''')
-        
-        # حفظ الطلبات
-        for order in orders:
-            cursor.execute('''
-                INSERT OR REPLACE INTO orders 
-                (order_number, customer_name, phone, city, total_amount, status, payment_method, order_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                order.get('رقم الطلب', ''),
-                order.get('اسم العميل', ''),
-                order.get('رقم الهاتف', ''),
-                order.get('المدينة', ''),
-                float(order.get('المبلغ الاجمالي', 0) or 0),
-                order.get('حالة الطلب', ''),
-                order.get(' طريقة الدفع', ''),  # مع المسافة
-                order.get('تاريخ الطلب', '')
-            ))
-        
+        inserted, updated, staged = cursor.fetchone()
+        report['inserted'] = inserted
+        report['updated'] = updated
+        report['unchanged'] = staged - inserted - updated
+        # الصفوف بدون رقم طلب أو المكررة داخل الملف نفسه
+        report['skipped'] = processed - staged
+
+        # 3) الدمج بجملة واحدة
+        cursor.execute(f'''
+            INSERT INTO orders ({column_list})
+            SELECT {column_list} FROM temp.orders_staging WHERE true
+            ON CONFLICT(order_number) DO UPDATE SET {assignments}
+            WHERE {changed_on_conflict}
+        ''')
+
+        cursor.execute('DROP TABLE temp.orders_staging')
         conn.commit()
-        
-        # مسح الـ cache بعد التحديث
-        st.cache_data.clear()
-        
-        return True
-        
+
     except Exception as e:
+        conn.rollback()
         st.error(f"خطأ في حفظ الطلبات: {e}")
-        return False
+        return None
 
+    # مسح الـ cache الخاص بالطلبات فقط
+    clear_orders_cache()
+
+    return report
+
+
+def save_orders(orders: List[Dict], progress_callback: Optional[Callable[[int, int], None]] = None) -> bool:
+    """
+    حفظ أو تحديث الطلبات في قاعدة البيانات
+    
+    Args:
+        orders: قائمة من القواميس تحتوي على بيانات الطلبات
+        progress_callback: دالة اختيارية لعرض التقدم (عدد الصفوف المعالجة, الإجمالي)
+    
+    Returns:
+        True إذا نجحت العملية، False إذا فشلت
+    """
+    return bulk_upsert_orders(orders, progress_callback=progress_callback) is not None
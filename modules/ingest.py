@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة استيراد ملفات Excel على دفعات (مراسلاتي والجرد)
+Argan Smart Generator
+
+- قراءة ملفات xlsx صفاً بصف عبر openpyxl (read_only) بدلاً من pd.read_excel
+  للملف كاملاً، فالذاكرة تتناسب مع حجم الدفعة وليس مع حجم الملف.
+- توحيد أسماء الأعمدة (حذف المسافات الزائدة) وتحويل الأعمدة الرقمية.
+- منع التكرار يتم داخل SQLite حسب رقم الطلب (bulk_upsert_orders) بدون تحميل
+  جدول الطلبات إلى الذاكرة.
+- قاعدة البيانات هي المصدر الوحيد؛ moraselaty_customers.json تصدير اختياري
+  يُكتب (متدفقاً) عند طلبه فقط وإذا سجّل orders_changes تغييراً بعد آخر تصدير.
+
+ملفات xls القديمة لا يدعمها openpyxl، فتُقرأ بـ pandas (بدون حد للذاكرة).
+"""
+
+import itertools
+import json
+import os
+import tempfile
+from datetime import datetime
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Union
+
+import openpyxl
+import pandas as pd
+
+from modules.database import (
+    ORDER_COLUMNS, bulk_upsert_orders, get_change_seq, get_export_seq, get_orders_count, iter_orders,
+    record_export,
+)
+
+
+EXCEL_CHUNK_SIZE = 2000
+
+ExcelSource = Union[str, IO[bytes]]
+
+
+def _source_name(source: ExcelSource) -> str:
+    return source if isinstance(source, str) else getattr(source, 'name', '')
+
+
+def _rewind(source: ExcelSource):
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+
+def normalize_header(header: Any) -> Optional[str]:
+    """اسم العمود بدون مسافات زائدة (' طريقة الدفع' -> 'طريقة الدفع')"""
+    if header is None:
+        return None
+    header = str(header).strip()
+    return header or None
+
+
+def _is_legacy_xls(source: ExcelSource) -> bool:
+    return _source_name(source).lower().endswith('.xls')
+
+
+def iter_excel_chunks(source: ExcelSource, chunk_size: int = EXCEL_CHUNK_SIZE,
+                      sheet: Optional[str] = None) -> Iterator[List[Dict]]:
+    """
+    قراءة ورقة Excel على دفعات من القواميس (الصف الأول = أسماء الأعمدة)
+
+    Args:
+        source: مسار الملف أو ملف مرفوع (st.file_uploader)
+        chunk_size: عدد الصفوف في كل دفعة
+        sheet: اسم الورقة (الافتراضي: الورقة النشطة)
+
+    Yields:
+        قائمة قواميس {اسم العمود: القيمة}، وتُتجاهل الصفوف الفارغة تماماً
+    """
+    _rewind(source)
+    if _is_legacy_xls(source):
+        df = pd.read_excel(source, sheet_name=sheet or 0)
+        df.columns = [normalize_header(column) for column in df.columns]
+        records = df.to_dict('records')
+        for start in range(0, len(records), chunk_size):
+            yield records[start:start + chunk_size]
+        return
+
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        headers = [normalize_header(column) for column in header]
+
+        chunk = []
+        for values in rows:
+            if all(value is None for value in values):
+                continue
+            chunk.append({key: value for key, value in zip(headers, values) if key is not None})
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+def iter_excel_rows(source: ExcelSource, chunk_size: int = EXCEL_CHUNK_SIZE,
+                    sheet: Optional[str] = None) -> Iterator[Dict]:
+    """نفس iter_excel_chunks لكن صفاً بصف"""
+    for chunk in iter_excel_chunks(source, chunk_size, sheet):
+        yield from chunk
+
+
+def count_excel_rows(source: ExcelSource, sheet: Optional[str] = None) -> Optional[int]:
+    """
+    عدد صفوف البيانات التقريبي من أبعاد الورقة (بدون قراءة الصفوف)
+
+    Returns:
+        العدد (بدون صف العناوين)، أو None إن لم تحفظ الورقة أبعادها
+    """
+    if _is_legacy_xls(source):
+        return None
+    _rewind(source)
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        max_row = worksheet.max_row
+        return max(max_row - 1, 0) if max_row else None
+    finally:
+        workbook.close()
+        _rewind(source)
+
+
+def preview_excel(source: ExcelSource, rows: int = 5, sheet: Optional[str] = None) -> pd.DataFrame:
+    """أول صفوف الملف فقط (للمعاينة قبل الاستيراد)"""
+    first = list(itertools.islice(iter_excel_rows(source, chunk_size=rows, sheet=sheet), rows))
+    _rewind(source)
+    return pd.DataFrame(first)
+
+
+def read_excel_frame(source: ExcelSource, numeric_columns: Optional[List[str]] = None,
+                     chunk_size: int = EXCEL_CHUNK_SIZE, sheet: Optional[str] = None) -> pd.DataFrame:
+    """
+    تحميل ورقة كاملة إلى DataFrame من الدفعات (بديل pd.read_excel)
+
+    Args:
+        numeric_columns: أعمدة تُحوّل إلى أرقام (القيم غير الصالحة = NaN)
+
+    Returns:
+        DataFrame بأسماء أعمدة موحدة
+    """
+    frames = [pd.DataFrame(chunk) for chunk in iter_excel_chunks(source, chunk_size, sheet)]
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    for column in numeric_columns or []:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df
+
+
+def ingest_orders_excel(source: ExcelSource, chunk_size: int = EXCEL_CHUNK_SIZE,
+                        progress_callback: Optional[Callable[[int, int], None]] = None) -> Optional[Dict]:
+    """
+    استيراد ملف طلبات مراسلاتي إلى SQLite على دفعات
+
+    الدمج ومنع التكرار حسب رقم الطلب يتمان داخل قاعدة البيانات.
+
+    Args:
+        source: مسار الملف أو ملف مرفوع
+        progress_callback: (عدد الصفوف المعالجة, الإجمالي المتوقع)
+
+    Returns:
+        تقرير bulk_upsert_orders: {'inserted', 'updated', 'unchanged', 'skipped', 'total'}
+    """
+    total = count_excel_rows(source)
+    return bulk_upsert_orders(
+        iter_excel_rows(source, chunk_size),
+        batch_size=chunk_size,
+        progress_callback=progress_callback,
+        total=total,
+    )
+
+
+def export_orders_json(path: str = 'moraselaty_customers.json', chunk_size: int = EXCEL_CHUNK_SIZE) -> int:
+    """
+    كتابة كل الطلبات إلى ملف JSON بنفس صيغة moraselaty_customers.json
+
+    الكتابة متدفقة (طلب بطلب) في ملف مؤقت ثم os.replace، فلا تُحمّل الطلبات
+    كلها في الذاكرة ولا يبقى ملف مقطوع عند انقطاع التشغيل.
+
+    Returns:
+        عدد الطلبات المكتوبة
+    """
+    columns = [column for column, _ in ORDER_COLUMNS]
+    keys = [aliases[0] for _, aliases in ORDER_COLUMNS]
+    seq = get_change_seq()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=directory)
+    count = 0
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            header = {
+                'last_updated': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'total_orders': get_orders_count(),
+            }
+            f.write(json.dumps(header, ensure_ascii=False)[:-1] + ',"orders":[')
+            for order in iter_orders(columns=columns, chunk_size=chunk_size):
+                # iter_orders يعيد الأعمدة بنفس ترتيب columns
+                record = dict(zip(keys, order.values()))
+                f.write((',' if count else '') + json.dumps(record, ensure_ascii=False))
+                count += 1
+            f.write(']}')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    record_export(path, seq)
+    return count
+
+
+def ensure_orders_json_export(path: str = 'moraselaty_customers.json') -> bool:
+    """
+    تحديث ملف JSON فقط إذا تغيرت الطلبات منذ آخر تصدير (أو لم يكن موجوداً)
+
+    Returns:
+        True إذا أُعيد التصدير، False إذا كان الملف محدّثاً
+    """
+    if os.path.exists(path) and get_export_seq(path) == get_change_seq():
+        return False
+    export_orders_json(path)
+    return True
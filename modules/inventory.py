@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة الجرد (Inventory)
+Argan Smart Generator
+
+كل ملف جرد في inventory_files يُستورد مرة واحدة كلقطة (snapshot) في
+database/inventory.db مع إجمالياتها محسوبة مسبقاً:
+
+- inventory_snapshots: لقطة لكل محتوى ملف (بصمة SHA-256) + الإجماليات
+- inventory_imports: كل عملية استيراد (ملف + وقت تعديله)، فإعادة رفع محتوى قديم
+  تجعل لقطته الأحدث دون إعادة تحليل الملف
+- inventory_items: أصناف كل لقطة، مع فهرس جزئي على الأصناف قليلة المخزون
+- العرض مقسم إلى صفحات من SQLite بدلاً من تحميل الجدول وتلوينه صفاً بصف
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import streamlit as st
+
+from modules.cache import invalidate, tagged_cache
+from modules.connection import get_connection
+from modules.workbook_cache import file_hash, load_workbook_frame
+
+
+DB_PATH = 'database/inventory.db'
+INVENTORY_DIR = 'inventory_files'
+
+PRODUCT_COLUMN = 'اسم المنتج'
+QUANTITY_COLUMN = 'كميته'
+
+LOW_STOCK_THRESHOLD = 100   # أقل من هذا = مخزون قليل
+MID_STOCK_THRESHOLD = 500   # أقل من هذا = مخزون متوسط
+
+STOCK_LEVELS = {
+    'low': '🟠 قليل',
+    'mid': '🔵 متوسط',
+    'good': '🟢 جيد',
+}
+
+
+def ensure_inventory_schema(conn: sqlite3.Connection):
+    """إنشاء جداول الجرد وفهارسها"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            content_hash TEXT UNIQUE NOT NULL,
+            source_file TEXT,
+            imported_at TEXT NOT NULL,
+            items_count INTEGER NOT NULL DEFAULT 0,
+            total_quantity REAL NOT NULL DEFAULT 0,
+            low_stock_count INTEGER NOT NULL DEFAULT 0,
+            mid_stock_count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            snapshot_id INTEGER NOT NULL,
+            product_name TEXT NOT NULL,
+            quantity REAL,
+            FOREIGN KEY (snapshot_id) REFERENCES inventory_snapshots(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_imports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            snapshot_id INTEGER NOT NULL,
+            source_file TEXT,
+            imported_at TEXT NOT NULL,
+            UNIQUE (snapshot_id, source_file, imported_at),
+            FOREIGN KEY (snapshot_id) REFERENCES inventory_snapshots(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_inventory_imports_time ON inventory_imports(imported_at, snapshot_id)')
+    # اللقطات المستوردة قبل جدول inventory_imports: استيرادها الأول فقط
+    cursor.execute('''
+        INSERT OR IGNORE INTO inventory_imports (snapshot_id, source_file, imported_at)
+        SELECT id, source_file, imported_at FROM inventory_snapshots
+        WHERE id NOT IN (SELECT snapshot_id FROM inventory_imports)
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_inventory_items_snapshot ON inventory_items(snapshot_id, product_name)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_inventory_items_product ON inventory_items(product_name, snapshot_id)')
+    # الفهرس الجزئي يحتوي الأصناف قليلة المخزون فقط، فالتنبيهات لا تمر على باقي الأصناف
+    cursor.execute(f'''
+        CREATE INDEX IF NOT EXISTS idx_inventory_low_stock
+        ON inventory_items(snapshot_id, quantity)
+        WHERE quantity < {LOW_STOCK_THRESHOLD}
+    ''')
+    conn.commit()
+
+
+def get_db_connection() -> sqlite3.Connection:
+    """اتصال الـ thread الحالي بقاعدة بيانات الجرد"""
+    return get_connection(DB_PATH, ensure_inventory_schema)
+
+
+def _record_import(conn: sqlite3.Connection, snapshot_id: int, source_file: str, imported_at: str) -> bool:
+    """تسجيل عملية استيراد (مرة واحدة لكل ملف ووقت تعديل)؛ True إذا كانت جديدة"""
+    with conn:
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO inventory_imports (snapshot_id, source_file, imported_at)
+            VALUES (?, ?, ?)
+        ''', (snapshot_id, source_file, imported_at))
+    return cursor.rowcount > 0
+
+
+def import_inventory_file(path: str) -> Optional[int]:
+    """
+    استيراد ملف جرد كلقطة جديدة (أو إرجاع اللقطة الموجودة لنفس المحتوى)
+
+    كل رفع للملف (وقت تعديل مختلف) يُسجَّل كعملية استيراد، فتصبح لقطته
+    الأحدث في get_snapshots حتى لو كان محتواها مستورداً من قبل.
+
+    Args:
+        path: مسار ملف Excel يحتوي عمودي 'اسم المنتج' و 'كميته'
+
+    Returns:
+        معرّف اللقطة، أو None عند الفشل
+    """
+    try:
+        content_hash = file_hash(path)
+        source_file = os.path.basename(path)
+        imported_at = datetime.fromtimestamp(os.path.getmtime(path)).strftime("%Y-%m-%d %H:%M:%S")
+        conn = get_db_connection()
+        row = conn.execute('SELECT id FROM inventory_snapshots WHERE content_hash = ?', (content_hash,)).fetchone()
+        if row is not None:
+            if _record_import(conn, row[0], source_file, imported_at):
+                invalidate('inventory')
+            return row[0]
+
+        df = load_workbook_frame(path, numeric_columns=[QUANTITY_COLUMN])
+        missing = [column for column in (PRODUCT_COLUMN, QUANTITY_COLUMN) if column not in df.columns]
+        if missing:
+            raise ValueError(f"أعمدة ناقصة في ملف الجرد: {missing}")
+
+        df = df[df[PRODUCT_COLUMN].notna()]
+        items = [
+            (str(name).strip(), None if quantity != quantity else float(quantity))
+            for name, quantity in zip(df[PRODUCT_COLUMN], df[QUANTITY_COLUMN])
+        ]
+
+        with conn:
+            cursor = conn.execute('''
+                INSERT INTO inventory_snapshots (content_hash, source_file, imported_at)
+                VALUES (?, ?, ?)
+            ''', (content_hash, source_file, imported_at))
+            snapshot_id = cursor.lastrowid
+            conn.execute(
+                'INSERT INTO inventory_imports (snapshot_id, source_file, imported_at) VALUES (?, ?, ?)',
+                (snapshot_id, source_file, imported_at)
+            )
+            conn.executemany(
+                'INSERT INTO inventory_items (snapshot_id, product_name, quantity) VALUES (?, ?, ?)',
+                [(snapshot_id, name, quantity) for name, quantity in items]
+            )
+            # الإجماليات تُحسب مرة واحدة عند الاستيراد
+            conn.execute(f'''
+                UPDATE inventory_snapshots SET
+                    items_count = (SELECT COUNT(*) FROM inventory_items WHERE snapshot_id = :id),
+                    total_quantity = (SELECT COALESCE(SUM(quantity), 0) FROM inventory_items WHERE snapshot_id = :id),
+                    low_stock_count = (SELECT COUNT(*) FROM inventory_items
+                                       WHERE snapshot_id = :id AND quantity < {LOW_STOCK_THRESHOLD}),
+                    mid_stock_count = (SELECT COUNT(*) FROM inventory_items
+                                       WHERE snapshot_id = :id AND quantity >= {LOW_STOCK_THRESHOLD}
+                                         AND quantity < {MID_STOCK_THRESHOLD})
+                WHERE id = :id
+            ''', {'id': snapshot_id})
+
+        invalidate('inventory')
+        return snapshot_id
+    except Exception as e:
+        st.error(f"⚠️ فشل استيراد ملف الجرد: {e}")
+        return None
+
+
+def sync_inventory_files(directory: str = INVENTORY_DIR) -> List[int]:
+    """
+    استيراد ملفات الجرد الجديدة أو المعدلة من المجلد (بترتيب التعديل)
+
+    الملفات المستوردة سابقاً لا يُعاد تحليلها (المقارنة ببصمة المحتوى)، ولا تُسجَّل
+    عملية استيراد جديدة إلا إذا تغير وقت تعديل الملف.
+
+    Returns:
+        معرّفات اللقطات لكل الملفات
+    """
+    if not os.path.isdir(directory):
+        return []
+    paths = sorted(
+        (os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(('.xlsx', '.xls'))),
+        key=os.path.getmtime
+    )
+    return [snapshot_id for snapshot_id in map(import_inventory_file, paths) if snapshot_id is not None]
+
+
+@tagged_cache('inventory', ttl=600)
+def get_snapshots(limit: int = 50) -> List[Dict]:
+    """اللقطات مع إجمالياتها (الأحدث استيراداً أولاً، بملف ووقت آخر استيراد لكل لقطة)"""
+    cursor = get_db_connection().execute('''
+        SELECT s.id, e.source_file, e.imported_at,
+               s.items_count, s.total_quantity, s.low_stock_count, s.mid_stock_count
+        FROM inventory_snapshots s
+        JOIN inventory_imports e ON e.id = (
+            SELECT id FROM inventory_imports WHERE snapshot_id = s.id
+            ORDER BY imported_at DESC, id DESC LIMIT 1
+        )
+        ORDER BY e.imported_at DESC, e.id DESC
+        LIMIT ?
+    ''', (limit,))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def get_latest_snapshot() -> Optional[Dict]:
+    """آخر لقطة مستوردة، أو None"""
+    snapshots = get_snapshots(limit=1)
+    return snapshots[0] if snapshots else None
+
+
+def _stock_level_sql() -> str:
+    return f'''
+        CASE
+            WHEN quantity < {LOW_STOCK_THRESHOLD} THEN '{STOCK_LEVELS['low']}'
+            WHEN quantity < {MID_STOCK_THRESHOLD} THEN '{STOCK_LEVELS['mid']}'
+            ELSE '{STOCK_LEVELS['good']}'
+        END
+    '''
+
+
+def _inventory_filter(snapshot_id: int, low_stock_only: bool = False,
+                      search: Optional[str] = None) -> Tuple[str, list]:
+    """شروط WHERE ومعاملاتها لأصناف لقطة (مشتركة بين العدّ والصفحة)"""
+    conditions = ['snapshot_id = ?']
+    params: list = [snapshot_id]
+    if low_stock_only:
+        conditions.append(f'quantity < {LOW_STOCK_THRESHOLD}')
+    if search:
+        conditions.append("product_name LIKE ? ESCAPE '\\'")
+        escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        params.append(f'%{escaped}%')
+    return ' AND '.join(conditions), params
+
+
+@tagged_cache('inventory', ttl=600)
+def count_inventory_items(snapshot_id: int, low_stock_only: bool = False, search: Optional[str] = None) -> int:
+    """عدد أصناف لقطة المطابقة للفلاتر (لحساب عدد الصفحات)"""
+    where, params = _inventory_filter(snapshot_id, low_stock_only, search)
+    return get_db_connection().execute(f'SELECT COUNT(*) FROM inventory_items WHERE {where}', params).fetchone()[0]
+
+
+@tagged_cache('inventory', ttl=600)
+def get_inventory_page(snapshot_id: int, page: int = 1, page_size: int = 50,
+                       low_stock_only: bool = False, search: Optional[str] = None) -> List[Dict]:
+    """
+    صفحة من أصناف لقطة (مع مستوى المخزون محسوباً في SQLite)
+
+    Args:
+        page: رقم الصفحة (يبدأ من 1)
+        low_stock_only: الأصناف قليلة المخزون فقط (تستخدم الفهرس الجزئي)
+        search: جزء من اسم المنتج
+
+    Returns:
+        صفوف الصفحة (العدد الإجمالي من count_inventory_items)
+    """
+    where, params = _inventory_filter(snapshot_id, low_stock_only, search)
+    cursor = get_db_connection().execute(f'''
+        SELECT product_name, quantity, {_stock_level_sql()} AS level
+        FROM inventory_items
+        WHERE {where}
+        ORDER BY {'quantity' if low_stock_only else 'id'}
+        LIMIT ? OFFSET ?
+    ''', params + [page_size, max(page - 1, 0) * page_size])
+    return [
+        {PRODUCT_COLUMN: name, QUANTITY_COLUMN: quantity, 'المستوى': level}
+        for name, quantity, level in cursor.fetchall()
+    ]
+
+
+@tagged_cache('inventory', ttl=600)
+def get_low_stock(snapshot_id: int, limit: int = 20) -> List[Dict]:
+    """الأصناف قليلة المخزون في لقطة (الأقل كمية أولاً)"""
+    cursor = get_db_connection().execute(f'''
+        SELECT product_name, quantity FROM inventory_items
+        WHERE snapshot_id = ? AND quantity < {LOW_STOCK_THRESHOLD}
+        ORDER BY quantity
+        LIMIT ?
+    ''', (snapshot_id, limit))
+    return [{PRODUCT_COLUMN: name, QUANTITY_COLUMN: quantity} for name, quantity in cursor.fetchall()]
+
+
+@tagged_cache('inventory', ttl=600)
+def get_item_history(product_name: str) -> List[Dict]:
+    """كمية صنف في كل عملية استيراد (الأقدم أولاً)"""
+    cursor = get_db_connection().execute('''
+        SELECT e.imported_at, e.source_file, i.quantity
+        FROM inventory_items i
+        JOIN inventory_imports e ON e.snapshot_id = i.snapshot_id
+        WHERE i.product_name = ?
+        ORDER BY e.imported_at, e.id
+    ''', (product_name,))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def delete_snapshot(snapshot_id: int) -> bool:
+    """حذف لقطة وأصنافها"""
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.execute('DELETE FROM inventory_items WHERE snapshot_id = ?', (snapshot_id,))
+            conn.execute('DELETE FROM inventory_imports WHERE snapshot_id = ?', (snapshot_id,))
+            conn.execute('DELETE FROM inventory_snapshots WHERE id = ?', (snapshot_id,))
+        invalidate('inventory')
+        return True
+    except Exception as e:
+        st.error(f"⚠️ فشل حذف اللقطة: {e}")
+        return False
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة تخزين ملفات JSON (users.json / options.json / ملفات الحملات)
+Argan Smart Generator
+
+- الكتابة في ملف مؤقت بجانب الهدف ثم fsync ثم os.replace، فانقطاع التشغيل
+  أثناء الحفظ لا يترك ملفاً مقطوعاً.
+- قفل استشاري (fcntl.flock) على ملف ‎.lock‎ حتى لا تضيع تعديلات جلستين تحفظان
+  في نفس الوقت؛ update_json يقرأ ويعدّل ويكتب داخل نفس القفل.
+- الحفظ مضغوط (بدون مسافات)، والنسخة المنسقة عبر export_pretty عند الحاجة.
+- القراءة مخزنة حسب (mtime, size, inode) للملف، فأي تعديل على القرص -من هذه
+  الجلسة أو غيرها- يظهر في القراءة التالية مباشرة بدون TTL.
+"""
+
+import copy
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: القفل داخل العملية فقط
+    fcntl = None
+
+
+_cache_lock = threading.Lock()
+_read_cache: Dict[str, Tuple[tuple, Any]] = {}
+_path_locks: Dict[str, threading.Lock] = {}
+
+
+def get_etag(path: str) -> Optional[tuple]:
+    """بصمة الملف (mtime_ns, size, inode)، أو None إن لم يكن موجوداً"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def _path_lock(path: str) -> threading.Lock:
+    with _cache_lock:
+        return _path_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+@contextmanager
+def locked(path: str):
+    """
+    قفل حصري على ملف JSON (بين الـ threads وبين العمليات)
+
+    Example:
+        with locked('users.json'):
+            ...
+    """
+    with _path_lock(path):
+        if fcntl is None:
+            yield
+            return
+        with open(f'{path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _dumps(data: Any, pretty: bool = False) -> str:
+    if pretty:
+        return json.dumps(data, ensure_ascii=False, indent=2)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+def _write(path: str, data: Any, pretty: bool = False):
+    """كتابة ذرية: ملف مؤقت في نفس المجلد + fsync + os.replace"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(_dumps(data, pretty))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    # تثبيت عملية إعادة التسمية نفسها على القرص
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    with _cache_lock:
+        _read_cache.pop(os.path.abspath(path), None)
+
+
+def read_json(path: str, default: Any = None) -> Any:
+    """
+    قراءة ملف JSON (من الـ cache إن لم يتغير الملف على القرص)
+
+    Args:
+        path: مسار الملف
+        default: القيمة عند عدم وجود الملف
+
+    Returns:
+        نسخة مستقلة من المحتوى (تعديلها لا يغيّر الـ cache)
+
+    Raises:
+        json.JSONDecodeError: إذا كان الملف تالفاً
+    """
+    key = os.path.abspath(path)
+    etag = get_etag(path)
+    if etag is None:
+        return copy.deepcopy(default)
+
+    with _cache_lock:
+        cached = _read_cache.get(key)
+    if cached is None or cached[0] != etag:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        cached = (etag, data)
+        with _cache_lock:
+            _read_cache[key] = cached
+    return copy.deepcopy(cached[1])
+
+
+def write_json(path: str, data: Any, pretty: bool = False):
+    """
+    حفظ ذري للملف تحت القفل
+
+    Args:
+        pretty: تنسيق بمسافات (الافتراضي: مضغوط)
+    """
+    with locked(path):
+        _write(path, data, pretty)
+
+
+def update_json(path: str, mutate: Callable[[Any], Any], default: Any = None) -> Any:
+    """
+    قراءة ثم تعديل ثم حفظ داخل قفل واحد (بدون فقدان تعديلات جلسة أخرى)
+
+    Args:
+        mutate: تأخذ المحتوى الحالي وتعدّله في مكانه أو تعيد محتوى جديداً
+        default: المحتوى إن لم يكن الملف موجوداً
+
+    Returns:
+        المحتوى بعد الحفظ
+
+    Example:
+        update_json('moraselaty_campaigns.json',
+                    lambda data: data['campaigns'].append(campaign),
+                    default={'campaigns': []})
+    """
+    with locked(path):
+        data = read_json(path, default)
+        result = mutate(data)
+        if result is not None:
+            data = result
+        _write(path, data)
+    return data
+
+
+def export_pretty(path: str, destination: Optional[str] = None) -> str:
+    """
+    نسخة منسقة (indent=2) من ملف JSON للقراءة أو التنزيل
+
+    Args:
+        destination: مسار حفظ النسخة (اختياري)
+
+    Returns:
+        النص المنسق
+    """
+    text = _dumps(read_json(path), pretty=True)
+    if destination:
+        with open(destination, 'w', encoding='utf-8') as f:
+            f.write(text)
+    return text
+
+
+def clear_read_cache():
+    """مسح cache القراءة (لا يلزم عادة لأن المفتاح هو بصمة الملف)"""
+    with _cache_lock:
+        _read_cache.clear()
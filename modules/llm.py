@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة توليد السيناريوهات بالذكاء الاصطناعي
+Argan Smart Generator
+
+- بناء الـ prompt المستخدم في صفحة إنتاج السيناريوهات
+- توليد دفعة (batch) من السيناريوهات بالتوازي عبر AsyncOpenAI مع حد أقصى
+  للطلبات المتزامنة (semaphore) وإعادة المحاولة مع تأخير أُسّي عند 429 / 5xx
+- base_url قابل للتغيير (أو OPENAI_BASE_URL) حتى يحل خادم محلي محل OpenAI في الاختبارات
+- الطلبات التي سبق توليدها تُقرأ من llm_cache بدون استدعاء API
+- كل طلب يمر بحدود llm_quota (حصة المستخدم + token bucket) ويُسجل في سجل التكلفة
+"""
+
+import asyncio
+import itertools
+import os
+import random
+import time
+from typing import Callable, Dict, List, Optional
+
+import openai
+
+from modules.llm_cache import get_cached, make_key, store_response
+from modules.llm_quota import (
+    QuotaExceeded, acquire_async, check_quota, estimate_tokens, record_call, record_failure, release_quota,
+    settle, throttle,
+)
+
+
+DEFAULT_MODEL = 'gpt-4o-mini'
+DEFAULT_TEMPERATURE = 0.8
+DEFAULT_MAX_TOKENS = 1000
+DEFAULT_CONCURRENCY = 4
+MAX_BATCH_JOBS = 60
+MAX_RETRIES = 4
+BASE_DELAY = 1.0   # ثانية، تتضاعف مع كل محاولة
+MAX_DELAY = 30.0
+
+SYSTEM_PROMPT = "أنت كاتب محتوى تسويقي سعودي محترف ومطلع على سياسات الإعلانات لمنصات التواصل الاجتماعي واشتراطات SFDA."
+
+SFDA_RULES = """
+                    ✅ طبق اشتراطات هيئة الغذاء والدواء السعودية (SFDA):
+                    - يمنع أي ادعاء طبي مثل "يعالج"، "يشفي"، "يقضي على"، "يوقف"، "يمنع"، "يصلح"، "يُجدد".
+                    - استخدم بدائل قانونية مثل: "يساعد"، "يساهم"، "يدعم"، "يعزز"، "يمنح إحساسًا بـ".
+                    - لا تُظهر المنتج كعلاج أو بديل طبي.
+                    - لا تستخدم صور أو عبارات توحي بنتائج مضمونة أو قبل/بعد.
+                    - لا تقلل من شأن المنافسين أو تدّعي أن المنتج "الأفضل".
+                    - لا تذكر أمراض، أعضاء جسمية، أو مصطلحات طبية.
+                    - ركّز على التجربة الحسية والفوائد الواقعية.
+                    """
+
+
+def build_scenario_prompt(product: str, platform: str, scenario: str, tone: str = '',
+                          offer: str = '', shipping: str = '', gift: str = '', cashback: str = '',
+                          inst: str = '', sfda: bool = False) -> str:
+    """
+    بناء prompt سكربت تسويقي لمنتج ومنصة وسيناريو
+
+    Returns:
+        نص الـ prompt (نفس صيغة صفحة إنتاج السيناريوهات)
+    """
+    sfda_rules = SFDA_RULES if sfda else ""
+
+    return f"""
+اكتب سكربت تسويقي احترافي باللهجة السعودية لمنتج {product} على منصة {platform}.
+
+**تفاصيل السيناريو:**
+- السيناريو: {scenario}
+- النبرة: {tone}
+- العرض: {offer}
+- التوصيل: {shipping}
+- الهدية: {gift}
+- الكاش باك: {cashback}
+
+**تعليمات إضافية:** {inst if inst else "لا توجد"}
+
+{sfda_rules}
+
+**المطلوب:**
+- اكتب سكربت جذاب ومقنع
+- استخدم اللهجة السعودية بشكل طبيعي
+- اجعل النص مناسب لمنصة {platform}
+- ركز على الفوائد والقيمة المضافة
+"""
+
+
+def build_messages(prompt: str) -> List[Dict]:
+    """رسائل المحادثة (system + user)"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def build_batch_jobs(products: List[str], platforms: List[str], scenarios: List[str],
+                     **details) -> List[Dict]:
+    """
+    كل تركيبات المنتجات × المنصات × السيناريوهات
+
+    Args:
+        products / platforms / scenarios: القيم المختارة
+        **details: الحقول المشتركة (tone, offer, shipping, gift, cashback, inst, sfda)
+
+    Returns:
+        قائمة مهام: {'product', 'platform', 'scenario', 'prompt'}
+    """
+    jobs = []
+    for product, platform, scenario in itertools.product(products, platforms, scenarios):
+        jobs.append({
+            'product': product,
+            'platform': platform,
+            'scenario': scenario,
+            'prompt': build_scenario_prompt(product, platform, scenario, **details),
+        })
+    return jobs
+
+
+def _is_retryable(error: Exception) -> bool:
+    """429 و 5xx وأخطاء الاتصال تستحق إعادة المحاولة، غيرها لا"""
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+def _retry_delay(error: Exception, attempt: int, base_delay: float) -> float:
+    """مدة الانتظار: Retry-After إن وُجد، وإلا تأخير أُسّي مع jitter"""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), MAX_DELAY)
+        except ValueError:
+            pass
+    delay = base_delay * (2 ** attempt)
+    return min(delay + random.uniform(0, delay / 2), MAX_DELAY)
+
+
+def make_async_client(api_key: Optional[str] = None, base_url: Optional[str] = None,
+                      timeout: float = 60.0) -> 'openai.AsyncOpenAI':
+    """
+    عميل AsyncOpenAI (إعادة المحاولة تتم هنا وليس داخل المكتبة)
+
+    Args:
+        api_key: المفتاح (الافتراضي: openai.api_key ثم OPENAI_API_KEY)
+        base_url: عنوان الخادم (الافتراضي: OPENAI_BASE_URL أو OpenAI)
+    """
+    return openai.AsyncOpenAI(
+        api_key=api_key or openai.api_key or os.getenv('OPENAI_API_KEY'),
+        base_url=base_url or os.getenv('OPENAI_BASE_URL') or None,
+        timeout=timeout,
+        max_retries=0,
+    )
+
+
+async def _generate_one(client: 'openai.AsyncOpenAI', semaphore: asyncio.Semaphore, job: Dict,
+                        model: str, temperature: float, max_tokens: int,
+                        max_retries: int, base_delay: float, use_cache: bool = True,
+                        context: Optional[Dict] = None) -> Dict:
+    """توليد سيناريو واحد مع إعادة المحاولة (أو قراءته من الـ cache)"""
+    started = time.perf_counter()
+    messages = build_messages(job['prompt'])
+    key = make_key(model, messages, temperature, max_tokens)
+    if use_cache:
+        script = get_cached(key)
+        if script is not None:
+            return {**job, 'script': script, 'error': None, 'attempts': 0, 'cached': True,
+                    'elapsed': time.perf_counter() - started}
+
+    job_context = {**(context or {}), 'product': job.get('product'), 'platform': job.get('platform')}
+    estimated = estimate_tokens(messages, max_tokens)
+    attempt = 0
+    # حجز الحصة مرة واحدة للمهمة (يبقى أثناء إعادة المحاولة) ويُحرر عند التسجيل أو الخروج
+    held = False
+    try:
+        while True:
+            call_started = time.perf_counter()
+            try:
+                if not held:
+                    check_quota(job_context.get('user'), estimated)
+                    held = True
+                await acquire_async(estimated)
+                call_started = time.perf_counter()
+                async with semaphore:
+                    response = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    )
+                script = (response.choices[0].message.content or '').strip()
+                usage = getattr(response, 'usage', None)
+                held = False
+                record_call(model, estimated, usage, time.perf_counter() - call_started, job_context)
+                store_response(key, model, script, usage)
+                return {
+                    **job,
+                    'script': script,
+                    'error': None,
+                    'attempts': attempt + 1,
+                    'cached': False,
+                    'elapsed': time.perf_counter() - started,
+                }
+            except QuotaExceeded as e:
+                # الحصة انتهت أو الانتظار طويل: لا فائدة من إعادة المحاولة
+                return {**job, 'script': None, 'error': str(e), 'attempts': attempt, 'cached': False,
+                        'elapsed': time.perf_counter() - started}
+            except Exception as e:
+                if attempt >= max_retries or not _is_retryable(e):
+                    held = False
+                    error = record_failure(model, estimated, e, time.perf_counter() - call_started, job_context)
+                    return {
+                        **job,
+                        'script': None,
+                        'error': str(error),
+                        'attempts': attempt + 1,
+                        'cached': False,
+                        'elapsed': time.perf_counter() - started,
+                    }
+                # المحاولة الفاشلة لم تستهلك tokens، و 429 يوقف بقية الطلبات أيضاً
+                settle(estimated, 0)
+                delay = _retry_delay(e, attempt, base_delay)
+                if isinstance(e, openai.RateLimitError):
+                    throttle(seconds=delay)
+                # الانتظار خارج الـ semaphore حتى لا يحجز مكان طلب آخر
+                await asyncio.sleep(delay)
+                attempt += 1
+    finally:
+        if held:
+            release_quota(job_context.get('user'), estimated)
+
+
+async def generate_batch_async(jobs: List[Dict],
+                               on_result: Optional[Callable[[int, Dict], None]] = None,
+                               concurrency: int = DEFAULT_CONCURRENCY,
+                               model: str = DEFAULT_MODEL,
+                               temperature: float = DEFAULT_TEMPERATURE,
+                               max_tokens: int = DEFAULT_MAX_TOKENS,
+                               max_retries: int = MAX_RETRIES,
+                               base_delay: float = BASE_DELAY,
+                               client: Optional['openai.AsyncOpenAI'] = None,
+                               use_cache: bool = True,
+                               context: Optional[Dict] = None) -> List[Dict]:
+    """
+    توليد دفعة سيناريوهات بالتوازي
+
+    Args:
+        jobs: من build_batch_jobs (أو أي قواميس تحتوي 'prompt')
+        on_result: تُستدعى (رقم المهمة, النتيجة) فور انتهاء كل مهمة
+        concurrency: الحد الأقصى للطلبات المتزامنة
+        client: عميل جاهز (الافتراضي: make_async_client())
+        use_cache: قراءة السيناريوهات المولدة سابقاً من llm_cache (False = توليد جديد للكل)
+        context: {'user', 'feature'} للحصة وسجل التكلفة (المنتج والمنصة من كل مهمة)
+
+    Returns:
+        النتائج بنفس ترتيب jobs، كل نتيجة = المهمة + script / error / attempts / cached / elapsed
+    """
+    own_client = client is None
+    client = client or make_async_client()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(index: int, job: Dict):
+        return index, await _generate_one(client, semaphore, job, model, temperature,
+                                          max_tokens, max_retries, base_delay, use_cache, context)
+
+    results: List[Optional[Dict]] = [None] * len(jobs)
+    try:
+        for future in asyncio.as_completed([run(i, job) for i, job in enumerate(jobs)]):
+            index, result = await future
+            results[index] = result
+            if on_result:
+                on_result(index, result)
+    finally:
+        if own_client:
+            await client.close()
+    return results
+
+
+def generate_batch(jobs: List[Dict], on_result: Optional[Callable[[int, Dict], None]] = None,
+                   **kwargs) -> List[Dict]:
+    """
+    نسخة متزامنة من generate_batch_async (لاستدعائها من صفحات Streamlit)
+
+    on_result تُستدعى في نفس الـ thread، فيمكنها الكتابة في الصفحة مباشرة.
+    """
+    return asyncio.run(generate_batch_async(jobs, on_result=on_result, **kwargs))
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة cache ردود الذكاء الاصطناعي (OpenAI)
+Argan Smart Generator
+
+نفس الطلب (النموذج + رسالة النظام + الـ prompt + temperature + max_tokens) لا
+يُرسل مرتين: الرد محفوظ في database/llm_cache.db بمفتاح SHA-256 لهذه القيم.
+
+- TTL: الرد أقدم من مدة الصلاحية يُعاد توليده.
+- LRU: يُحتفظ بآخر MAX_ENTRIES رد فقط (الأقدم استخداماً يُحذف).
+- الطلبات المتطابقة المتزامنة من جلسات مختلفة تنتظر طلباً واحداً (coalescing).
+- عدادات: إصابات، إخفاقات، طلبات مدمجة، والـ tokens التي وُفّرت.
+- stream_chat: عرض الرد كلمة بكلمة (stream=True) مع الإيقاف، وتسجيل زمن أول
+  كلمة (TTFT) والزمن الكلي لكل استدعاء في جدول llm_latency.
+- كل استدعاء API يمر بحدود llm_quota (حصة المستخدم + token bucket) ويُسجل في
+  سجل التكلفة؛ الرد المحفوظ لا يُحسب من الحصة.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+import openai
+
+from modules.connection import get_connection
+from modules.llm_quota import (
+    MAX_WAIT, acquire, approximate_usage, check_quota, estimate_tokens, record_call, record_failure, release_quota,
+    reserve,
+)
+
+
+DB_PATH = 'database/llm_cache.db'
+DEFAULT_TTL = 7 * 24 * 3600   # ثوانٍ
+MAX_ENTRIES = 2000
+WAIT_TIMEOUT = 180.0          # أقصى انتظار لطلب مطابق قيد التنفيذ
+MAX_LATENCY_ROWS = 5000       # آخر الاستدعاءات المحفوظة في llm_latency
+
+STAT_NAMES = ('hits', 'misses', 'coalesced', 'saved_prompt_tokens', 'saved_completion_tokens')
+
+_inflight_lock = threading.Lock()
+_inflight: Dict[str, Future] = {}
+
+
+def ensure_llm_cache_schema(conn: sqlite3.Connection):
+    """إنشاء جداول الردود والعدادات وأزمنة الاستدعاءات"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            content TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_cache_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.executemany('INSERT OR IGNORE INTO llm_cache_stats (name, value) VALUES (?, 0)',
+                     [(name,) for name in STAT_NAMES])
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_latency (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            model TEXT NOT NULL,
+            source TEXT NOT NULL,
+            ttft REAL,
+            elapsed REAL NOT NULL,
+            chars INTEGER NOT NULL DEFAULT 0,
+            cancelled INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.commit()
+
+
+def get_db_connection() -> sqlite3.Connection:
+    """اتصال الـ thread الحالي بقاعدة بيانات الـ cache"""
+    return get_connection(DB_PATH, ensure_llm_cache_schema)
+
+
+def make_key(model: str, messages: List[Dict], temperature: float, max_tokens: int) -> str:
+    """مفتاح الطلب: SHA-256 للنموذج والرسائل (النظام + المستخدم) والإعدادات"""
+    payload = json.dumps([model, messages, float(temperature), int(max_tokens)],
+                         ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _count(conn: sqlite3.Connection, **increments: int):
+    conn.executemany('UPDATE llm_cache_stats SET value = value + ? WHERE name = ?',
+                     [(value, name) for name, value in increments.items() if value])
+
+
+def get_cached(key: str, ttl: float = DEFAULT_TTL) -> Optional[str]:
+    """
+    الرد المحفوظ لمفتاح (وتحديث وقت استخدامه وعداد الإصابات)، أو None
+    """
+    conn = get_db_connection()
+    now = time.time()
+    row = conn.execute(
+        'SELECT content, prompt_tokens, completion_tokens FROM llm_cache WHERE key = ? AND created_at >= ?',
+        (key, now - ttl)
+    ).fetchone()
+    with conn:
+        if row is None:
+            _count(conn, misses=1)
+            return None
+        conn.execute('UPDATE llm_cache SET last_used = ?, hits = hits + 1 WHERE key = ?', (now, key))
+        _count(conn, hits=1, saved_prompt_tokens=row[1], saved_completion_tokens=row[2])
+    return row[0]
+
+
+def store_response(key: str, model: str, content: str, usage: Any = None):
+    """حفظ رد جديد (واستبدال القديم لنفس المفتاح) ثم حذف الأقدم استخداماً بعد MAX_ENTRIES"""
+    now = time.time()
+    prompt_tokens = getattr(usage, 'prompt_tokens', None) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', None) or 0
+    conn = get_db_connection()
+    with conn:
+        conn.execute('''
+            INSERT INTO llm_cache (key, model, content, prompt_tokens, completion_tokens, created_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                content = excluded.content,
+                prompt_tokens = excluded.prompt_tokens,
+                completion_tokens = excluded.completion_tokens,
+                created_at = excluded.created_at,
+                last_used = excluded.last_used,
+                hits = 0
+        ''', (key, model, content, prompt_tokens, completion_tokens, now, now))
+        conn.execute('''
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+        ''', (MAX_ENTRIES,))
+
+
+def cached_chat(messages: List[Dict],
+                model: str,
+                temperature: float,
+                max_tokens: int,
+                client: Any = None,
+                ttl: float = DEFAULT_TTL,
+                refresh: bool = False,
+                context: Optional[Dict] = None) -> Dict:
+    """
+    chat.completions.create مع الـ cache ودمج الطلبات المتطابقة المتزامنة
+
+    Args:
+        messages: رسائل المحادثة (system + user)
+        client: عميل OpenAI (الافتراضي: وحدة openai نفسها بمفتاح openai.api_key)
+        ttl: مدة صلاحية الرد المحفوظ بالثواني
+        refresh: تجاهل الرد المحفوظ وتوليد رد جديد (يستبدله)
+        context: {'user', 'feature', 'product', 'platform'} للحصة وسجل التكلفة
+
+    Returns:
+        {'content': النص, 'source': 'cache' | 'api' | 'coalesced'}
+
+    Raises:
+        QuotaExceeded: تجاوز الحصة اليومية، أو ضغط على الخدمة (429 / انتظار طويل)
+        أخطاء OpenAI الأخرى كما هي (لا يُحفظ شيء عند الفشل)
+    """
+    key = make_key(model, messages, temperature, max_tokens)
+    if not refresh:
+        content = get_cached(key, ttl)
+        if content is not None:
+            return {'content': content, 'source': 'cache'}
+
+    # الحصة لكل مستخدم حتى لو انضم لطلب مطابق قيد التنفيذ
+    estimated = estimate_tokens(messages, max_tokens)
+    username = (context or {}).get('user')
+    check_quota(username, estimated)
+    held = True
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+
+    if not leader:
+        # لا استدعاء API لهذا الطلب، فلا يبقى حجز من حصته
+        release_quota(username, estimated)
+        content = future.result(timeout=WAIT_TIMEOUT)
+        conn = get_db_connection()
+        row = conn.execute('SELECT prompt_tokens, completion_tokens FROM llm_cache WHERE key = ?',
+                           (key,)).fetchone() or (0, 0)
+        with conn:
+            _count(conn, coalesced=1, saved_prompt_tokens=row[0], saved_completion_tokens=row[1])
+        return {'content': content, 'source': 'coalesced'}
+
+    try:
+        if not refresh:
+            # طلب مطابق ربما انتهى وحُفظ بين البحث في الـ cache وتسجيل هذا الطلب
+            row = get_db_connection().execute(
+                'SELECT content FROM llm_cache WHERE key = ? AND created_at >= ?', (key, time.time() - ttl)
+            ).fetchone()
+            if row is not None:
+                future.set_result(row[0])
+                return {'content': row[0], 'source': 'cache'}
+
+        acquire(estimated, MAX_WAIT)
+        started = time.perf_counter()
+        try:
+            response = (client or openai).chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+            )
+        except Exception as e:
+            held = False
+            failure = record_failure(model, estimated, e, time.perf_counter() - started, context)
+            if failure is e:
+                raise
+            raise failure from e
+        content = (response.choices[0].message.content or '').strip()
+        usage = getattr(response, 'usage', None)
+        held = False
+        record_call(model, estimated, usage, time.perf_counter() - started, context)
+        store_response(key, model, content, usage)
+        future.set_result(content)
+        return {'content': content, 'source': 'api'}
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        if held:
+            release_quota(username, estimated)
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def record_latency(model: str, source: str, ttft: Optional[float], elapsed: float,
+                   chars: int = 0, cancelled: bool = False):
+    """تسجيل زمن استدعاء واحد (والاحتفاظ بآخر MAX_LATENCY_ROWS فقط)"""
+    conn = get_db_connection()
+    with conn:
+        cursor = conn.execute('''
+            INSERT INTO llm_latency (created_at, model, source, ttft, elapsed, chars, cancelled)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (time.time(), model, source, ttft, elapsed, chars, int(cancelled)))
+        conn.execute('DELETE FROM llm_latency WHERE id <= ?', (cursor.lastrowid - MAX_LATENCY_ROWS,))
+
+
+def stream_chat(messages: List[Dict],
+                model: str,
+                temperature: float,
+                max_tokens: int,
+                on_token: Callable[[str, str], None],
+                client: Any = None,
+                ttl: float = DEFAULT_TTL,
+                refresh: bool = False,
+                cancel: Optional[threading.Event] = None,
+                context: Optional[Dict] = None) -> Dict:
+    """
+    مثل cached_chat لكن الرد يصل كلمة بكلمة (stream=True)
+
+    الرد المحفوظ يُرسل دفعة واحدة. الرد الجديد لا يُدمج مع طلبات متطابقة متزامنة،
+    ويُحفظ في الـ cache فقط إذا اكتمل.
+
+    Args:
+        on_token: (الجزء الجديد, النص حتى الآن) لكل جزء يصل
+        cancel: إيقاف القراءة عند تفعيله. في Streamlit يكفي زر إيقاف: إعادة تشغيل
+                الصفحة تقطع on_token، والاتصال يُغلق ويُسجل الاستدعاء كملغى
+        context: {'user', 'feature', 'product', 'platform'} للحصة وسجل التكلفة
+
+    Returns:
+        {'content', 'source': 'cache' | 'api', 'ttft', 'elapsed', 'cancelled'}
+        (ttft و elapsed بالثواني)
+
+    Raises:
+        QuotaExceeded: تجاوز الحصة اليومية، أو ضغط على الخدمة (429 / انتظار طويل)
+        أخطاء OpenAI الأخرى كما هي
+    """
+    started = time.perf_counter()
+    key = make_key(model, messages, temperature, max_tokens)
+    result = {'content': '', 'source': 'api', 'ttft': None, 'elapsed': 0.0, 'cancelled': False}
+
+    if not refresh:
+        content = get_cached(key, ttl)
+        if content is not None:
+            result.update(content=content, source='cache', ttft=time.perf_counter() - started)
+            on_token(content, content)
+            result['elapsed'] = time.perf_counter() - started
+            record_latency(model, 'cache', result['ttft'], result['elapsed'], len(content))
+            return result
+
+    estimated = reserve(messages, max_tokens, context)
+    parts: List[str] = []
+    usage = None
+    stream = None
+    failed = False
+    try:
+        stream = (client or openai).chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={'include_usage': True},
+        )
+        for chunk in stream:
+            if cancel is not None and cancel.is_set():
+                result['cancelled'] = True
+                break
+            usage = getattr(chunk, 'usage', None) or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if result['ttft'] is None:
+                result['ttft'] = time.perf_counter() - started
+            parts.append(delta)
+            on_token(delta, ''.join(parts))
+    except Exception as e:
+        failed = True
+        failure = record_failure(model, estimated, e, time.perf_counter() - started, context)
+        if failure is e:
+            raise
+        raise failure from e
+    except BaseException:
+        # مقاطعة من خارج الدالة (مثل إعادة تشغيل صفحة Streamlit بزر الإيقاف)
+        result['cancelled'] = True
+        raise
+    finally:
+        if stream is not None:
+            stream.close()
+        result['content'] = ''.join(parts).strip()
+        result['elapsed'] = time.perf_counter() - started
+        if not failed:
+            record_latency(model, 'api', result['ttft'], result['elapsed'],
+                           len(result['content']), result['cancelled'])
+            record_call(model, estimated, usage or approximate_usage(messages, result['content']),
+                        result['elapsed'], context, 'cancelled' if result['cancelled'] else 'ok')
+
+    if not result['cancelled']:
+        store_response(key, model, result['content'], usage)
+    return result
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def get_latency_stats(limit: int = 500) -> List[Dict]:
+    """
+    أزمنة آخر limit استدعاء لكل (نموذج, مصدر)
+
+    Returns:
+        [{'model', 'source', 'calls', 'cancelled', 'ttft_p50', 'ttft_p95',
+          'elapsed_p50', 'elapsed_p95'}] بالثواني
+    """
+    rows = get_db_connection().execute(
+        'SELECT model, source, ttft, elapsed, cancelled FROM llm_latency ORDER BY id DESC LIMIT ?', (limit,)
+    ).fetchall()
+    groups: Dict[tuple, List] = {}
+    for model, source, ttft, elapsed, cancelled in rows:
+        groups.setdefault((model, source), []).append((ttft, elapsed, cancelled))
+
+    stats = []
+    for (model, source), calls in sorted(groups.items()):
+        ttfts = [ttft for ttft, _, _ in calls if ttft is not None]
+        # الزمن الكلي للاستدعاءات المكتملة فقط
+        elapsed = [total for _, total, cancelled in calls if not cancelled]
+        stats.append({
+            'model': model,
+            'source': source,
+            'calls': len(calls),
+            'cancelled': sum(cancelled for _, _, cancelled in calls),
+            'ttft_p50': _percentile(ttfts, 50),
+            'ttft_p95': _percentile(ttfts, 95),
+            'elapsed_p50': _percentile(elapsed, 50),
+            'elapsed_p95': _percentile(elapsed, 95),
+        })
+    return stats
+
+
+def get_cache_stats() -> Dict:
+    """
+    إحصائيات الـ cache
+
+    Returns:
+        {'entries', 'hits', 'misses', 'coalesced', 'hit_rate',
+         'saved_prompt_tokens', 'saved_completion_tokens', 'saved_tokens'}
+    """
+    conn = get_db_connection()
+    stats = dict(conn.execute('SELECT name, value FROM llm_cache_stats').fetchall())
+    stats['entries'] = conn.execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+    requests = stats.get('hits', 0) + stats.get('misses', 0)
+    stats['hit_rate'] = stats.get('hits', 0) / requests * 100 if requests else 0.0
+    stats['saved_tokens'] = stats.get('saved_prompt_tokens', 0) + stats.get('saved_completion_tokens', 0)
+    return stats
+
+
+def purge_expired(ttl: float = DEFAULT_TTL) -> int:
+    """حذف الردود الأقدم من ttl، وإرجاع عددها"""
+    conn = get_db_connection()
+    with conn:
+        return conn.execute('DELETE FROM llm_cache WHERE created_at < ?', (time.time() - ttl,)).rowcount
+
+
+def clear_llm_cache(reset_stats: bool = False):
+    """حذف كل الردود المحفوظة (والعدادات إن طُلب)"""
+    conn = get_db_connection()
+    with conn:
+        conn.execute('DELETE FROM llm_cache')
+        if reset_stats:
+            conn.execute('UPDATE llm_cache_stats SET value = 0')
+            conn.execute('DELETE FROM llm_latency')
@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة حدود استخدام الذكاء الاصطناعي (OpenAI) وسجل التكلفة
+Argan Smart Generator
+
+- Token bucket مشترك بين كل جلسات Streamlit (نفس العملية): حد للطلبات وحد
+  للـ tokens في الدقيقة. الطلب الزائد ينتظر دوره (حتى MAX_WAIT) بدلاً من أن
+  يرسل ويرجع 429، وعند 429 من OpenAI يتوقف الجميع مدة Retry-After.
+- حصة يومية من الـ tokens لكل مستخدم (الافتراضي DEFAULT_DAILY_TOKENS، وقابلة
+  للتعديل لكل مستخدم من لوحة الإدارة). الـ tokens المقدرة للاستدعاءات الجارية
+  تُحجز من الحصة حتى تُسجل، فالطلبات المتزامنة لا تتجاوزها معاً.
+- سجل تكلفة (llm_ledger): tokens الطلب والرد، التكلفة، وزمن الاستدعاء لكل
+  استدعاء API مع المستخدم والميزة والمنتج والمنصة.
+
+تجاوز الحد يرفع QuotaExceeded برسالة عربية جاهزة للعرض (st.warning).
+"""
+
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import openai
+
+from modules.connection import get_connection
+
+
+DB_PATH = 'database/llm_usage.db'
+REQUESTS_PER_MINUTE = int(os.getenv('LLM_REQUESTS_PER_MINUTE', '60'))
+TOKENS_PER_MINUTE = int(os.getenv('LLM_TOKENS_PER_MINUTE', '200000'))
+DEFAULT_DAILY_TOKENS = int(os.getenv('LLM_DAILY_TOKENS', '200000'))
+MAX_WAIT = 20.0           # أقصى انتظار (ثوانٍ) لطلب من الصفحة قبل رفضه
+BATCH_MAX_WAIT = 120.0    # أقصى انتظار لمهمة داخل التوليد الدفعي
+RATE_LIMIT_PAUSE = 10.0   # التوقف بعد 429 إن لم يحدد OpenAI مدة Retry-After
+
+# سعر المليون token بالدولار: (الطلب, الرد)
+PRICES = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gpt-4-turbo': (10.0, 30.0),
+}
+DEFAULT_PRICE = (10.0, 30.0)  # نموذج غير معروف: أعلى سعر حتى لا تُقلَّل التكلفة
+
+SPEND_GROUPS = ('username', 'feature', 'product', 'platform', 'model', 'day')
+
+_bucket_lock = threading.Lock()
+_bucket = {
+    'requests': float(REQUESTS_PER_MINUTE),
+    'tokens': float(TOKENS_PER_MINUTE),
+    'updated': time.monotonic(),
+    'blocked_until': 0.0,
+}
+
+# tokens مقدرة لاستدعاءات قيد التنفيذ لكل مستخدم (تُحجز في check_quota وتُحرر في record_call)
+_reserved_lock = threading.Lock()
+_reserved: Dict[str, int] = {}
+
+
+class QuotaExceeded(RuntimeError):
+    """تجاوز حد الاستخدام (retry_after: الثواني المقترحة قبل المحاولة مرة أخرى)"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def ensure_usage_schema(conn: sqlite3.Connection):
+    """إنشاء جدول سجل التكلفة وجدول حصص المستخدمين"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            day TEXT NOT NULL,
+            username TEXT NOT NULL DEFAULT '',
+            feature TEXT NOT NULL DEFAULT '',
+            product TEXT NOT NULL DEFAULT '',
+            platform TEXT NOT NULL DEFAULT '',
+            model TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL DEFAULT 0,
+            completion_tokens INTEGER NOT NULL DEFAULT 0,
+            cost REAL NOT NULL DEFAULT 0,
+            latency REAL NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'ok'
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_ledger_user_day ON llm_ledger(username, day)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_ledger_day ON llm_ledger(day)')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_user_quota (
+            username TEXT PRIMARY KEY,
+            daily_tokens INTEGER NOT NULL
+        )
+    ''')
+    conn.commit()
+
+
+def get_db_connection() -> sqlite3.Connection:
+    """اتصال الـ thread الحالي بقاعدة بيانات الاستخدام"""
+    return get_connection(DB_PATH, ensure_usage_schema)
+
+
+def _today() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def _seconds_to_midnight() -> float:
+    now = datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - now).total_seconds()
+
+
+def estimate_tokens(messages: List[Dict], max_tokens: int) -> int:
+    """
+    تقدير tokens الاستدعاء قبل إرساله: الرسائل (حرفان تقريباً لكل token في
+    النص العربي) + الحد الأقصى للرد
+    """
+    chars = sum(len(message.get('content') or '') for message in messages)
+    return chars // 2 + int(max_tokens)
+
+
+def approximate_usage(messages: List[Dict], content: str) -> Dict:
+    """tokens تقريبية لاستدعاء لم تصل نهايته (stream أُوقف قبل وصول usage)"""
+    return {
+        'prompt_tokens': sum(len(message.get('content') or '') for message in messages) // 2,
+        'completion_tokens': len(content) // 2,
+    }
+
+
+def _usage_tokens(usage: Any) -> tuple:
+    if isinstance(usage, dict):
+        return usage.get('prompt_tokens') or 0, usage.get('completion_tokens') or 0
+    return getattr(usage, 'prompt_tokens', None) or 0, getattr(usage, 'completion_tokens', None) or 0
+
+
+def call_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """تكلفة الاستدعاء بالدولار"""
+    prompt_price, completion_price = PRICES.get(model, DEFAULT_PRICE)
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+# ============================================
+# Token bucket
+# ============================================
+
+def _refill(now: float):
+    elapsed = now - _bucket['updated']
+    _bucket['requests'] = min(float(REQUESTS_PER_MINUTE),
+                              _bucket['requests'] + elapsed * REQUESTS_PER_MINUTE / 60)
+    _bucket['tokens'] = min(float(TOKENS_PER_MINUTE),
+                            _bucket['tokens'] + elapsed * TOKENS_PER_MINUTE / 60)
+    _bucket['updated'] = now
+
+
+def _try_acquire(tokens: int) -> float:
+    """حجز طلب و tokens إن أمكن (يعيد 0)، وإلا مدة الانتظار المتوقعة بالثواني"""
+    tokens = min(tokens, TOKENS_PER_MINUTE)
+    with _bucket_lock:
+        now = time.monotonic()
+        _refill(now)
+        wait = max(
+            _bucket['blocked_until'] - now,
+            (1 - _bucket['requests']) * 60 / REQUESTS_PER_MINUTE,
+            (tokens - _bucket['tokens']) * 60 / TOKENS_PER_MINUTE,
+        )
+        if wait <= 0:
+            _bucket['requests'] -= 1
+            _bucket['tokens'] -= tokens
+            return 0.0
+        return wait
+
+
+def _busy(wait: float) -> QuotaExceeded:
+    seconds = math.ceil(wait)
+    return QuotaExceeded(f"⏳ ضغط كبير على خدمة الذكاء الاصطناعي الآن، حاول مرة أخرى بعد {seconds} ثانية",
+                         retry_after=seconds)
+
+
+def acquire(tokens: int, max_wait: float = MAX_WAIT) -> float:
+    """
+    انتظار مكان في الـ token bucket
+
+    Returns:
+        مدة الانتظار الفعلية بالثواني
+
+    Raises:
+        QuotaExceeded: إذا كان الانتظار المتوقع أطول من max_wait
+    """
+    started = time.monotonic()
+    while True:
+        wait = _try_acquire(tokens)
+        if wait <= 0:
+            return time.monotonic() - started
+        if time.monotonic() - started + wait > max_wait:
+            raise _busy(wait)
+        time.sleep(min(wait, 0.5))
+
+
+async def acquire_async(tokens: int, max_wait: float = BATCH_MAX_WAIT) -> float:
+    """نفس acquire لكن بـ asyncio.sleep (للتوليد الدفعي)"""
+    started = time.monotonic()
+    while True:
+        wait = _try_acquire(tokens)
+        if wait <= 0:
+            return time.monotonic() - started
+        if time.monotonic() - started + wait > max_wait:
+            raise _busy(wait)
+        await asyncio.sleep(min(wait, 0.5))
+
+
+def settle(estimated: int, actual: int):
+    """إرجاع الفرق بين الـ tokens المحجوزة والمستخدمة فعلاً إلى الـ bucket"""
+    with _bucket_lock:
+        _bucket['tokens'] = min(float(TOKENS_PER_MINUTE),
+                                _bucket['tokens'] + min(estimated, TOKENS_PER_MINUTE) - actual)
+
+
+def throttle(error: Optional[Exception] = None, seconds: Optional[float] = None):
+    """إيقاف كل الطلبات مدة Retry-After (بعد 429 من OpenAI)"""
+    if seconds is None:
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        try:
+            seconds = float(retry_after) if retry_after else RATE_LIMIT_PAUSE
+        except ValueError:
+            seconds = RATE_LIMIT_PAUSE
+    with _bucket_lock:
+        _bucket['blocked_until'] = max(_bucket['blocked_until'], time.monotonic() + seconds)
+
+
+def get_bucket_state() -> Dict:
+    """حالة الـ bucket الآن: {'requests', 'tokens', 'paused_for'}"""
+    with _bucket_lock:
+        now = time.monotonic()
+        _refill(now)
+        return {
+            'requests': _bucket['requests'],
+            'tokens': _bucket['tokens'],
+            'paused_for': max(0.0, _bucket['blocked_until'] - now),
+        }
+
+
+# ============================================
+# الحصص اليومية
+# ============================================
+
+def get_user_quota(username: str) -> int:
+    """حصة المستخدم اليومية من الـ tokens"""
+    row = get_db_connection().execute(
+        'SELECT daily_tokens FROM llm_user_quota WHERE username = ?', (username,)
+    ).fetchone()
+    return row[0] if row else DEFAULT_DAILY_TOKENS
+
+
+def set_user_quota(username: str, daily_tokens: Optional[int]):
+    """تعديل حصة مستخدم (None = الرجوع للحصة الافتراضية)"""
+    conn = get_db_connection()
+    with conn:
+        if daily_tokens is None:
+            conn.execute('DELETE FROM llm_user_quota WHERE username = ?', (username,))
+        else:
+            conn.execute('''
+                INSERT INTO llm_user_quota (username, daily_tokens) VALUES (?, ?)
+                ON CONFLICT(username) DO UPDATE SET daily_tokens = excluded.daily_tokens
+            ''', (username, int(daily_tokens)))
+
+
+def get_user_usage(username: str, day: Optional[str] = None) -> int:
+    """الـ tokens التي استخدمها المستخدم في يوم (الافتراضي: اليوم)"""
+    row = get_db_connection().execute(
+        'SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) FROM llm_ledger WHERE username = ? AND day = ?',
+        (username, day or _today())
+    ).fetchone()
+    return row[0]
+
+
+def get_user_reserved(username: str) -> int:
+    """الـ tokens المحجوزة الآن لاستدعاءات المستخدم الجارية"""
+    with _reserved_lock:
+        return _reserved.get(username, 0)
+
+
+def check_quota(username: Optional[str], tokens: int):
+    """
+    التأكد أن المستخدم لم يستهلك حصته اليومية، ثم حجز tokens من الحصة
+
+    الحجز يُحرر في record_call (أو release_quota إذا لم يُرسل الاستدعاء).
+
+    Raises:
+        QuotaExceeded: إذا كان الاستخدام + المحجوز + tokens أكبر من الحصة
+    """
+    if not username:
+        return
+    quota = get_user_quota(username)
+    with _reserved_lock:
+        used = get_user_usage(username) + _reserved.get(username, 0)
+        if used + tokens > quota:
+            raise QuotaExceeded(
+                f"🚫 وصلت إلى حدك اليومي من الذكاء الاصطناعي ({used:,} من {quota:,} token)، يتجدد الحد منتصف الليل",
+                retry_after=_seconds_to_midnight()
+            )
+        _reserved[username] = _reserved.get(username, 0) + tokens
+
+
+def release_quota(username: Optional[str], tokens: int):
+    """تحرير tokens حجزها check_quota لاستدعاء لن يُسجل (انتظار طويل، إلغاء، رد مشترك)"""
+    if not username:
+        return
+    with _reserved_lock:
+        left = _reserved.get(username, 0) - tokens
+        if left > 0:
+            _reserved[username] = left
+        else:
+            _reserved.pop(username, None)
+
+
+# ============================================
+# سجل التكلفة
+# ============================================
+
+def reserve(messages: List[Dict], max_tokens: int, context: Optional[Dict] = None,
+            max_wait: float = MAX_WAIT) -> int:
+    """
+    قبل استدعاء API: التحقق من حصة المستخدم ثم انتظار الـ token bucket
+
+    Args:
+        context: {'user', 'feature', 'product', 'platform'} (كلها اختيارية)
+
+    Returns:
+        الـ tokens المقدرة المحجوزة (تُمرر إلى record_call)
+    """
+    estimated = estimate_tokens(messages, max_tokens)
+    username = (context or {}).get('user')
+    check_quota(username, estimated)
+    try:
+        acquire(estimated, max_wait)
+    except BaseException:
+        release_quota(username, estimated)
+        raise
+    return estimated
+
+
+def record_call(model: str, estimated: int, usage: Any = None, latency: float = 0.0,
+                context: Optional[Dict] = None, status: str = 'ok') -> float:
+    """
+    تسجيل استدعاء API في llm_ledger، وتسوية الـ token bucket وتحرير حجز الحصة
+
+    Args:
+        estimated: من reserve
+        usage: response.usage أو approximate_usage (prompt_tokens / completion_tokens)
+        status: 'ok' | 'cancelled' | 'error' | 'rate_limited'
+
+    Returns:
+        التكلفة بالدولار
+    """
+    prompt_tokens, completion_tokens = _usage_tokens(usage)
+    settle(estimated, prompt_tokens + completion_tokens)
+
+    context = context or {}
+    cost = call_cost(model, prompt_tokens, completion_tokens)
+    conn = get_db_connection()
+    try:
+        with conn:
+            conn.execute('''
+                INSERT INTO llm_ledger (created_at, day, username, feature, product, platform, model,
+                                        prompt_tokens, completion_tokens, cost, latency, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (time.time(), _today(), context.get('user') or '', context.get('feature') or '',
+                  context.get('product') or '', context.get('platform') or '', model,
+                  prompt_tokens, completion_tokens, cost, latency, status))
+    finally:
+        # بعد الكتابة في السجل، حتى لا يرى check_quota متزامن الاستدعاء بدون حجز ولا سجل
+        release_quota(context.get('user'), estimated)
+    return cost
+
+
+def record_failure(model: str, estimated: int, error: BaseException, latency: float = 0.0,
+                   context: Optional[Dict] = None) -> BaseException:
+    """
+    تسجيل استدعاء فاشل، وتحويل 429 إلى QuotaExceeded (مع إيقاف الطلبات مؤقتاً)
+
+    Returns:
+        الخطأ الذي يُرفع للصفحة
+    """
+    if isinstance(error, openai.RateLimitError):
+        throttle(error)
+        record_call(model, estimated, latency=latency, context=context, status='rate_limited')
+        return _busy(get_bucket_state()['paused_for'] or RATE_LIMIT_PAUSE)
+    record_call(model, estimated, latency=latency, context=context, status='error')
+    return error
+
+
+def get_spend(group_by: str = 'username', days: int = 30) -> List[Dict]:
+    """
+    الإنفاق مجمّعاً حسب عمود في آخر days يوم
+
+    Args:
+        group_by: أحد SPEND_GROUPS
+
+    Returns:
+        [{group_by, 'calls', 'prompt_tokens', 'completion_tokens', 'cost',
+          'avg_latency', 'failed'}] مرتبة تنازلياً حسب التكلفة
+    """
+    if group_by not in SPEND_GROUPS:
+        raise ValueError(f"تجميع غير مدعوم: {group_by}")
+    since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    rows = get_db_connection().execute(f'''
+        SELECT {group_by}, COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), SUM(cost),
+               AVG(latency), SUM(status != 'ok')
+        FROM llm_ledger
+        WHERE day >= ?
+        GROUP BY {group_by}
+        ORDER BY SUM(cost) DESC
+    ''', (since,)).fetchall()
+    return [
+        {
+            group_by: row[0],
+            'calls': row[1],
+            'prompt_tokens': row[2],
+            'completion_tokens': row[3],
+            'cost': row[4],
+            'avg_latency': row[5],
+            'failed': row[6],
+        }
+        for row in rows
+    ]
+
+
+def get_daily_usage(day: Optional[str] = None) -> Dict[str, int]:
+    """{المستخدم: الـ tokens المستخدمة} ليوم (الافتراضي: اليوم)"""
+    rows = get_db_connection().execute('''
+        SELECT username, SUM(prompt_tokens + completion_tokens) FROM llm_ledger
+        WHERE day = ? AND username != '' GROUP BY username
+    ''', (day or _today(),)).fetchall()
+    return dict(rows)
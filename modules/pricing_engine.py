@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+محرك سيناريوهات التسعير (Vectorized)
+Argan Smart Generator
+
+نفس حسابات calculate_product_metrics في pricing_planning_v2 لكن لكل منتجات
+products_pricing.json ولكل تركيبة (خصم أساسي × خصم كود) في عملية NumPy واحدة:
+
+    بعد الخصم = السعر الأساسي × (1 - الخصم الأساسي)
+    بعد الكود = بعد الخصم × (1 - خصم الكود)
+    نسبة الربح = (بعد الكود - التكلفة) / بعد الكود
+
+النتيجة مصفوفات بشكل (منتج, خصم أساسي, خصم كود)، فآلاف السيناريوهات تُحسب
+في أجزاء من الثانية بدلاً من إعادة تشغيل الصفحة لكل رقم.
+"""
+
+from typing import Dict, Mapping, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+
+EXCELLENT_MARGIN = 30.0   # نسبة الربح % للحالة "ممتاز"
+GOOD_MARGIN = 15.0        # نسبة الربح % للحالة "جيد"
+DEFAULT_COST_RATIO = 0.5  # التكلفة الافتراضية = 50% من السعر بعد الكود (كما في نموذج الإضافة)
+
+# رمز الحالة في مصفوفة status -> (الحالة, اللون) بنفس قيم calculate_product_metrics
+STATUSES = {
+    0: ("تحذير", "🔴"),
+    1: ("جيد", "🟠"),
+    2: ("ممتاز", "🟢"),
+}
+
+Costs = Union[float, Sequence[float], Mapping[str, float], np.ndarray, None]
+
+
+def catalogue_frame(products_pricing: Dict[str, Dict], costs: Costs = None) -> pd.DataFrame:
+    """
+    كتالوج الأسعار كـ DataFrame (صف لكل منتج) مع عمود التكلفة
+
+    Args:
+        products_pricing: محتوى products_pricing.json
+        costs: تكلفة كل منتج: قاموس {المنتج: التكلفة}، أو قائمة بنفس ترتيب
+               المنتجات، أو رقم واحد للكل؛ الناقص = DEFAULT_COST_RATIO من السعر بعد الكود
+
+    Returns:
+        DataFrame بفهرس أسماء المنتجات وأعمدة base_price, after_discount,
+        after_code, base_discount_percent, code_discount_percent, cost
+    """
+    columns = ['base_price', 'after_discount', 'after_code', 'base_discount_percent', 'code_discount_percent']
+    df = pd.DataFrame.from_dict(products_pricing, orient='index').reindex(columns=columns).astype('float64')
+
+    if isinstance(costs, Mapping):
+        cost = pd.Series(costs, dtype='float64').reindex(df.index)
+    elif costs is None:
+        cost = pd.Series(np.nan, index=df.index)
+    else:
+        cost = pd.Series(np.broadcast_to(np.asarray(costs, dtype='float64'), len(df)), index=df.index)
+    df['cost'] = cost.fillna(df['after_code'] * DEFAULT_COST_RATIO)
+    return df
+
+
+def _status_codes(margin: np.ndarray) -> np.ndarray:
+    return np.select([margin >= EXCELLENT_MARGIN, margin >= GOOD_MARGIN], [2, 1], default=0).astype('int8')
+
+
+def _margin(price: np.ndarray, cost: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(price > 0, (price - cost) / price * 100, 0.0)
+
+
+def catalogue_metrics(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    مقاييس calculate_product_metrics للأسعار الحالية لكل المنتجات دفعة واحدة
+
+    Returns:
+        frame مع net_profit, profit_margin, total_discount_percent, status, status_color
+    """
+    price = frame['after_code'].to_numpy()
+    base = frame['base_price'].to_numpy()
+    margin = _margin(price, frame['cost'].to_numpy())
+    codes = _status_codes(margin)
+
+    result = frame.copy()
+    result['net_profit'] = price - frame['cost'].to_numpy()
+    result['profit_margin'] = margin
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['total_discount_percent'] = np.where(base > 0, (base - price) / base * 100, 0.0)
+    result['status'] = [STATUSES[code][0] for code in codes]
+    result['status_color'] = [STATUSES[code][1] for code in codes]
+    return result
+
+
+def evaluate_scenarios(frame: pd.DataFrame,
+                       base_discounts: Sequence[float],
+                       code_discounts: Sequence[float]) -> Dict:
+    """
+    تقييم كل تركيبة (خصم أساسي × خصم كود) لكل المنتجات في عملية واحدة
+
+    Args:
+        frame: من catalogue_frame
+        base_discounts: نسب الخصم الأساسي % (مثل np.arange(0, 51, 1))
+        code_discounts: نسب خصم الكود %
+
+    Returns:
+        {'products', 'base_discounts', 'code_discounts',
+         'price', 'profit', 'margin', 'status'}: المصفوفات بشكل (منتج, خصم أساسي, خصم كود)
+         و status رموز STATUSES
+    """
+    base_discounts = np.asarray(base_discounts, dtype='float64')
+    code_discounts = np.asarray(code_discounts, dtype='float64')
+    base = frame['base_price'].to_numpy()[:, None, None]
+    cost = frame['cost'].to_numpy()[:, None, None]
+
+    price = base * (1 - base_discounts / 100)[None, :, None] * (1 - code_discounts / 100)[None, None, :]
+    margin = _margin(price, cost)
+    return {
+        'products': list(frame.index),
+        'base_discounts': base_discounts,
+        'code_discounts': code_discounts,
+        'price': price,
+        'profit': price - cost,
+        'margin': margin,
+        'status': _status_codes(margin),
+    }
+
+
+def margin_heatmap(grid: Dict, product: Optional[str] = None) -> pd.DataFrame:
+    """
+    جدول نسبة الربح (صفوف = الخصم الأساسي، أعمدة = خصم الكود)
+
+    Args:
+        product: اسم المنتج (None = متوسط كل المنتجات)
+    """
+    if product is None:
+        values = grid['margin'].mean(axis=0)
+    else:
+        values = grid['margin'][grid['products'].index(product)]
+    return pd.DataFrame(
+        values,
+        index=pd.Index(grid['base_discounts'], name='الخصم الأساسي %'),
+        columns=pd.Index(grid['code_discounts'], name='خصم الكود %'),
+    )
+
+
+def summarize_scenarios(grid: Dict) -> pd.DataFrame:
+    """
+    ملخص كل سيناريو على مستوى الكتالوج (صف لكل تركيبة خصم)
+
+    Returns:
+        DataFrame: base_discount, code_discount, avg_margin, min_margin, total_profit,
+        excellent, good, warning (عدد المنتجات في كل حالة)
+    """
+    base, code = np.meshgrid(grid['base_discounts'], grid['code_discounts'], indexing='ij')
+    status = grid['status']
+    return pd.DataFrame({
+        'base_discount': base.ravel(),
+        'code_discount': code.ravel(),
+        'avg_margin': grid['margin'].mean(axis=0).ravel(),
+        'min_margin': grid['margin'].min(axis=0).ravel(),
+        'total_profit': grid['profit'].sum(axis=0).ravel(),
+        'excellent': (status == 2).sum(axis=0).ravel(),
+        'good': (status == 1).sum(axis=0).ravel(),
+        'warning': (status == 0).sum(axis=0).ravel(),
+    })
+
+
+def product_thresholds(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    حدود الحالات لكل منتج: أقل سعر وأكبر خصم كلي يحققان كل حالة
+
+    السعر الذي يحقق نسبة ربح m هو التكلفة / (1 - m)، والخصم الكلي المقابل
+    1 - السعر / السعر الأساسي. max_base_discount_* هو أكبر خصم أساسي مع بقاء
+    خصم الكود الحالي كما هو.
+
+    Returns:
+        DataFrame بفهرس المنتجات وأعمدة break_even_*, good_*, excellent_*
+        (price / discount / max_base_discount) بالنسب المئوية
+    """
+    base = frame['base_price'].to_numpy()
+    cost = frame['cost'].to_numpy()
+    code = frame['code_discount_percent'].fillna(0).to_numpy() / 100
+
+    result = pd.DataFrame(index=frame.index)
+    for name, margin in (('break_even', 0.0), ('good', GOOD_MARGIN), ('excellent', EXCELLENT_MARGIN)):
+        price = cost / (1 - margin / 100)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            discount = np.where(base > 0, 1 - price / base, np.nan)
+            base_discount = np.where(code < 1, 1 - (1 - discount) / (1 - code), np.nan)
+        result[f'{name}_price'] = price
+        result[f'{name}_discount'] = discount * 100
+        result[f'{name}_max_base_discount'] = base_discount * 100
+    return result
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+محسّن الأسعار المحلي (بدون API)
+Argan Smart Generator
+
+يبحث لكل منتجات الكتالوج عن سعر "بعد الخصم" و"بعد الكود" الأقرب للخصومات
+المستهدفة مع الشروط:
+
+- نسبة الربح عند سعر الكود لا تقل عن الحد الأدنى (حدود calculate_product_metrics).
+- الأسعار بنهايات نفسية (…9 / …5 افتراضياً).
+- خصم الكود بين حد أدنى وحد أعلى من سعر بعد الخصم.
+- سلّم الأحجام متسق لكل عائلة منتج (لتر / نصف / ربع / 100 مل ...): الحجم الأكبر
+  أغلى، وسعر الوحدة فيه لا يزيد عن الحجم الأصغر.
+
+الأسعار المرشحة لكل منتج مصفوفة NumPy، وسلّم كل عائلة يُحل بالبرمجة الديناميكية
+(Dynamic Programming) على السلسلة من الأكبر للأصغر، فالكتالوج كاملاً في أجزاء من الثانية.
+"""
+
+import math
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from modules.pricing_engine import GOOD_MARGIN, catalogue_metrics
+
+
+PRICE_ENDINGS = (5, 9)
+
+# (نمط الحجم, الحجم بالمل/جرام؛ None = الرقم في الاسم)
+SIZE_PATTERNS = [
+    (re.compile(r'(?:نصف|نص)\s*(?:لتر|كيلو)'), 500.0),
+    (re.compile(r'ربع\s*(?:لتر|كيلو)'), 250.0),
+    (re.compile(r'(?:لتر|كيلو)'), 1000.0),
+    (re.compile(r'(\d+(?:\.\d+)?)\s*(?:مل|جرام|غرام)'), None),
+]
+
+
+def parse_size(name: str) -> Tuple[str, Optional[float]]:
+    """
+    عائلة المنتج وحجمه من اسمه
+
+    Example:
+        parse_size("نصف لتر زيت الارغان الصافي")  # ("زيت الارغان الصافي", 500.0)
+        parse_size("زيت الارغان الصافي100 مل")     # ("زيت الارغان الصافي", 100.0)
+    """
+    for pattern, size in SIZE_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            family = ' '.join((name[:match.start()] + ' ' + name[match.end():]).split())
+            return family, size if size is not None else float(match.group(1))
+    return name.strip(), None
+
+
+def psychological_prices(low: float, high: float, endings: Sequence[int] = PRICE_ENDINGS) -> np.ndarray:
+    """الأسعار الصحيحة بين low و high التي ينتهي رقم آحادها بأحد endings"""
+    if not (np.isfinite(low) and np.isfinite(high)) or high < low:
+        return np.empty(0)
+    prices = np.arange(math.ceil(low), math.floor(high) + 1, dtype='float64')
+    if endings:
+        prices = prices[np.isin(prices % 10, endings)]
+    return prices
+
+
+def _chain(candidates: List[np.ndarray], scores: List[np.ndarray], sizes: List[float]) -> Optional[List[int]]:
+    """
+    اختيار سعر لكل حجم (من الأكبر للأصغر) بأعلى مجموع نقاط مع شروط السلّم
+
+    Returns:
+        موقع السعر المختار في candidates لكل حجم، أو None إن لم يوجد سلّم ممكن
+    """
+    best = scores[0]
+    back = []
+    for i in range(1, len(candidates)):
+        larger, smaller = candidates[i - 1][:, None], candidates[i][None, :]
+        allowed = (smaller < larger) & (smaller / sizes[i] >= larger / sizes[i - 1] - 1e-9)
+        total = np.where(allowed, best[:, None], -np.inf)
+        choice = total.argmax(axis=0)
+        back.append(choice)
+        best = total[choice, np.arange(smaller.shape[1])] + scores[i]
+
+    if not len(best) or not np.isfinite(best.max()):
+        return None
+    picked = [int(best.argmax())]
+    for choice in reversed(back):
+        picked.append(int(choice[picked[-1]]))
+    return picked[::-1]
+
+
+def _solve(candidates: Dict[str, np.ndarray], targets: Dict[str, float], bases: Dict[str, float],
+           ladders: List[List[Tuple[str, float]]]) -> Tuple[Dict[str, float], set]:
+    """
+    أفضل سعر لكل منتج (الأقرب للهدف) مع حل سلّم كل عائلة معاً
+
+    Returns:
+        ({المنتج: السعر}, المنتجات التي تعذّر اتساق سلّمها)
+    """
+    scores = {name: -np.abs(prices - targets[name]) / bases[name] for name, prices in candidates.items()}
+    chosen = {name: float(prices[scores[name].argmax()]) for name, prices in candidates.items() if len(prices)}
+    broken = set()
+
+    for ladder in ladders:
+        names = [name for name, _ in ladder if len(candidates.get(name, ()))]
+        if len(names) < 2:
+            continue
+        sizes = [size for name, size in ladder if name in names]
+        picked = _chain([candidates[name] for name in names], [scores[name] for name in names], sizes)
+        if picked is None:
+            broken.update(names)
+            continue
+        for name, index in zip(names, picked):
+            chosen[name] = float(candidates[name][index])
+    return chosen, broken
+
+
+def find_ladders(names: Sequence[str]) -> List[List[Tuple[str, float]]]:
+    """عائلات المنتجات ذات الأحجام المختلفة، كل عائلة مرتبة من الأكبر للأصغر"""
+    families: Dict[str, List[Tuple[str, float]]] = {}
+    for name in names:
+        family, size = parse_size(name)
+        if size is not None:
+            families.setdefault(family, []).append((name, size))
+
+    ladders = []
+    for members in families.values():
+        sizes = [size for _, size in members]
+        # الأحجام المكررة لا تكوّن سلّماً واضحاً
+        if len(members) >= 2 and len(set(sizes)) == len(sizes):
+            ladders.append(sorted(members, key=lambda member: -member[1]))
+    return ladders
+
+
+def optimize_prices(frame: pd.DataFrame,
+                    min_margin: float = GOOD_MARGIN,
+                    target_base_discount: float = 15.0,
+                    target_code_discount: float = 5.0,
+                    min_code_discount: float = 1.0,
+                    max_code_discount: float = 20.0,
+                    endings: Sequence[int] = PRICE_ENDINGS,
+                    ladder: bool = True) -> pd.DataFrame:
+    """
+    البحث عن أسعار "بعد الخصم" و"بعد الكود" لكل الكتالوج
+
+    Args:
+        frame: من catalogue_frame (السعر الأساسي والتكلفة لكل منتج)
+        min_margin: أقل نسبة ربح % مسموحة عند سعر الكود
+        target_base_discount / target_code_discount: الخصومات المستهدفة %
+        min_code_discount / max_code_discount: حدود خصم الكود % من سعر بعد الخصم
+        endings: أرقام الآحاد المسموحة (فارغة = أي سعر صحيح)
+        ladder: فرض اتساق سلّم الأحجام
+
+    Returns:
+        frame مع after_discount, after_code, base_discount_percent, code_discount_percent
+        (بصيغة products_pricing.json) ومقاييس catalogue_metrics، و:
+        feasible: False إذا لم يوجد سعر يحقق الحد الأدنى للربح (تبقى الأسعار الحالية)
+        ladder_ok: False إذا تعذّر اتساق سلّم العائلة (السعر الأفضل للمنتج وحده)
+    """
+    base = frame['base_price'].to_dict()
+    cost = frame['cost'].to_dict()
+    ladders = find_ladders(list(frame.index)) if ladder else []
+    min_cd, max_cd = min_code_discount / 100, max_code_discount / 100
+
+    # 1) سعر الكود: الأقرب للهدف مع الحد الأدنى للربح
+    code_candidates = {
+        name: psychological_prices(cost[name] / (1 - min_margin / 100), base[name] * (1 - min_cd), endings)
+        for name in frame.index
+    }
+    code_targets = {
+        name: base[name] * (1 - target_base_discount / 100) * (1 - target_code_discount / 100)
+        for name in frame.index
+    }
+    after_code, code_broken = _solve(code_candidates, code_targets, base, ladders)
+
+    # 2) سعر بعد الخصم: ضمن حدود خصم الكود فوق سعر الكود المختار
+    discount_candidates = {}
+    for name, code_price in after_code.items():
+        low = code_price / (1 - min_cd)
+        high = min(base[name], code_price / (1 - max_cd)) if max_cd < 1 else base[name]
+        prices = psychological_prices(low, high, endings)
+        if not len(prices):
+            # لا يوجد سعر بنهاية نفسية في المدى: أي سعر صحيح، ثم أقرب سعر لا يتجاوز الأساسي
+            prices = psychological_prices(low, high, ())
+        if not len(prices):
+            prices = np.array([min(base[name], float(math.ceil(low)))])
+        discount_candidates[name] = prices
+    discount_targets = {name: base[name] * (1 - target_base_discount / 100) for name in after_code}
+    after_discount, discount_broken = _solve(discount_candidates, discount_targets, base, ladders)
+
+    result = frame.copy()
+    result['feasible'] = [name in after_code for name in frame.index]
+    result['ladder_ok'] = [name not in code_broken | discount_broken for name in frame.index]
+    result['after_code'] = [after_code.get(name, frame.at[name, 'after_code']) for name in frame.index]
+    result['after_discount'] = [after_discount.get(name, frame.at[name, 'after_discount']) for name in frame.index]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['base_discount_percent'] = ((result['base_price'] - result['after_discount'])
+                                           / result['base_price'] * 100).round(2)
+        result['code_discount_percent'] = ((result['after_discount'] - result['after_code'])
+                                           / result['after_discount'] * 100).round(2)
+    return catalogue_metrics(result)
+
+
+def to_products_pricing(result: pd.DataFrame) -> Dict[str, Dict]:
+    """نتيجة optimize_prices بصيغة products_pricing.json"""
+    columns = ['base_price', 'after_discount', 'after_code', 'base_discount_percent', 'code_discount_percent']
+    records = result[columns].astype('object').where(result[columns].notna(), None)
+    return records.to_dict('index')
@@ -6,18 +6,108 @@ Argan Smart Generator - Revenues Module
 """
 
 import sqlite3
-import streamlit as st
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
 
+from modules.cache import invalidate, tagged_cache
+from modules.connection import get_connection
+
 
 DB_PATH = 'database/revenues.db'
 
 
-@st.cache_data(ttl=300)
+# إجماليات كل شهر مجمعة مسبقاً (CTE لكل جدول على حدة حتى لا تتضاعف الصفوف في الـ JOIN)
+_MONTH_KPIS_SQL = '''
+    WITH
+    e AS (SELECT month_id, SUM(value) AS total FROM expenses {where} GROUP BY month_id),
+    r AS (SELECT month_id, SUM(value) AS total, SUM(orders) AS orders FROM revenues {where} GROUP BY month_id),
+    ids AS (
+        SELECT id AS month_id FROM months {months_where}
+        UNION SELECT month_id FROM e
+        UNION SELECT month_id FROM r
+    )
+    INSERT OR REPLACE INTO month_kpis (month_id, total_expenses, total_revenues, total_orders, updated_at)
+    SELECT ids.month_id, COALESCE(e.total, 0), COALESCE(r.total, 0), COALESCE(r.orders, 0), CURRENT_TIMESTAMP
+    FROM ids
+    LEFT JOIN e ON e.month_id = ids.month_id
+    LEFT JOIN r ON r.month_id = ids.month_id
+'''
+
+
+def ensure_revenues_schema(conn: sqlite3.Connection):
+    """إنشاء جدول month_kpis (إجماليات الأشهر) وبناؤه إن كان جديداً"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'month_kpis'")
+    exists = cursor.fetchone() is not None
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS month_kpis (
+            month_id INTEGER PRIMARY KEY,
+            total_expenses REAL NOT NULL DEFAULT 0,
+            total_revenues REAL NOT NULL DEFAULT 0,
+            total_orders INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP
+        )
+    ''')
+    if not exists:
+        _refresh_month_kpis(cursor)
+    conn.commit()
+
+
+def _refresh_month_kpis(cursor: sqlite3.Cursor, month_id: Optional[int] = None):
+    """إعادة حساب إجماليات شهر واحد (أو كل الأشهر) داخل المعاملة الحالية"""
+    if month_id is None:
+        cursor.execute('DELETE FROM month_kpis')
+        cursor.execute(_MONTH_KPIS_SQL.format(where='', months_where=''))
+    else:
+        cursor.execute(
+            _MONTH_KPIS_SQL.format(where='WHERE month_id = ?', months_where='WHERE id = ?'),
+            (month_id, month_id, month_id)
+        )
+        # شهر بلا صفوف في أي جدول (مثلاً بعد حذف الشهر)
+        cursor.execute('''
+            DELETE FROM month_kpis WHERE month_id = ?
+            AND NOT EXISTS (SELECT 1 FROM months WHERE id = ?)
+            AND NOT EXISTS (SELECT 1 FROM expenses WHERE month_id = ?)
+            AND NOT EXISTS (SELECT 1 FROM revenues WHERE month_id = ?)
+        ''', (month_id,) * 4)
+
+
+def refresh_month_kpis() -> bool:
+    """إعادة بناء جدول month_kpis بالكامل (مثلاً بعد تعديل يدوي على القاعدة)"""
+    conn = get_db_connection()
+    try:
+        with conn:
+            _refresh_month_kpis(conn.cursor())
+        invalidate('month_kpis')
+        return True
+    except Exception as e:
+        print(f"خطأ في إعادة بناء إجماليات الأشهر: {e}")
+        return False
+
+
+def _month_of(conn: sqlite3.Connection, table: str, row_id: int) -> Optional[int]:
+    """الشهر الذي ينتمي إليه مصروف/إيراد (لتحديث month_kpis)"""
+    row = conn.execute(f'SELECT month_id FROM {table} WHERE id = ?', (row_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _kpis(total_revenues: float, total_expenses: float) -> Tuple[float, float]:
+    """صافي الربح وهامش الربح (%)"""
+    net_profit = total_revenues - total_expenses
+    profit_margin = (net_profit / total_revenues * 100) if total_revenues > 0 else 0
+    return net_profit, profit_margin
+
+
+def get_db_connection() -> sqlite3.Connection:
+    """اتصال الـ thread الحالي بقاعدة بيانات الإيرادات (WAL، مشترك عبر الدوال)"""
+    return get_connection(DB_PATH, ensure_revenues_schema)
+
+
+@tagged_cache('months', ttl=300)
 def get_all_months() -> List[Dict]:
     """الحصول على قائمة جميع الأشهر"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -36,14 +126,13 @@ def get_all_months() -> List[Dict]:
             'last_update': row[4]
         })
     
-    conn.close()
     return months
 
 
-@st.cache_data(ttl=300)
+@tagged_cache('expenses', ttl=300)
 def get_month_expenses(month_id: int) -> List[Dict]:
     """الحصول على مصاريف شهر معين"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -61,14 +150,13 @@ def get_month_expenses(month_id: int) -> List[Dict]:
             'value': row[2]
         })
     
-    conn.close()
     return expenses
 
 
-@st.cache_data(ttl=300)
+@tagged_cache('revenues', ttl=300)
 def get_month_revenues(month_id: int) -> List[Dict]:
     """الحصول على إيرادات شهر معين"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -88,40 +176,29 @@ def get_month_revenues(month_id: int) -> List[Dict]:
             'orders': row[4]
         })
     
-    conn.close()
     return revenues
 
 
-@st.cache_data(ttl=300)
+@tagged_cache('months', 'month_kpis', ttl=300)
 def get_month_summary(month_id: int) -> Dict:
-    """الحصول على ملخص شهر معين"""
-    conn = sqlite3.connect(DB_PATH)
+    """الحصول على ملخص شهر معين (استعلام واحد من month_kpis)"""
+    conn = get_db_connection()
     cursor = conn.cursor()
     
-    # معلومات الشهر
-    cursor.execute('SELECT month_name, last_update FROM months WHERE id = ?', (month_id,))
-    month_info = cursor.fetchone()
-    
-    # إجمالي المصاريف
-    cursor.execute('SELECT SUM(value) FROM expenses WHERE month_id = ?', (month_id,))
-    total_expenses = cursor.fetchone()[0] or 0
-    
-    # إجمالي الإيرادات
-    cursor.execute('SELECT SUM(value) FROM revenues WHERE month_id = ?', (month_id,))
-    total_revenues = cursor.fetchone()[0] or 0
-    
-    # عدد الطلبات
-    cursor.execute('SELECT SUM(orders) FROM revenues WHERE month_id = ?', (month_id,))
-    total_orders = cursor.fetchone()[0] or 0
-    
-    conn.close()
+    cursor.execute('''
+    SELECT m.month_name, m.last_update,
+           COALESCE(k.total_expenses, 0), COALESCE(k.total_revenues, 0), COALESCE(k.total_orders, 0)
+    FROM months m
+    LEFT JOIN month_kpis k ON k.month_id = m.id
+    WHERE m.id = ?
+    ''', (month_id,))
+    month_name, last_update, total_expenses, total_revenues, total_orders = cursor.fetchone()
     
-    net_profit = total_revenues - total_expenses
-    profit_margin = (net_profit / total_revenues * 100) if total_revenues > 0 else 0
+    net_profit, profit_margin = _kpis(total_revenues, total_expenses)
     
     return {
-        'month_name': month_info[0],
-        'last_update': month_info[1],
+        'month_name': month_name,
+        'last_update': last_update,
         'total_expenses': total_expenses,
         'total_revenues': total_revenues,
         'net_profit': net_profit,
@@ -130,32 +207,22 @@ def get_month_summary(month_id: int) -> Dict:
     }
 
 
-@st.cache_data(ttl=300)
+@tagged_cache('months', 'month_kpis', ttl=300)
 def get_total_summary() -> Dict:
-    """الحصول على الملخص الإجمالي لجميع الأشهر"""
-    conn = sqlite3.connect(DB_PATH)
+    """الحصول على الملخص الإجمالي لجميع الأشهر (استعلام واحد من month_kpis)"""
+    conn = get_db_connection()
     cursor = conn.cursor()
     
-    # عدد الأشهر
-    cursor.execute('SELECT COUNT(*) FROM months')
-    months_count = cursor.fetchone()[0]
-    
-    # إجمالي المصاريف
-    cursor.execute('SELECT SUM(value) FROM expenses')
-    total_expenses = cursor.fetchone()[0] or 0
-    
-    # إجمالي الإيرادات
-    cursor.execute('SELECT SUM(value) FROM revenues')
-    total_revenues = cursor.fetchone()[0] or 0
-    
-    # إجمالي الطلبات
-    cursor.execute('SELECT SUM(orders) FROM revenues')
-    total_orders = cursor.fetchone()[0] or 0
-    
-    conn.close()
+    cursor.execute('''
+    SELECT (SELECT COUNT(*) FROM months),
+           COALESCE(SUM(total_expenses), 0),
+           COALESCE(SUM(total_revenues), 0),
+           COALESCE(SUM(total_orders), 0)
+    FROM month_kpis
+    ''')
+    months_count, total_expenses, total_revenues, total_orders = cursor.fetchone()
     
-    net_profit = total_revenues - total_expenses
-    profit_margin = (net_profit / total_revenues * 100) if total_revenues > 0 else 0
+    net_profit, profit_margin = _kpis(total_revenues, total_expenses)
     avg_revenue_per_month = total_revenues / months_count if months_count > 0 else 0
     
     return {
@@ -169,10 +236,10 @@ def get_total_summary() -> Dict:
     }
 
 
-@st.cache_data(ttl=300)
+@tagged_cache('expenses', ttl=300)
 def get_expenses_by_type() -> List[Dict]:
     """الحصول على المصاريف مجمعة حسب النوع"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -189,14 +256,13 @@ def get_expenses_by_type() -> List[Dict]:
             'total': row[1]
         })
     
-    conn.close()
     return expenses
 
 
-@st.cache_data(ttl=300)
+@tagged_cache('revenues', ttl=300)
 def get_revenues_by_type() -> List[Dict]:
     """الحصول على الإيرادات مجمعة حسب النوع"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -214,27 +280,25 @@ def get_revenues_by_type() -> List[Dict]:
             'orders': int(row[2])
         })
     
-    conn.close()
     return revenues
 
 
-@st.cache_data(ttl=300)
+@tagged_cache('months', 'month_kpis', ttl=300)
 def get_monthly_trend() -> List[Dict]:
     """الحصول على اتجاه الإيرادات والمصاريف الشهري"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
+    # من month_kpis مباشرة: الـ JOIN المزدوج على expenses و revenues كان يضاعف المجاميع
     cursor.execute('''
     SELECT 
         m.month_name,
         m.month_number,
         m.year,
-        COALESCE(SUM(e.value), 0) as total_expenses,
-        COALESCE(SUM(r.value), 0) as total_revenues
+        COALESCE(k.total_expenses, 0) as total_expenses,
+        COALESCE(k.total_revenues, 0) as total_revenues
     FROM months m
-    LEFT JOIN expenses e ON m.id = e.month_id
-    LEFT JOIN revenues r ON m.id = r.month_id
-    GROUP BY m.id, m.month_name, m.month_number, m.year
+    LEFT JOIN month_kpis k ON k.month_id = m.id
     ORDER BY m.year, m.month_number
     ''')
     
@@ -253,14 +317,13 @@ def get_monthly_trend() -> List[Dict]:
             'profit': profit
         })
     
-    conn.close()
     return trend
 
 
-@st.cache_data(ttl=300)
+@tagged_cache('revenues', ttl=300)
 def get_roi_analysis() -> List[Dict]:
     """تحليل العائد على الاستثمار (ROI) لكل قناة"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -284,214 +347,175 @@ def get_roi_analysis() -> List[Dict]:
             'total_orders': int(row[3])
         })
     
-    conn.close()
     return analysis
 
 
 def add_month(month_name: str, month_number: int, year: int) -> int:
     """إضافة شهر جديد"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    conn = get_db_connection()
     
     try:
-        cursor.execute('''
-        INSERT INTO months (month_name, month_number, year, last_update)
-        VALUES (?, ?, ?, ?)
-        ''', (month_name, month_number, year, datetime.now().strftime('%Y-%m-%d')))
-        
-        month_id = cursor.lastrowid
-        conn.commit()
+        # with conn: commit عند النجاح و rollback عند الخطأ (الاتصال مشترك ولا يُغلق)
+        with conn:
+            cursor = conn.execute('''
+            INSERT INTO months (month_name, month_number, year, last_update)
+            VALUES (?, ?, ?, ?)
+            ''', (month_name, month_number, year, datetime.now().strftime('%Y-%m-%d')))
+            month_id = cursor.lastrowid
+            _refresh_month_kpis(cursor, month_id)
         
-        # مسح الـ cache
-        get_all_months.clear()
-        get_total_summary.clear()
+        # مسح الـ cache (فقط الدوال المعتمدة على الجداول المعدلة)
+        invalidate('months', 'month_kpis')
         
         return month_id
         
     except sqlite3.IntegrityError:
         return None
-    finally:
-        conn.close()
 
 
 def add_expense(month_id: int, expense_type: str, value: float) -> bool:
     """إضافة مصروف"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    conn = get_db_connection()
     
     try:
-        cursor.execute('''
-        INSERT INTO expenses (month_id, expense_type, value)
-        VALUES (?, ?, ?)
-        ''', (month_id, expense_type, value))
-        
-        conn.commit()
+        with conn:
+            conn.execute('''
+            INSERT INTO expenses (month_id, expense_type, value)
+            VALUES (?, ?, ?)
+            ''', (month_id, expense_type, value))
+            _refresh_month_kpis(conn.cursor(), month_id)
         
-        # مسح الـ cache
-        get_month_expenses.clear()
-        get_month_summary.clear()
-        get_total_summary.clear()
-        get_expenses_by_type.clear()
-        get_monthly_trend.clear()
+        # مسح الـ cache (فقط الدوال المعتمدة على الجداول المعدلة)
+        invalidate('expenses', 'month_kpis')
         
         return True
         
     except Exception as e:
         print(f"خطأ في إضافة المصروف: {e}")
         return False
-    finally:
-        conn.close()
 
 
 def add_revenue(month_id: int, revenue_type: str, value: float, 
                 roi: Optional[float] = None, orders: int = 0) -> bool:
     """إضافة إيراد"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    conn = get_db_connection()
     
     try:
-        cursor.execute('''
-        INSERT INTO revenues (month_id, revenue_type, value, roi, orders)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (month_id, revenue_type, value, roi, orders))
+        with conn:
+            conn.execute('''
+            INSERT INTO revenues (month_id, revenue_type, value, roi, orders)
+            VALUES (?, ?, ?, ?, ?)
+            ''', (month_id, revenue_type, value, roi, orders))
+            _refresh_month_kpis(conn.cursor(), month_id)
         
-        conn.commit()
-        
-        # مسح الـ cache
-        get_month_revenues.clear()
-        get_month_summary.clear()
-        get_total_summary.clear()
-        get_revenues_by_type.clear()
-        get_monthly_trend.clear()
-        get_roi_analysis.clear()
+        # مسح الـ cache (فقط الدوال المعتمدة على الجداول المعدلة)
+        invalidate('revenues', 'month_kpis')
         
         return True
         
     except Exception as e:
         print(f"خطأ في إضافة الإيراد: {e}")
         return False
-    finally:
-        conn.close()
 
 
 def update_expense(expense_id: int, value: float) -> bool:
     """تحديث قيمة مصروف"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    conn = get_db_connection()
     
     try:
-        cursor.execute('''
-        UPDATE expenses
-        SET value = ?
-        WHERE id = ?
-        ''', (value, expense_id))
-        
-        conn.commit()
+        with conn:
+            conn.execute('''
+            UPDATE expenses
+            SET value = ?
+            WHERE id = ?
+            ''', (value, expense_id))
+            month_id = _month_of(conn, 'expenses', expense_id)
+            if month_id is not None:
+                _refresh_month_kpis(conn.cursor(), month_id)
         
-        # مسح الـ cache
-        get_month_expenses.clear()
-        get_month_summary.clear()
-        get_total_summary.clear()
-        get_expenses_by_type.clear()
-        get_monthly_trend.clear()
+        # مسح الـ cache (فقط الدوال المعتمدة على الجداول المعدلة)
+        invalidate('expenses', 'month_kpis')
         
         return True
         
     except Exception as e:
         print(f"خطأ في تحديث المصروف: {e}")
         return False
-    finally:
-        conn.close()
 
 
 def update_revenue(revenue_id: int, value: float, roi: Optional[float] = None, 
                    orders: Optional[int] = None) -> bool:
     """تحديث إيراد"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    conn = get_db_connection()
     
     try:
-        if roi is not None and orders is not None:
-            cursor.execute('''
-            UPDATE revenues
-            SET value = ?, roi = ?, orders = ?
-            WHERE id = ?
-            ''', (value, roi, orders, revenue_id))
-        else:
-            cursor.execute('''
-            UPDATE revenues
-            SET value = ?
-            WHERE id = ?
-            ''', (value, revenue_id))
+        with conn:
+            if roi is not None and orders is not None:
+                conn.execute('''
+                UPDATE revenues
+                SET value = ?, roi = ?, orders = ?
+                WHERE id = ?
+                ''', (value, roi, orders, revenue_id))
+            else:
+                conn.execute('''
+                UPDATE revenues
+                SET value = ?
+                WHERE id = ?
+                ''', (value, revenue_id))
+            month_id = _month_of(conn, 'revenues', revenue_id)
+            if month_id is not None:
+                _refresh_month_kpis(conn.cursor(), month_id)
         
-        conn.commit()
-        
-        # مسح الـ cache
-        get_month_revenues.clear()
-        get_month_summary.clear()
-        get_total_summary.clear()
-        get_revenues_by_type.clear()
-        get_monthly_trend.clear()
-        get_roi_analysis.clear()
+        # مسح الـ cache (فقط الدوال المعتمدة على الجداول المعدلة)
+        invalidate('revenues', 'month_kpis')
         
         return True
         
     except Exception as e:
         print(f"خطأ في تحديث الإيراد: {e}")
         return False
-    finally:
-        conn.close()
 
 
 def delete_expense(expense_id: int) -> bool:
     """حذف مصروف"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    conn = get_db_connection()
     
     try:
-        cursor.execute('DELETE FROM expenses WHERE id = ?', (expense_id,))
-        conn.commit()
+        with conn:
+            month_id = _month_of(conn, 'expenses', expense_id)
+            conn.execute('DELETE FROM expenses WHERE id = ?', (expense_id,))
+            if month_id is not None:
+                _refresh_month_kpis(conn.cursor(), month_id)
         
-        # مسح الـ cache
-        get_month_expenses.clear()
-        get_month_summary.clear()
-        get_total_summary.clear()
-        get_expenses_by_type.clear()
-        get_monthly_trend.clear()
+        # مسح الـ cache (فقط الدوال المعتمدة على الجداول المعدلة)
+        invalidate('expenses', 'month_kpis')
         
         return True
         
     except Exception as e:
         print(f"خطأ في حذف المصروف: {e}")
         return False
-    finally:
-        conn.close()
 
 
 def delete_revenue(revenue_id: int) -> bool:
     """حذف إيراد"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    conn = get_db_connection()
     
     try:
-        cursor.execute('DELETE FROM revenues WHERE id = ?', (revenue_id,))
-        conn.commit()
+        with conn:
+            month_id = _month_of(conn, 'revenues', revenue_id)
+            conn.execute('DELETE FROM revenues WHERE id = ?', (revenue_id,))
+            if month_id is not None:
+                _refresh_month_kpis(conn.cursor(), month_id)
         
-        # مسح الـ cache
-        get_month_revenues.clear()
-        get_month_summary.clear()
-        get_total_summary.clear()
-        get_revenues_by_type.clear()
-        get_monthly_trend.clear()
-        get_roi_analysis.clear()
+        # مسح الـ cache (فقط الدوال المعتمدة على الجداول المعدلة)
+        invalidate('revenues', 'month_kpis')
         
         return True
         
     except Exception as e:
         print(f"خطأ في حذف الإيراد: {e}")
         return False
-    finally:
-        conn.close()
 
 
 # دوال مساعدة للتنسيق
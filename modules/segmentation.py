@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة تقسيم العملاء (Segmentation) لحملات مراسلاتي
+Argan Smart Generator
+
+تبويب "إنشاء حملة جديدة" يجرّب الفلاتر (السعر، المدينة، الحالة، طريقة الدفع)
+مرات كثيرة: الطلبات تُحمَّل مرة واحدة في DataFrame بأعمدة محددة الأنواع (حتى
+يتغير جدول orders)، وتُطبَّق الفلاتر كأقنعة منطقية (vectorized) بدلاً من
+list comprehensions على قواميس الطلبات في كل إعادة تشغيل للصفحة.
+
+جمهور الحملة المحفوظة يُخزَّن في SQLite (campaign_members) بنفس الفلاتر داخل
+قاعدة البيانات (filters_to_query ← materialize_segment) ويُحدَّث بالطلبات
+المتغيرة فقط، فإعادة فتح الحملة أو تصديرها لا تعيد تطبيق الفلاتر على كل الطلبات.
+"""
+
+import streamlit as st
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+from modules.cache import tagged_cache
+from modules.database import (
+    LEGACY_COLUMNS, delete_segment, get_db_connection, get_segment_info, materialize_segment, refresh_segment,
+)
+
+
+# أعمدة الـ DataFrame بمفاتيح JSON القديم (نفس شكل query_orders)
+FRAME_COLUMNS = LEGACY_COLUMNS
+
+CATEGORY_COLUMNS = ['المدينة', 'حالة الطلب', ' طريقة الدفع']
+
+
+def _coerce_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    تحويل الأنواع مرة واحدة بدلاً من float(...) لكل طلب في كل فلتر
+
+    المبلغ الفارغ يبقى NaN (لا يطابق أي حد للسعر، كما في SQL).
+    """
+    df['المبلغ الاجمالي'] = pd.to_numeric(df['المبلغ الاجمالي'], errors='coerce').astype('float64')
+    for column in CATEGORY_COLUMNS:
+        df[column] = df[column].astype('category')
+    return df
+
+
+@tagged_cache('orders', ttl=600, show_spinner=False)
+def load_orders_frame() -> pd.DataFrame:
+    """
+    كل الطلبات كـ DataFrame محدد الأنواع (الأحدث أولاً)
+
+    يُعاد تحميله فقط عند تغير جدول orders (tag 'orders').
+
+    Returns:
+        DataFrame بأعمدة FRAME_COLUMNS
+    """
+    try:
+        select = ', '.join(f'{column} AS "{name}"' for column, name in FRAME_COLUMNS.items())
+        df = pd.read_sql_query(f'SELECT {select} FROM orders ORDER BY id DESC', get_db_connection())
+    except Exception as e:
+        st.error(f"خطأ في تحميل الطلبات: {e}")
+        df = pd.DataFrame(columns=list(FRAME_COLUMNS.values()))
+    return _coerce_frame(df)
+
+
+def get_filter_options(df: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    القيم المتاحة لفلاتر المدينة والحالة وطريقة الدفع
+
+    Returns:
+        {'cities': [...], 'statuses': [...], 'payments': [...]}
+    """
+    def _values(column: str) -> List[str]:
+        return sorted(str(value) for value in df[column].dropna().unique() if str(value))
+
+    return {
+        'cities': _values('المدينة'),
+        'statuses': _values('حالة الطلب'),
+        'payments': _values(' طريقة الدفع'),
+    }
+
+
+def segment_orders(df: pd.DataFrame,
+                   min_amount: Optional[float] = None,
+                   max_amount: Optional[float] = None,
+                   inclusive: bool = True,
+                   cities: Optional[List[str]] = None,
+                   statuses: Optional[List[str]] = None,
+                   payments: Optional[List[str]] = None) -> Dict:
+    """
+    تطبيق فلاتر الحملة على الطلبات دفعة واحدة (نفس نتيجة query_orders بنفس الفلاتر)
+
+    Args:
+        df: DataFrame من load_orders_frame
+        min_amount: الحد الأدنى لقيمة الطلب (None = بدون حد)
+        max_amount: الحد الأعلى لقيمة الطلب (None = بدون حد)
+        inclusive: هل الحدود شاملة (بين) أم لا (أكثر من / أقل من)
+        cities: المدن المطلوبة (None أو فارغة = الكل)
+        statuses: حالات الطلب المطلوبة (None أو فارغة = الكل)
+        payments: طرق الدفع المطلوبة (None أو فارغة = الكل)
+
+    Returns:
+        {'contacts': قائمة الطلبات المطابقة,
+         'metrics': {'total_customers', 'total_value', 'unique_phones', 'avg_order', 'cities'}}
+    """
+    mask = np.ones(len(df), dtype=bool)
+    amounts = df['المبلغ الاجمالي'].to_numpy()
+
+    if min_amount is not None:
+        mask &= (amounts >= min_amount) if inclusive else (amounts > min_amount)
+    if max_amount is not None:
+        mask &= (amounts <= max_amount) if inclusive else (amounts < max_amount)
+    for column, values in (('المدينة', cities), ('حالة الطلب', statuses), (' طريقة الدفع', payments)):
+        if values:
+            mask &= df[column].isin(values).to_numpy()
+
+    matched = df[mask]
+    return {
+        'contacts': _to_records(matched),
+        'metrics': segment_metrics(matched),
+    }
+
+
+def segment_metrics(df: pd.DataFrame) -> Dict:
+    """
+    المقاييس الإجمالية لمجموعة طلبات (نفس مفاتيح get_orders_summary)
+
+    Returns:
+        {'total_customers', 'total_value', 'unique_phones', 'avg_order', 'cities'}
+    """
+    total = len(df)
+    total_value = float(df['المبلغ الاجمالي'].sum()) if total else 0.0
+    phones = df['رقم الهاتف'].replace('', np.nan).dropna()
+    cities = df['المدينة'].astype('object').replace('', np.nan).dropna()
+
+    return {
+        'total_customers': total,
+        'total_value': total_value,
+        'unique_phones': int(phones.nunique()),
+        'avg_order': total_value / total if total else 0.0,
+        'cities': int(cities.nunique()),
+    }
+
+
+def _to_records(df: pd.DataFrame) -> List[Dict]:
+    """تحويل النتيجة إلى قائمة قواميس (بنفس شكل query_orders)"""
+    records = df.astype('object')
+    return records.where(df.notna(), None).to_dict('records')
+
+
+def filters_to_query(filters: Dict) -> Dict:
+    """
+    تحويل فلاتر الحملة المحفوظة في moraselaty_campaigns.json إلى معاملات segment_orders
+
+    نفس منطق تبويب "إنشاء حملة جديدة" (الكل / كامل السعودية = بدون فلتر).
+    """
+    price_type = filters.get('price_type', 'الكل')
+    cities = filters.get('cities') or []
+    statuses = filters.get('statuses') or []
+    payments = filters.get('payments') or []
+    return {
+        'min_amount': filters.get('min_price') if price_type in ('أكثر من', 'بين') else None,
+        'max_amount': filters.get('max_price') if price_type in ('أقل من', 'بين') else None,
+        'inclusive': price_type == 'بين',
+        'cities': None if 'كامل السعودية' in cities else cities,
+        'statuses': None if 'الكل' in statuses else statuses,
+        'payments': None if 'الكل' in payments else payments,
+    }
+
+
+def is_legacy_campaign(campaign: Dict) -> bool:
+    """
+    حملة محفوظة قبل تخزين الجمهور في SQLite: قائمة العملاء المحفوظة معها هي الجمهور
+
+    الحملات القديمة حفظت نوع فلتر السعر بدون قيمه (min_price / max_price)، فلا
+    يمكن إعادة بناء جمهورها من الفلاتر.
+    """
+    if campaign.get('customers'):
+        return True
+    filters = campaign.get('filters')
+    if filters is None:
+        return False
+    return (filters.get('price_type', 'الكل') != 'الكل'
+            and 'min_price' not in filters and 'max_price' not in filters)
+
+
+def saved_order_numbers(campaign: Dict) -> List:
+    """أرقام الطلبات في قائمة العملاء المحفوظة مع الحملة (الحملات القديمة)"""
+    return [c.get('رقم الطلب') for c in campaign.get('customers') or [] if c.get('رقم الطلب') is not None]
+
+
+def ensure_campaign_segment(campaign: Dict) -> bool:
+    """
+    التأكد من أن جمهور الحملة محفوظ ومحدّث
+
+    الحملة غير المحفوظة بعد تُحفظ من فلاترها، والحملات القديمة (is_legacy_campaign)
+    من قائمة العملاء المخزنة معها؛ المحفوظة تُحدَّث بالطلبات المتغيرة فقط.
+
+    Returns:
+        True إذا كان للحملة جمهور محفوظ (الحملات التسويقية ليس لها جمهور)
+    """
+    try:
+        legacy = is_legacy_campaign(campaign)
+        info = get_segment_info(campaign['id'])
+        # جمهور حملة قديمة بُني من الفلاتر (بدون فلتر السعر) يُعاد بناؤه من القائمة المحفوظة
+        if info is not None and not (legacy and info['filters'] is not None):
+            refresh_segment(campaign['id'])
+            return True
+
+        if legacy:
+            order_numbers = saved_order_numbers(campaign)
+            if not order_numbers:
+                if info is not None:
+                    delete_segment(campaign['id'])
+                return False
+            materialize_segment(campaign['id'], order_numbers=order_numbers)
+        elif campaign.get('filters') is not None:
+            materialize_segment(campaign['id'], query=filters_to_query(campaign['filters']))
+        else:
+            return False
+        return True
+    except Exception as e:
+        st.error(f"خطأ في تحديث جمهور الحملة: {e}")
+        return False
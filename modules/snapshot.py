@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة اللقطات المشتركة (Shared Snapshots) لملفات الإعدادات
+Argan Smart Generator
+
+بديل المتغيرات العامة USERS / OPTIONS / CAMPAIGNS في app.py: نسخة واحدة من
+كل ملف في ذاكرة العملية (st.cache_resource) تشترك فيها كل الجلسات.
+
+- كل لقطة لها رقم إصدار (version) يزيد مع كل تغيير.
+- اللقطة للقراءة فقط؛ التعديل عبر update_snapshot الذي يعمل على نسخة جديدة
+  (copy-on-write) ثم يستبدل المرجع، فلا ترى أي جلسة بيانات نصف معدّلة.
+- إذا تغير الملف على القرص (save_users أو أداة خارجية) يُعاد تحميله تلقائياً
+  عند أول قراءة بعد CHECK_INTERVAL ثانية.
+- subscribe لتسجيل دالة تُستدعى عند كل تغيير.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import streamlit as st
+
+from modules.json_store import get_etag, read_json, update_json
+
+
+CHECK_INTERVAL = 1.0  # ثوانٍ بين فحص بصمة الملف على القرص
+
+
+@st.cache_resource(show_spinner=False)
+def _registry() -> Dict[str, Any]:
+    """الحالة المشتركة بين كل الجلسات في نفس العملية"""
+    return {
+        'lock': threading.RLock(),
+        'entries': {},    # path -> {'version', 'etag', 'data', 'checked_at'}
+        'listeners': {},  # path -> [callback]
+    }
+
+
+def _notify(registry: Dict, path: str, version: int, data: Any):
+    for callback in list(registry['listeners'].get(path, [])):
+        try:
+            callback(path, version, data)
+        except Exception as e:
+            print(f"خطأ في مستمع اللقطة {path}: {e}")
+
+
+def _load(registry: Dict, path: str, default: Any) -> Dict:
+    """تحميل الملف أو إعادة تحميله إن تغيرت بصمته (تحت القفل)"""
+    entry = registry['entries'].get(path)
+    now = time.monotonic()
+    if entry is not None and now - entry['checked_at'] < CHECK_INTERVAL:
+        return entry
+
+    etag = get_etag(path)
+    if entry is not None and entry['etag'] == etag:
+        entry['checked_at'] = now
+        return entry
+
+    data = read_json(path, default)
+    version = entry['version'] + 1 if entry else 1
+    entry = {'version': version, 'etag': etag, 'data': data, 'checked_at': now}
+    registry['entries'][path] = entry
+    if version > 1:
+        _notify(registry, path, version, data)
+    return entry
+
+
+def get_snapshot(path: str, default: Any = None) -> Any:
+    """
+    اللقطة الحالية لملف JSON (مشتركة بين الجلسات - لا تعدّلها مباشرة)
+
+    Args:
+        path: مسار الملف (مثل 'users.json')
+        default: المحتوى إن لم يكن الملف موجوداً
+
+    Returns:
+        المحتوى (نفس الكائن لكل الجلسات حتى يتغير الإصدار)
+    """
+    registry = _registry()
+    try:
+        with registry['lock']:
+            return _load(registry, path, default)['data']
+    except Exception as e:
+        st.error(f"⚠️ خطأ في تحميل {path}: {e}")
+        return default
+
+
+def get_version(path: str) -> int:
+    """رقم إصدار اللقطة (0 إن لم تُحمّل بعد)"""
+    registry = _registry()
+    with registry['lock']:
+        entry = registry['entries'].get(path)
+        return entry['version'] if entry else 0
+
+
+def update_snapshot(path: str, mutate: Callable[[Any], Any], default: Any = None) -> Optional[int]:
+    """
+    تعديل ملف ولقطته معاً (copy-on-write)
+
+    mutate تعمل على نسخة جديدة مقروءة من القرص داخل قفل json_store، ثم تُحفظ
+    وتستبدل اللقطة المشتركة. القرّاء الحاليون يكملون على النسخة القديمة.
+
+    Args:
+        mutate: تعدّل النسخة في مكانها أو تعيد محتوى جديداً
+
+    Returns:
+        رقم الإصدار الجديد، أو None عند الفشل
+
+    Example:
+        update_snapshot('campaigns.json', lambda c: c.append('حملة رمضان'), default=[])
+    """
+    registry = _registry()
+    try:
+        with registry['lock']:
+            data = update_json(path, mutate, default)
+            entry = registry['entries'].get(path)
+            version = entry['version'] + 1 if entry else 1
+            registry['entries'][path] = {
+                'version': version,
+                'etag': get_etag(path),
+                'data': data,
+                'checked_at': time.monotonic(),
+            }
+            _notify(registry, path, version, data)
+            return version
+    except Exception as e:
+        st.error(f"⚠️ فشل حفظ {path}: {e}")
+        return None
+
+
+def subscribe(path: str, callback: Callable[[str, int, Any], None]):
+    """
+    تسجيل دالة تُستدعى (path, version, data) عند كل تغيير في اللقطة
+
+    Example:
+        subscribe('options.json', lambda path, version, data: print(version))
+    """
+    registry = _registry()
+    with registry['lock']:
+        listeners: List = registry['listeners'].setdefault(path, [])
+        if callback not in listeners:
+            listeners.append(callback)
+
+
+def unsubscribe(path: str, callback: Callable[[str, int, Any], None]):
+    """إلغاء تسجيل دالة"""
+    registry = _registry()
+    with registry['lock']:
+        listeners = registry['listeners'].get(path, [])
+        if callback in listeners:
+            listeners.remove(callback)
+
+
+def reload_snapshots():
+    """إجبار إعادة فحص كل الملفات عند القراءة التالية"""
+    registry = _registry()
+    with registry['lock']:
+        for entry in registry['entries'].values():
+            entry['checked_at'] = float('-inf')
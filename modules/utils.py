@@ -12,11 +12,15 @@ from datetime import datetime
 from hijri_converter import Hijri, Gregorian
 from typing import Any, Dict, List, Optional
 
+from modules.cache import invalidate, invalidate_all
+from modules.json_store import read_json, write_json
+
 
-@st.cache_data(ttl=300)
 def load_json(path: str) -> Any:
     """
-    تحميل ملف JSON مع معالجة أفضل للأخطاء (cached)
+    تحميل ملف JSON مع معالجة أفضل للأخطاء
+
+    القراءة من cache الـ json_store ما دام الملف لم يتغير على القرص.
     
     Args:
         path: مسار الملف
@@ -24,27 +28,25 @@ def load_json(path: str) -> Any:
     Returns:
         محتوى الملف (dict أو list)
     """
+    default_data = [] if 'logs' in path else {}
     try:
         if not os.path.exists(path):
             # إنشاء ملف فارغ إذا لم يكن موجوداً
-            default_data = [] if 'logs' in path else {}
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(default_data, f, ensure_ascii=False, indent=2)
+            write_json(path, default_data)
             return default_data
         
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        return read_json(path, default_data)
     except json.JSONDecodeError:
         st.error(f"⚠️ خطأ في قراءة الملف: {path}")
-        return [] if 'logs' in path else {}
+        return default_data
     except Exception as e:
         st.error(f"⚠️ خطأ غير متوقع: {e}")
-        return [] if 'logs' in path else {}
+        return default_data
 
 
 def save_json(path: str, data: Any) -> bool:
     """
-    حفظ البيانات إلى ملف JSON مع معالجة الأخطاء
+    حفظ البيانات إلى ملف JSON (كتابة ذرية تحت قفل)
     
     Args:
         path: مسار الملف
@@ -54,10 +56,7 @@ def save_json(path: str, data: Any) -> bool:
         True إذا نجح الحفظ، False إذا فشل
     """
     try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        # مسح الـ cache لإعادة التحميل
-        load_json.clear()
+        write_json(path, data)
         return True
     except Exception as e:
         st.error(f"⚠️ فشل حفظ البيانات: {e}")
@@ -311,9 +310,17 @@ def parse_date(date_str: str) -> Optional[datetime]:
     return None
 
 
-def clear_all_cache():
-    """مسح جميع الـ cache"""
-    st.cache_data.clear()
-    st.cache_resource.clear()
+def clear_all_cache(*tags: str):
+    """
+    مسح الـ cache
+    
+    Args:
+        *tags: الجداول/الملفات المطلوب إبطالها فقط (مثل 'orders' أو file_tag('users.json'))،
+               وبدونها يُمسح كل الـ cache (زر المسح اليدوي في لوحة الإدارة)
+    """
+    if tags:
+        invalidate(*tags)
+    else:
+        invalidate_all()
     st.success("✅ تم مسح الـ cache بنجاح!")
 
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+وحدة cache ملفات Excel المحللة (الجرد وغيره)
+Argan Smart Generator
+
+تحليل xlsx هو أبطأ خطوة في صفحات الجرد، لذلك يُحوَّل كل ملف مرة واحدة إلى
+جدول في database/workbook_cache.db مفتاحه بصمة محتوى الملف (SHA-256):
+
+- العرض التالي لنفس الملف يقرأ الجدول مباشرة (أجزاء من الثانية).
+- تغيير محتوى الملف يغيّر البصمة فيُحلَّل من جديد؛ إعادة حفظ نفس المحتوى لا.
+- البصمة نفسها محفوظة حسب (mtime, size, inode) فلا يُعاد حساب الـ hash في كل عرض.
+- يُحتفظ بآخر MAX_CACHED_WORKBOOKS ملف فقط (الأقدم استخداماً يُحذف).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from modules.connection import get_connection
+from modules.ingest import read_excel_frame
+from modules.json_store import get_etag
+
+
+DB_PATH = 'database/workbook_cache.db'
+MAX_CACHED_WORKBOOKS = 20
+HASH_BLOCK_SIZE = 1024 * 1024
+
+_hash_lock = threading.Lock()
+_hash_cache: Dict[str, Tuple[tuple, str]] = {}
+
+
+def ensure_workbook_cache_schema(conn: sqlite3.Connection):
+    """إنشاء جدول فهرس الملفات المخزنة"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS workbooks (
+            content_hash TEXT NOT NULL,
+            sheet TEXT NOT NULL DEFAULT '',
+            table_name TEXT NOT NULL,
+            source_path TEXT,
+            dtypes TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            created_at TEXT NOT NULL,
+            last_used TEXT NOT NULL,
+            PRIMARY KEY (content_hash, sheet)
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_workbooks_last_used ON workbooks(last_used)')
+    conn.commit()
+
+
+def get_db_connection() -> sqlite3.Connection:
+    """اتصال الـ thread الحالي بقاعدة بيانات الـ cache"""
+    return get_connection(DB_PATH, ensure_workbook_cache_schema)
+
+
+def file_hash(path: str) -> str:
+    """
+    بصمة SHA-256 لمحتوى الملف
+
+    تُحفظ حسب (mtime, size, inode)، فلا تُقرأ محتويات الملف إلا إذا تغير.
+    """
+    key = os.path.abspath(path)
+    etag = get_etag(path)
+    with _hash_lock:
+        cached = _hash_cache.get(key)
+    if cached is not None and cached[0] == etag:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    content_hash = digest.hexdigest()
+
+    with _hash_lock:
+        _hash_cache[key] = (etag, content_hash)
+    return content_hash
+
+
+def _table_name(content_hash: str, sheet: str) -> str:
+    suffix = hashlib.sha256(sheet.encode('utf-8')).hexdigest()[:8] if sheet else 'active'
+    return f'wb_{content_hash[:32]}_{suffix}'
+
+
+def _restore_dtypes(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """إعادة أنواع الأعمدة التي لا يحفظها SQLite كما هي (التواريخ)"""
+    for column, dtype in dtypes.items():
+        if column in df.columns and dtype.startswith('datetime64'):
+            df[column] = pd.to_datetime(df[column], errors='coerce')
+    return df
+
+
+def _evict(conn: sqlite3.Connection, keep: int):
+    """حذف الملفات الأقدم استخداماً بعد أول keep ملف"""
+    stale = conn.execute(
+        'SELECT content_hash, sheet, table_name FROM workbooks ORDER BY last_used DESC LIMIT -1 OFFSET ?',
+        (keep,)
+    ).fetchall()
+    for content_hash, sheet, table_name in stale:
+        conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+        conn.execute('DELETE FROM workbooks WHERE content_hash = ? AND sheet = ?', (content_hash, sheet))
+
+
+def load_workbook_frame(path: str, numeric_columns: Optional[List[str]] = None,
+                        sheet: Optional[str] = None) -> pd.DataFrame:
+    """
+    DataFrame ورقة Excel من الـ cache، أو تحليلها وتخزينها إن لم تكن مخزنة
+
+    Args:
+        path: مسار ملف xlsx
+        numeric_columns: أعمدة تُحوّل إلى أرقام عند التحليل (مثل ["كميته"])
+        sheet: اسم الورقة (الافتراضي: الورقة النشطة)
+
+    Returns:
+        نفس نتيجة read_excel_frame
+    """
+    content_hash = file_hash(path)
+    sheet_key = sheet or ''
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_db_connection()
+
+    row = conn.execute(
+        'SELECT table_name, dtypes FROM workbooks WHERE content_hash = ? AND sheet = ?',
+        (content_hash, sheet_key)
+    ).fetchone()
+    if row is not None:
+        table_name, dtypes = row
+        try:
+            df = pd.read_sql(f'SELECT * FROM "{table_name}"', conn)
+            with conn:
+                conn.execute('UPDATE workbooks SET last_used = ? WHERE content_hash = ? AND sheet = ?',
+                             (now, content_hash, sheet_key))
+            return _restore_dtypes(df, json.loads(dtypes))
+        except (sqlite3.Error, pd.errors.DatabaseError):
+            # جدول ناقص أو محذوف يدوياً: إعادة التحليل
+            pass
+
+    df = read_excel_frame(path, numeric_columns=numeric_columns, sheet=sheet)
+    table_name = _table_name(content_hash, sheet_key)
+    dtypes = {str(column): str(dtype) for column, dtype in df.dtypes.items()}
+
+    with conn:
+        df.to_sql(table_name, conn, if_exists='replace', index=False)
+        conn.execute('''
+            INSERT OR REPLACE INTO workbooks
+                (content_hash, sheet, table_name, source_path, dtypes, row_count, created_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (content_hash, sheet_key, table_name, path, json.dumps(dtypes, ensure_ascii=False),
+              len(df), now, now))
+        _evict(conn, MAX_CACHED_WORKBOOKS)
+    return df
+
+
+def get_cached_workbooks() -> List[Dict]:
+    """قائمة الملفات المخزنة (للوحة الإدارة)"""
+    cursor = get_db_connection().execute('''
+        SELECT content_hash, sheet, source_path, row_count, created_at, last_used
+        FROM workbooks ORDER BY last_used DESC
+    ''')
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def clear_workbook_cache():
+    """حذف كل الملفات المخزنة"""
+    conn = get_db_connection()
+    with conn:
+        _evict(conn, 0)
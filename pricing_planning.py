@@ -16,6 +16,11 @@ from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
 from openpyxl.utils.dataframe import dataframe_to_rows
 
+from modules.llm_cache import cached_chat, stream_chat
+from modules.llm_quota import QuotaExceeded
+from modules.pricing_engine import catalogue_frame
+from modules.pricing_optimizer import optimize_prices
+
 # ============================================
 # 💰 تخطيط التسعير للحملات
 # ============================================
@@ -355,10 +360,52 @@ def create_new_pricing_plan():
         # النصائح الذكية من GPT
         st.markdown("#### 🤖 النصائح الذكية")
         
+        # زر الإيقاف يعيد تشغيل الصفحة فيقطع التوليد: عرض ما وصل قبل الإيقاف
+        if st.session_state.pop('pricing_advice_stopped', False) and st.session_state.get('partial_pricing_advice'):
+            st.warning("⏹️ تم إيقاف التوليد، هذا ما وصل قبل الإيقاف:")
+            st.markdown(st.session_state.partial_pricing_advice)
+        
         if st.button("✨ احصل على نصائح من الذكاء الاصطناعي", use_container_width=True, type="primary"):
-            with st.spinner("🤖 جاري تحليل الأسعار..."):
-                advice = get_ai_pricing_advice(st.session_state.pricing_products, base_discount, code_discount)
-                st.markdown(advice)
+            # النصائح تظهر أثناء كتابتها
+            st.button("⏹️ إيقاف", key="stop_pricing_advice",
+                      on_click=lambda: st.session_state.update(pricing_advice_stopped=True))
+            advice_box = st.empty()
+            advice_box.info("🤖 جاري تحليل الأسعار...")
+            
+            def on_token(delta, text):
+                st.session_state.partial_pricing_advice = text
+                advice_box.markdown(text + " ▌")
+            
+            advice = get_ai_pricing_advice(
+                st.session_state.pricing_products, base_discount, code_discount,
+                on_token=on_token,
+                user=st.session_state.get("user")
+            )
+            st.session_state.pop('partial_pricing_advice', None)
+            advice_box.markdown(advice)
+        
+        # أسعار مقترحة محلياً: نهايات نفسية + سلّم أحجام متسق + الحد الأدنى للربح (بدون API)
+        if st.button("🧮 أسعار مقترحة (بدون ذكاء اصطناعي)", use_container_width=True):
+            products = {p['name']: p for p in st.session_state.pricing_products}
+            suggested = optimize_prices(
+                catalogue_frame(products, {name: p['cost'] for name, p in products.items()}),
+                min_margin=min(min_profit, 95.0),
+                target_base_discount=base_discount,
+                target_code_discount=code_discount
+            )
+            for name in suggested.index[~suggested['feasible']]:
+                st.warning(f"⚠️ {name}: لا يوجد سعر يحقق {min_profit:.0f}% ربح بهذه التكلفة")
+            st.dataframe(
+                suggested[['base_price', 'cost', 'after_discount', 'after_code', 'profit_margin', 'status']].rename(columns={
+                    'base_price': 'السعر الأساسي',
+                    'cost': 'التكلفة',
+                    'after_discount': 'بعد الخصم (مقترح)',
+                    'after_code': 'بعد الكود (مقترح)',
+                    'profit_margin': 'نسبة الربح',
+                    'status': 'الحالة'
+                }).round(2),
+                use_container_width=True
+            )
         
         # حفظ الخطة
         st.markdown("---")
@@ -464,8 +511,13 @@ def get_product_pricing(product_name):
         return None
 
 
-def get_ai_pricing_advice(products, base_discount, code_discount):
-    """الحصول على نصائح ذكية من GPT حول التسعير"""
+def get_ai_pricing_advice(products, base_discount, code_discount, on_token=None, user=None):
+    """
+    الحصول على نصائح ذكية من GPT حول التسعير
+    
+    on_token: (الجزء الجديد, النص حتى الآن) لعرض الرد أثناء توليده (stream)
+    user: المستخدم الحالي (للحصة اليومية وسجل التكلفة)
+    """
     
     try:
         client = OpenAI()
@@ -501,18 +553,22 @@ def get_ai_pricing_advice(products, base_discount, code_discount):
 اجعل الرد باللغة العربية، منظماً، واحترافياً مع استخدام الرموز التعبيرية.
 """
         
-        response = client.chat.completions.create(
-            model="gpt-4.1-mini",
-            messages=[
-                {"role": "system", "content": "أنت خبير في التسعير والتسويق، تقدم نصائح احترافية ومدروسة."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=2000
-        )
+        messages = [
+            {"role": "system", "content": "أنت خبير في التسعير والتسويق، تقدم نصائح احترافية ومدروسة."},
+            {"role": "user", "content": prompt}
+        ]
+        context = {"user": user, "feature": "نصائح التسعير"}
+        if on_token:
+            response = stream_chat(messages, model="gpt-4.1-mini", temperature=0.7, max_tokens=2000,
+                                   on_token=on_token, client=client, context=context)
+        else:
+            response = cached_chat(messages, model="gpt-4.1-mini", temperature=0.7, max_tokens=2000,
+                                   client=client, context=context)
         
-        return response.choices[0].message.content
+        return response['content']
         
+    except QuotaExceeded as e:
+        return str(e)
     except Exception as e:
         return f"❌ خطأ في الحصول على النصائح: {str(e)}"
 
@@ -9,14 +9,23 @@ Argan Smart Generator - Pricing Planning System
 - نسبة خصم منفصلة لكل منتج
 - إمكانية تعديل كامل للبيانات
 - تصميم احترافي وجذاب
+- محاكاة الخصومات لكل المنتجات دفعة واحدة (modules/pricing_engine.py)
+- اقتراح أسعار آمنة الربح بنهايات نفسية وسلّم أحجام متسق (modules/pricing_optimizer.py)
 """
 
 import streamlit as st
 import json
 import os
 from datetime import datetime
+import numpy as np
 import pandas as pd
 
+from modules.pricing_engine import (
+    DEFAULT_COST_RATIO, EXCELLENT_MARGIN, GOOD_MARGIN, catalogue_frame, evaluate_scenarios,
+    margin_heatmap, product_thresholds, summarize_scenarios,
+)
+from modules.pricing_optimizer import PRICE_ENDINGS, optimize_prices, to_products_pricing
+
 
 def load_products_pricing():
     """تحميل بيانات التسعير من ملف JSON"""
@@ -232,13 +241,21 @@ def pricing_planning():
         return
     
     # التبويبات
-    tab1, tab2 = st.tabs(["📋 خطط التسعير المحفوظة", "➕ خطة تسعير جديدة"])
+    tab1, tab2, tab3, tab4 = st.tabs([
+        "📋 خطط التسعير المحفوظة", "➕ خطة تسعير جديدة", "🧮 محاكاة الخصومات", "🎯 الأسعار المقترحة"
+    ])
     
     with tab1:
         show_saved_plans(pricing_plans)
     
     with tab2:
         create_new_plan(products_pricing)
+    
+    with tab3:
+        show_scenario_explorer(products_pricing)
+    
+    with tab4:
+        show_price_optimizer(products_pricing)
 
 
 def show_saved_plans(plans):
@@ -512,3 +529,166 @@ def create_new_plan(products_pricing):
                     st.session_state.pricing_products = []
                     st.rerun()
 
+
+def _margin_style(value):
+    """لون خلية نسبة الربح حسب حدود الحالات"""
+    if value >= EXCELLENT_MARGIN:
+        return "background-color: #d4edda"
+    if value >= GOOD_MARGIN:
+        return "background-color: #fff3cd"
+    return "background-color: #f8d7da"
+
+
+def show_scenario_explorer(products_pricing):
+    """محاكاة كل تركيبات الخصم الأساسي × خصم الكود لكل المنتجات"""
+    st.markdown('<div class="section-header">🧮 محاكاة الخصومات</div>', unsafe_allow_html=True)
+    
+    # التكاليف (قابلة للتعديل، الافتراضي 50% من السعر بعد الكود)
+    if 'scenario_costs' not in st.session_state:
+        st.session_state.scenario_costs = {
+            name: round(data['after_code'] * DEFAULT_COST_RATIO, 2) for name, data in products_pricing.items()
+        }
+    
+    with st.expander("💵 تكاليف المنتجات", expanded=False):
+        costs_df = pd.DataFrame({
+            'المنتج': list(products_pricing.keys()),
+            'بعد الكود': [data['after_code'] for data in products_pricing.values()],
+            'التكلفة': [st.session_state.scenario_costs.get(name, np.nan) for name in products_pricing],
+        })
+        edited = st.data_editor(
+            costs_df,
+            disabled=['المنتج', 'بعد الكود'],
+            hide_index=True,
+            use_container_width=True,
+            key="scenario_costs_editor"
+        )
+        st.session_state.scenario_costs = dict(zip(edited['المنتج'], edited['التكلفة']))
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        base_range = st.slider("الخصم الأساسي %", 0.0, 80.0, (0.0, 40.0), step=1.0)
+    with col2:
+        code_range = st.slider("خصم الكود %", 0.0, 50.0, (0.0, 20.0), step=1.0)
+    with col3:
+        step = st.select_slider("دقة الشبكة %", options=[0.25, 0.5, 1.0, 2.0, 5.0], value=1.0)
+    
+    base_discounts = np.arange(base_range[0], base_range[1] + step / 2, step)
+    code_discounts = np.arange(code_range[0], code_range[1] + step / 2, step)
+    
+    frame = catalogue_frame(products_pricing, st.session_state.scenario_costs)
+    grid = evaluate_scenarios(frame, base_discounts, code_discounts)
+    summary = summarize_scenarios(grid)
+    
+    st.caption(f"📐 {len(summary):,} سيناريو × {len(frame)} منتج")
+    
+    # خريطة نسبة الربح
+    st.markdown("### 🌡️ نسبة الربح حسب الخصم")
+    product_choice = st.selectbox(
+        "المنتج:",
+        options=["متوسط كل المنتجات"] + grid['products'],
+        key="scenario_product"
+    )
+    heatmap = margin_heatmap(grid, None if product_choice == "متوسط كل المنتجات" else product_choice)
+    st.dataframe(heatmap.style.map(_margin_style).format("{:.1f}"), use_container_width=True)
+    
+    # أعلى الخصومات بدون منتجات في حالة تحذير
+    st.markdown("### 🏆 أعلى خصم بدون منتجات في حالة تحذير")
+    safe = summary[summary['warning'] == 0].copy()
+    if safe.empty:
+        st.warning("⚠️ كل السيناريوهات فيها منتجات بنسبة ربح أقل من الحد الأدنى")
+    else:
+        safe['total_discount'] = 100 - (100 - safe['base_discount']) * (100 - safe['code_discount']) / 100
+        safe = safe.sort_values(['total_discount', 'total_profit'], ascending=False).head(10)
+        st.dataframe(
+            safe.rename(columns={
+                'base_discount': 'الخصم الأساسي %',
+                'code_discount': 'خصم الكود %',
+                'total_discount': 'الخصم الكلي %',
+                'avg_margin': 'متوسط الربح %',
+                'min_margin': 'أقل ربح %',
+                'total_profit': 'إجمالي الربح',
+                'excellent': 'ممتاز',
+                'good': 'جيد',
+                'warning': 'تحذير',
+            }).round(2),
+            use_container_width=True,
+            hide_index=True
+        )
+    
+    # حدود الحالات لكل منتج
+    st.markdown("### 🎯 حدود الخصم لكل منتج")
+    thresholds = product_thresholds(frame)
+    st.dataframe(
+        thresholds.rename(columns={
+            'break_even_price': 'سعر التعادل',
+            'break_even_discount': 'خصم التعادل %',
+            'break_even_max_base_discount': 'أقصى خصم أساسي (تعادل) %',
+            'good_price': 'سعر "جيد"',
+            'good_discount': 'خصم "جيد" %',
+            'good_max_base_discount': 'أقصى خصم أساسي ("جيد") %',
+            'excellent_price': 'سعر "ممتاز"',
+            'excellent_discount': 'خصم "ممتاز" %',
+            'excellent_max_base_discount': 'أقصى خصم أساسي ("ممتاز") %',
+        }).round(2),
+        use_container_width=True
+    )
+    st.caption("الخصم الكلي محسوب من السعر الأساسي؛ أقصى خصم أساسي مع بقاء خصم الكود الحالي للمنتج")
+
+
+def show_price_optimizer(products_pricing):
+    """اقتراح أسعار بعد الخصم وبعد الكود لكل الكتالوج (بحث محلي بدون API)"""
+    st.markdown('<div class="section-header">🎯 الأسعار المقترحة</div>', unsafe_allow_html=True)
+    st.info("💡 التكاليف من تبويب \"محاكاة الخصومات\" (الافتراضي 50% من السعر بعد الكود)")
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        min_margin = st.number_input("📊 أقل نسبة ربح (%):", 0.0, 95.0, GOOD_MARGIN, step=1.0, key="opt_min_margin")
+        endings = st.multiselect("🔢 نهايات الأسعار:", list(range(10)), default=list(PRICE_ENDINGS), key="opt_endings")
+    with col2:
+        target_base = st.number_input("💸 الخصم الأساسي المستهدف (%):", 0.0, 90.0, 15.0, step=1.0, key="opt_target_base")
+        target_code = st.number_input("🎟️ خصم الكود المستهدف (%):", 0.0, 90.0, 5.0, step=1.0, key="opt_target_code")
+    with col3:
+        code_range = st.slider("حدود خصم الكود (%)", 0.0, 50.0, (1.0, 20.0), step=0.5, key="opt_code_range")
+        ladder = st.checkbox("📏 اتساق سلّم الأحجام", value=True, key="opt_ladder")
+    
+    if not st.button("🔍 ابحث عن الأسعار", type="primary", use_container_width=True):
+        return
+    
+    frame = catalogue_frame(products_pricing, st.session_state.get('scenario_costs'))
+    result = optimize_prices(
+        frame,
+        min_margin=min_margin,
+        target_base_discount=target_base,
+        target_code_discount=target_code,
+        min_code_discount=code_range[0],
+        max_code_discount=code_range[1],
+        endings=endings,
+        ladder=ladder
+    )
+    
+    infeasible = result.index[~result['feasible']]
+    if len(infeasible):
+        st.warning(f"⚠️ لا يوجد سعر يحقق {min_margin:.0f}% ربح (بقيت الأسعار الحالية): {'، '.join(infeasible)}")
+    broken = result.index[result['feasible'] & ~result['ladder_ok']]
+    if len(broken):
+        st.warning(f"⚠️ تعذّر اتساق سلّم الأحجام: {'، '.join(broken)}")
+    
+    display = pd.DataFrame({
+        'السعر الأساسي': result['base_price'],
+        'التكلفة': result['cost'].round(2),
+        'بعد الخصم (حالياً)': frame['after_discount'],
+        'بعد الخصم (مقترح)': result['after_discount'],
+        'بعد الكود (حالياً)': frame['after_code'],
+        'بعد الكود (مقترح)': result['after_code'],
+        'خصم الكود %': result['code_discount_percent'],
+        'نسبة الربح %': result['profit_margin'].round(2),
+        'الحالة': result['status_color'] + " " + result['status'],
+    })
+    st.dataframe(display, use_container_width=True)
+    
+    st.download_button(
+        "⬇️ تحميل products_pricing.json المقترح",
+        json.dumps(to_products_pricing(result), ensure_ascii=False, indent=2),
+        "products_pricing_suggested.json",
+        "application/json"
+    )
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ملف اختبار لقطات الجرد (modules/inventory.py)
+
+قواعد بيانات مؤقتة لكل اختبار (DB_PATH في tmp_path).
+"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from modules import inventory, workbook_cache
+from modules.inventory import (
+    count_inventory_items, get_inventory_page, get_item_history, get_latest_snapshot, get_snapshots, import_inventory_file,
+)
+
+
+@pytest.fixture
+def inventory_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(inventory, 'DB_PATH', str(tmp_path / 'inventory.db'))
+    monkeypatch.setattr(workbook_cache, 'DB_PATH', str(tmp_path / 'workbook_cache.db'))
+    return tmp_path
+
+
+def _write(path, quantity, mtime):
+    pd.DataFrame({'اسم المنتج': ['زيت الارجان'], 'كميته': [quantity]}).to_excel(path, index=False)
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+
+def test_reupload_makes_old_content_latest(inventory_db):
+    """رفع A ثم B ثم A مرة أخرى: اللقطة الأحدث هي A"""
+
+    print("🧪 اختبار إعادة رفع ملف جرد:")
+    path_a = _write(inventory_db / 'a.xlsx', 50, 1_700_000_000)
+    snapshot_a = import_inventory_file(path_a)
+    snapshot_b = import_inventory_file(_write(inventory_db / 'b.xlsx', 800, 1_700_000_100))
+    assert get_latest_snapshot()['id'] == snapshot_b
+
+    # نفس المحتوى، رفع جديد (وقت تعديل أحدث)
+    assert import_inventory_file(_write(inventory_db / 'a.xlsx', 50, 1_700_000_200)) == snapshot_a
+    latest = get_latest_snapshot()
+    assert latest['id'] == snapshot_a
+    assert latest['source_file'] == 'a.xlsx'
+    assert [s['id'] for s in get_snapshots()] == [snapshot_a, snapshot_b]
+
+    # نفس الملف بدون تعديل (مزامنة المجلد) لا يُسجَّل مرة أخرى
+    import_inventory_file(path_a)
+    assert [row['quantity'] for row in get_item_history('زيت الارجان')] == [50, 800, 50]
+    print("✓ اللقطة الأحدث حسب وقت الاستيراد")
+
+
+def test_count_matches_pages(inventory_db):
+    """count_inventory_items = مجموع صفوف كل الصفحات بنفس الفلاتر"""
+
+    path = inventory_db / 'c.xlsx'
+    names = [f'منتج {i}' for i in range(7)] + ['زيت 100%', 'زيت_خاص']
+    pd.DataFrame({'اسم المنتج': names, 'كميته': [10, 600, 50, 200, 5, 900, 99, 20, 700]}).to_excel(path, index=False)
+    snapshot_id = import_inventory_file(str(path))
+
+    for low_stock_only, search in ((False, None), (True, None), (False, 'منتج'), (True, 'منتج'), (False, '%'), (False, '_')):
+        total = count_inventory_items(snapshot_id, low_stock_only, search)
+        rows = [row for page in (1, 2, 3) for row in get_inventory_page(snapshot_id, page, 3, low_stock_only, search)]
+        assert len(rows) == total, (low_stock_only, search)
+    assert count_inventory_items(snapshot_id, False, '%') == 1
+    assert count_inventory_items(snapshot_id, True) == 5
+    print("✓ العدد يطابق الصفحات")
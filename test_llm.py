@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ملف اختبار للتوليد الدفعي للسيناريوهات (modules/llm.py)
+
+يعمل بدون OpenAI: خادم HTTP محلي يحاكي /chat/completions.
+وأيضاً cached_chat (modules/llm_cache.py) والحصص (modules/llm_quota.py) بقواعد بيانات مؤقتة.
+"""
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+import pytest
+
+from modules import llm_cache, llm_quota
+from modules.llm import build_batch_jobs, generate_batch, make_async_client
+from modules.llm_cache import cached_chat
+from modules.llm_quota import QuotaExceeded, estimate_tokens, get_bucket_state, get_user_reserved, set_user_quota
+
+
+class StubOpenAI(BaseHTTPRequestHandler):
+    """خادم وهمي: أول طلب لكل prompt يرجع 429 إن كان fail_first مفعلاً"""
+
+    state = {'seen': set(), 'active': 0, 'max_active': 0, 'calls': 0, 'fail_first': True, 'status': 200,
+             'delay': 0.05, 'retry_after': '0'}
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['messages'][-1]['content']
+
+        with self.lock:
+            first = prompt not in self.state['seen']
+            self.state['seen'].add(prompt)
+            self.state['active'] += 1
+            self.state['calls'] += 1
+            self.state['max_active'] = max(self.state['max_active'], self.state['active'])
+
+        time.sleep(self.state['delay'])
+        with self.lock:
+            self.state['active'] -= 1
+
+        if self.state['status'] != 200:
+            self._reply(self.state['status'], {'error': {'message': 'bad request'}})
+        elif first and self.state['fail_first']:
+            self._reply(429, {'error': {'message': 'rate limited'}}, {'retry-after': self.state['retry_after']})
+        else:
+            self._reply(200, {
+                'id': 'stub', 'object': 'chat.completion', 'created': 0, 'model': body['model'],
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': f"سكربت: {len(prompt)}"}}],
+            })
+
+    def _reply(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_stub(**state):
+    StubOpenAI.state = {'seen': set(), 'active': 0, 'max_active': 0, 'calls': 0, 'fail_first': True, 'status': 200,
+                        'delay': 0.05, 'retry_after': '0', **state}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubOpenAI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+@pytest.fixture
+def llm_db(monkeypatch, tmp_path):
+    """
+    قواعد بيانات مؤقتة للـ cache وسجل التكلفة، و token bucket ممتلئ يرجع كما كان بعد الاختبار
+
+    ردود الخادم الوهمي لا تُحفظ في database/llm_cache.db الحقيقية (نفس مفاتيح الطلبات الحقيقية)،
+    واستدعاءاته لا تُحسب في llm_ledger الحقيقي ولا تستهلك الـ bucket المشترك لبقية الاختبارات.
+    """
+    monkeypatch.setattr(llm_cache, 'DB_PATH', str(tmp_path / 'llm_cache.db'))
+    monkeypatch.setattr(llm_quota, 'DB_PATH', str(tmp_path / 'llm_usage.db'))
+    for key, value in (('requests', float(llm_quota.REQUESTS_PER_MINUTE)),
+                       ('tokens', float(llm_quota.TOKENS_PER_MINUTE)),
+                       ('updated', time.monotonic()),
+                       ('blocked_until', 0.0)):
+        monkeypatch.setitem(llm_quota._bucket, key, value)
+    return tmp_path
+
+
+def _cached_rows():
+    return llm_cache.get_db_connection().execute('SELECT COUNT(*) FROM llm_cache').fetchone()[0]
+
+
+def _ledger_statuses():
+    rows = llm_quota.get_db_connection().execute('SELECT status, COUNT(*) FROM llm_ledger GROUP BY status')
+    return dict(rows.fetchall())
+
+
+def test_batch_retries_and_concurrency(llm_db):
+    """اختبار الدفعة: إعادة المحاولة عند 429، حد التزامن، وترتيب النتائج"""
+
+    print("🧪 اختبار التوليد الدفعي:")
+    assert llm_cache.DB_PATH == str(llm_db / 'llm_cache.db')
+    assert llm_quota.DB_PATH == str(llm_db / 'llm_usage.db')
+    server, base_url = _start_stub()
+    try:
+        jobs = build_batch_jobs(['زيت الأرغان', 'صابون'], ['تيك توك', 'سناب'], ['تجربة', 'عرض'])
+        arrived = []
+        results = generate_batch(
+            jobs,
+            on_result=lambda index, result: arrived.append(index),
+            concurrency=3,
+            base_delay=0.01,
+            client=make_async_client(api_key='test', base_url=base_url),
+            use_cache=False,
+        )
+    finally:
+        server.shutdown()
+
+    assert len(results) == len(jobs) == 8
+    assert all(r['error'] is None for r in results), [r['error'] for r in results]
+    assert all(r['attempts'] == 2 for r in results), "يجب إعادة المحاولة مرة واحدة بعد 429"
+    assert [r['product'] for r in results] == [j['product'] for j in jobs], "النتائج بنفس ترتيب المهام"
+    assert sorted(arrived) == list(range(8)), "on_result لكل مهمة مرة واحدة"
+    assert StubOpenAI.state['max_active'] <= 3, "تجاوز حد الطلبات المتزامنة"
+    assert _cached_rows() == 8, "الردود في الـ cache المؤقت"
+    assert _ledger_statuses() == {'ok': 8}, "المحاولات المعادة لا تُسجل، الناجحة فقط"
+    print(f"✓ {len(results)} سيناريو، أقصى تزامن: {StubOpenAI.state['max_active']}")
+
+    return True
+
+
+def test_batch_non_retryable_error(llm_db):
+    """اختبار أن 400 لا يُعاد ويُسجل كخطأ"""
+
+    print("\n🧪 اختبار الأخطاء غير القابلة لإعادة المحاولة:")
+    assert llm_cache.DB_PATH == str(llm_db / 'llm_cache.db')
+    assert llm_quota.DB_PATH == str(llm_db / 'llm_usage.db')
+    server, base_url = _start_stub(status=400)
+    try:
+        jobs = build_batch_jobs(['زيت الأرغان'], ['تيك توك'], ['تجربة'])
+        results = generate_batch(jobs, base_delay=0.01,
+                                 client=make_async_client(api_key='test', base_url=base_url),
+                                 use_cache=False)
+    finally:
+        server.shutdown()
+
+    assert results[0]['error'] and results[0]['attempts'] == 1
+    assert _cached_rows() == 0
+    assert _ledger_statuses() == {'error': 1}
+    print("✓ خطأ مسجل بعد محاولة واحدة")
+
+    return True
+
+
+def _sync_client(base_url):
+    # إعادة المحاولة من cached_chat / llm_quota وليس من مكتبة OpenAI
+    return openai.OpenAI(api_key='test', base_url=base_url, max_retries=0)
+
+
+def _messages(text):
+    return [{'role': 'system', 'content': 'اختبار'}, {'role': 'user', 'content': text}]
+
+
+def test_concurrent_identical_requests_coalesce(llm_db):
+    """طلبان متطابقان في نفس الوقت = استدعاء API واحد"""
+
+    print("\n🧪 اختبار دمج الطلبات المتطابقة:")
+    server, base_url = _start_stub(fail_first=False, delay=0.5)
+    try:
+        client = _sync_client(base_url)
+        with ThreadPoolExecutor(2) as pool:
+            futures = [pool.submit(cached_chat, _messages('زيت الأرغان'), 'gpt-4o-mini', 0.8, 100, client)
+                       for _ in range(2)]
+            results = [future.result() for future in futures]
+    finally:
+        server.shutdown()
+
+    assert StubOpenAI.state['calls'] == 1
+    assert sorted(result['source'] for result in results) == ['api', 'coalesced']
+    assert results[0]['content'] == results[1]['content']
+    print("✓ استدعاء واحد لطلبين")
+
+
+def test_quota_exceeded_before_call(llm_db):
+    """تجاوز الحصة اليومية يرفع QuotaExceeded بدون استدعاء API"""
+
+    print("\n🧪 اختبار الحصة اليومية:")
+    server, base_url = _start_stub(fail_first=False)
+    try:
+        set_user_quota('sara', 10)
+        with pytest.raises(QuotaExceeded) as error:
+            cached_chat(_messages('صابون'), 'gpt-4o-mini', 0.8, 100, _sync_client(base_url),
+                        context={'user': 'sara'})
+    finally:
+        server.shutdown()
+
+    assert StubOpenAI.state['calls'] == 0
+    assert error.value.retry_after > 0
+    assert get_user_reserved('sara') == 0
+    print("✓ QuotaExceeded")
+
+
+def test_inflight_tokens_count_against_quota(llm_db):
+    """الطلب الجاري يحجز من الحصة: طلب متزامن ثانٍ لنفس المستخدم يُرفض"""
+
+    print("\n🧪 اختبار حجز الحصة للطلبات الجارية:")
+    server, base_url = _start_stub(fail_first=False, delay=0.5)
+    try:
+        client = _sync_client(base_url)
+        set_user_quota('sara', int(estimate_tokens(_messages('طلب 1'), 100) * 1.5))
+        with ThreadPoolExecutor(1) as pool:
+            first = pool.submit(cached_chat, _messages('طلب 1'), 'gpt-4o-mini', 0.8, 100, client,
+                                context={'user': 'sara'})
+            time.sleep(0.2)
+            with pytest.raises(QuotaExceeded):
+                cached_chat(_messages('طلب 2'), 'gpt-4o-mini', 0.8, 100, client, context={'user': 'sara'})
+            assert first.result()['source'] == 'api'
+    finally:
+        server.shutdown()
+
+    assert StubOpenAI.state['calls'] == 1
+    assert get_user_reserved('sara') == 0, "الحجز يُحرر بعد تسجيل الاستدعاء"
+    print("✓ الطلب الثاني رُفض أثناء الأول")
+
+
+def test_rate_limit_throttles_everyone(llm_db):
+    """429 من OpenAI يوقف كل الطلبات مدة Retry-After"""
+
+    print("\n🧪 اختبار 429:")
+    server, base_url = _start_stub(retry_after='60')
+    try:
+        client = _sync_client(base_url)
+        with pytest.raises(QuotaExceeded):
+            cached_chat(_messages('عطر'), 'gpt-4o-mini', 0.8, 100, client)
+        assert get_bucket_state()['paused_for'] > 50
+
+        # الطلب التالي يُرفض فوراً بدون الوصول للخادم
+        with pytest.raises(QuotaExceeded) as error:
+            cached_chat(_messages('كريم'), 'gpt-4o-mini', 0.8, 100, client)
+    finally:
+        server.shutdown()
+
+    assert StubOpenAI.state['calls'] == 1
+    assert error.value.retry_after > 50
+    print("✓ توقف الطلبات بعد 429")
+
+
+if __name__ == "__main__":
+    # الاختبارات تحتاج fixture قواعد البيانات المؤقتة (llm_db)
+    raise SystemExit(pytest.main([__file__, '-q', '-s']))
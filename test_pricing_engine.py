@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ملف اختبار محرك سيناريوهات التسعير (modules/pricing_engine.py)
+
+المرجع هو calculate_product_metrics في pricing_planning_v2، والكتالوج من products_pricing.json.
+"""
+
+import numpy as np
+import pytest
+
+from modules.pricing_engine import STATUSES, catalogue_metrics, evaluate_scenarios
+from pricing_planning_v2 import calculate_product_metrics
+
+
+def test_catalogue_metrics_matches_calculate_product_metrics(frame):
+    """catalogue_metrics = calculate_product_metrics لكل منتج"""
+
+    print("🧪 اختبار catalogue_metrics:")
+    metrics = catalogue_metrics(frame)
+    for name, row in frame.iterrows():
+        expected = calculate_product_metrics(row.to_dict(), row['cost'])
+        for key, value in expected.items():
+            if isinstance(value, str):
+                assert metrics.at[name, key] == value, f"{name}: {key}"
+            else:
+                assert metrics.at[name, key] == pytest.approx(value), f"{name}: {key}"
+    print(f"✓ {len(frame)} منتج")
+
+
+def test_evaluate_scenarios_matches_calculate_product_metrics(frame):
+    """كل خلية في مصفوفات evaluate_scenarios = calculate_product_metrics بنفس الخصومات"""
+
+    print("🧪 اختبار evaluate_scenarios:")
+    base_discounts, code_discounts = np.arange(0, 41, 5), np.arange(0, 21, 4)
+    grid = evaluate_scenarios(frame, base_discounts, code_discounts)
+    assert grid['margin'].shape == (len(frame), len(base_discounts), len(code_discounts))
+
+    for p, (name, row) in enumerate(frame.iterrows()):
+        for b, base_discount in enumerate(base_discounts):
+            for c, code_discount in enumerate(code_discounts):
+                after_discount = row['base_price'] * (1 - base_discount / 100)
+                product = {'base_price': row['base_price'], 'after_discount': after_discount,
+                           'after_code': after_discount * (1 - code_discount / 100)}
+                expected = calculate_product_metrics(product, row['cost'])
+                assert grid['price'][p, b, c] == pytest.approx(product['after_code'])
+                assert grid['profit'][p, b, c] == pytest.approx(expected['net_profit'])
+                assert grid['margin'][p, b, c] == pytest.approx(expected['profit_margin'])
+                assert STATUSES[grid['status'][p, b, c]][0] == expected['status'], name
+    print("✓ جميع السيناريوهات")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ملف اختبار محسّن الأسعار المحلي (modules/pricing_optimizer.py)
+
+الكتالوج من products_pricing.json مع تكاليف مختلفة (fixture frame في conftest.py).
+"""
+
+from modules.pricing_optimizer import PRICE_ENDINGS, find_ladders, optimize_prices
+
+
+def test_optimize_prices_margin_floor_and_endings(frame):
+    """الأسعار المقترحة تحقق الحد الأدنى للربح وبنهايات نفسية"""
+
+    print("🧪 اختبار optimize_prices:")
+    min_margin = 20.0
+    result = optimize_prices(frame, min_margin=min_margin)
+    feasible = result[result['feasible']]
+    assert len(feasible) > 0
+
+    assert (feasible['profit_margin'] >= min_margin - 1e-9).all()
+    assert feasible['after_code'].mod(10).isin(PRICE_ENDINGS).all()
+    assert (feasible['after_code'] < feasible['after_discount']).all()
+    assert (feasible['after_discount'] <= feasible['base_price']).all()
+
+    # منتج بتكلفة أعلى من سعره الأساسي: لا يوجد سعر آمن فتبقى الأسعار الحالية
+    assert not result['feasible'].all()
+    for name in result.index[~result['feasible']]:
+        assert result.at[name, 'after_code'] == frame.at[name, 'after_code']
+    print(f"✓ {len(feasible)} منتج بأسعار آمنة")
+
+
+def test_optimize_prices_ladder_invariants(frame):
+    """سلّم الأحجام: الحجم الأكبر أغلى، وسعر الوحدة فيه لا يزيد عن الأصغر"""
+
+    print("🧪 اختبار سلّم الأحجام:")
+    result = optimize_prices(frame)
+    ladders = find_ladders(list(frame.index))
+    assert ladders
+
+    checked = 0
+    for ladder in ladders:
+        members = [(name, size) for name, size in ladder
+                   if result.at[name, 'feasible'] and result.at[name, 'ladder_ok']]
+        for (larger, larger_size), (smaller, smaller_size) in zip(members, members[1:]):
+            for column in ('after_code', 'after_discount'):
+                assert result.at[larger, column] > result.at[smaller, column], f"{larger} / {smaller}"
+                assert (result.at[larger, column] / larger_size
+                        <= result.at[smaller, column] / smaller_size + 1e-9), f"{larger} / {smaller}"
+            checked += 1
+    assert checked > 0
+    print(f"✓ {checked} زوج أحجام")
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ملف اختبار جداول التجميع المسبق (rollups) في modules/database.py
+
+الـ triggers يجب أن تعطي نفس نتيجة _rebuild_rollups بعد كل إدراج وتعديل وحذف.
+قاعدة بيانات مؤقتة لكل اختبار (DB_PATH في tmp_path).
+"""
+
+import pytest
+
+from modules import database
+from modules.database import ROLLUPS, bulk_upsert_orders, get_top_customers, refresh_rollups
+
+
+def _order(number, name, amount, city, date):
+    return {'رقم الطلب': number, 'اسم العميل': name, 'المبلغ الاجمالي': amount,
+            'المدينة': city, 'تاريخ الطلب': date}
+
+
+@pytest.fixture
+def orders_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'customers.db'))
+    return database.get_db_connection()
+
+
+def _rollups(conn):
+    tables = {}
+    for table, key, _, _ in ROLLUPS:
+        rows = conn.execute(f'SELECT * FROM {table} ORDER BY {key}').fetchall()
+        tables[table] = [tuple(round(v, 6) if isinstance(v, float) else v for v in row) for row in rows]
+    return tables
+
+
+def _assert_matches_rebuild(conn):
+    maintained = _rollups(conn)
+    assert refresh_rollups()
+    assert maintained == _rollups(conn)
+
+
+def test_triggers_match_rebuild(orders_db):
+    """insert / update / delete: الـ triggers = إعادة البناء الكاملة"""
+
+    print("🧪 اختبار جداول التجميع:")
+    bulk_upsert_orders([
+        _order(1, 'محمد', 100, 'أبها', '2025-01-05'),
+        _order(2, 'محمد', 250, 'جدة', '2025-01-20'),
+        _order(3, 'سارة', 80, 'الرياض', '2025-02-01'),
+        _order(4, 'سارة', 40, '', '2025-02-03'),
+        _order(5, '', 60, 'جدة', None),
+    ])
+    _assert_matches_rebuild(orders_db)
+    print("✓ بعد الإدراج")
+
+    # تعديل المبلغ والمدينة والتاريخ والعميل (UPSERT ← trigger التحديث)
+    bulk_upsert_orders([
+        _order(2, 'محمد', 300, 'الدمام', '2025-03-01'),
+        _order(3, 'نورة', 80, 'الرياض', '2025-02-01'),
+        _order(6, 'سارة', 500, 'مكة', '2025-03-15'),
+    ])
+    _assert_matches_rebuild(orders_db)
+    print("✓ بعد التعديل")
+
+    with orders_db:
+        orders_db.execute('DELETE FROM orders WHERE order_number IN (2, 6)')
+    _assert_matches_rebuild(orders_db)
+    print("✓ بعد الحذف")
+
+
+def test_customer_city_after_delete(orders_db):
+    """حذف آخر طلب للعميل في مدينة: المدينة تعود لطلباته الباقية"""
+
+    bulk_upsert_orders([
+        _order(1, 'محمد', 100, 'أبها', '2025-01-05'),
+        _order(2, 'محمد', 250, 'جدة', '2025-01-20'),
+    ])
+    assert get_top_customers.__wrapped__()['المدينة'].tolist() == ['جدة']
+
+    with orders_db:
+        orders_db.execute('DELETE FROM orders WHERE order_number = 2')
+    assert get_top_customers.__wrapped__()['المدينة'].tolist() == ['أبها']
+    _assert_matches_rebuild(orders_db)
+    print("✓ المدينة بعد الحذف")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ملف اختبار البحث في الطلبات (search_orders / search_orders_fts)
+
+قاعدة بيانات مؤقتة لكل اختبار (DB_PATH في tmp_path).
+"""
+
+import pytest
+
+from modules import database
+from modules.database import PAGE_COLUMNS, bulk_upsert_orders, search_orders, search_orders_fts
+
+
+def _order(number, name, phone, city):
+    return {'رقم الطلب': number, 'اسم العميل': name, 'المبلغ الاجمالي': 100,
+            'رقم الهاتف': phone, 'المدينة': city}
+
+
+@pytest.fixture
+def orders_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'customers.db'))
+    bulk_upsert_orders([
+        _order(1, 'محمد العتيبي', '0501234567', 'أبها'),
+        _order(2, 'عبدالرحمن', '966559876543', 'الرياض'),
+        _order(3, 'سارة', '512223333', 'جدة'),
+    ])
+
+
+def _numbers(orders):
+    return [order[PAGE_COLUMNS[0]] for order in orders]
+
+
+def test_phone_search_both_formats(orders_db):
+    """الجوال يُطابق بالصيغة المحلية والدولية وبأي جزء من الرقم"""
+
+    print("🧪 اختبار البحث بالجوال:")
+    assert _numbers(search_orders('0501', search_by='phone')) == [1]
+    assert _numbers(search_orders('966501', search_by='phone')) == [1]
+    assert _numbers(search_orders('0559', search_by='phone')) == [2]
+    assert _numbers(search_orders('0512', search_by='phone')) == [3]
+    assert _numbers(search_orders('4567', search_by='phone')) == [1]
+    assert _numbers(search_orders_fts('0559')) == [2]
+    assert _numbers(search_orders_fts('9665012')) == [1]
+    print("✓ الصيغتان 05 و 966")
+
+
+def test_substring_search_falls_back_to_like(orders_db):
+    """جزء من الكلمة (ليس بدايتها) يجد الطلب عبر LIKE"""
+
+    assert _numbers(search_orders('محمد', search_by='customer_name')) == [1]
+    assert _numbers(search_orders('رحمن', search_by='customer_name')) == [2]
+    assert _numbers(search_orders('ياض', search_by='city')) == [2]
+    print("✓ البحث بجزء من الكلمة")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ملف اختبار لجمهور حملات مراسلاتي المحفوظ (modules/segmentation.py)
+
+قاعدة بيانات مؤقتة لكل اختبار (DB_PATH في tmp_path).
+"""
+
+import pytest
+
+from modules import database
+from modules.campaign_export import iter_campaign_contacts
+from modules.database import bulk_upsert_orders, iter_segment_orders, materialize_segment
+from modules.segmentation import (
+    ensure_campaign_segment, filters_to_query, get_filter_options, is_legacy_campaign, load_orders_frame,
+    segment_metrics, segment_orders,
+)
+
+
+def _order(number, amount, phone):
+    return {'رقم الطلب': number, 'اسم العميل': f'عميل {number}', 'المبلغ الاجمالي': amount,
+            'رقم الهاتف': phone, 'المدينة': 'Abha', 'حالة الطلب': 'مكتمل', ' طريقة الدفع': 'مدى'}
+
+
+@pytest.fixture
+def orders_db(monkeypatch, tmp_path):
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'customers.db'))
+    bulk_upsert_orders([
+        _order(1, 50, '0500000001'),
+        _order(2, 150, '0500000002'),
+        _order(3, 300, '0500000003'),
+        _order(4, 600, '0500000004'),
+    ])
+
+
+def _baseline_campaign():
+    """حملة بصيغة moraselaty_campaigns.json القديمة: نوع فلتر السعر بدون قيمه + قائمة العملاء"""
+    return {
+        'id': 1,
+        'name': 'حملة قديمة',
+        'filters': {'price_type': 'أكثر من', 'cities': ['كامل السعودية'],
+                    'statuses': ['الكل'], 'payments': ['الكل']},
+        'total_customers': 2,
+        'customers': [_order(3, 300, '0500000003'), _order(4, 600, '0500000004')],
+    }
+
+
+def _members(campaign_id):
+    return sorted(order['رقم الطلب'] for order in iter_segment_orders(campaign_id, columns=['order_number']))
+
+
+def test_legacy_campaign_keeps_saved_audience(orders_db):
+    """جمهور الحملة القديمة = القائمة المحفوظة، وليس الفلاتر بدون السعر"""
+
+    print("🧪 اختبار جمهور حملة قديمة:")
+    campaign = _baseline_campaign()
+    assert is_legacy_campaign(campaign)
+    assert ensure_campaign_segment(campaign)
+    assert _members(1) == [3, 4]
+
+    # طلب جديد يطابق الفلاتر (بدون السعر) لا يدخل الجمهور المحفوظ
+    bulk_upsert_orders([_order(5, 900, '0500000005')])
+    assert ensure_campaign_segment(campaign)
+    assert _members(1) == [3, 4]
+    print("✓ الجمهور من قائمة العملاء المحفوظة")
+
+
+def test_legacy_segment_built_from_filters_is_rebuilt(orders_db):
+    """جمهور قديم بُني خطأً من الفلاتر يُعاد بناؤه من القائمة المحفوظة"""
+
+    campaign = _baseline_campaign()
+    materialize_segment(1, query=filters_to_query(campaign['filters']))
+    assert _members(1) == [1, 2, 3, 4]
+
+    assert ensure_campaign_segment(campaign)
+    assert _members(1) == [3, 4]
+    print("✓ أُعيد بناء الجمهور")
+
+
+def test_new_campaign_uses_filters(orders_db):
+    """الحملات الجديدة (مع min_price) تُبنى من الفلاتر"""
+
+    campaign = {
+        'id': 2,
+        'filters': {'price_type': 'أكثر من', 'min_price': 200.0, 'max_price': None,
+                    'cities': ['كامل السعودية'], 'statuses': ['الكل'], 'payments': ['الكل']},
+    }
+    assert not is_legacy_campaign(campaign)
+    assert ensure_campaign_segment(campaign)
+    assert _members(2) == [3, 4]
+
+    bulk_upsert_orders([_order(5, 900, '0500000005')])
+    assert ensure_campaign_segment(campaign)
+    assert _members(2) == [3, 4, 5]
+    print("✓ الجمهور يتبع الفلاتر")
+
+
+def test_legacy_campaign_export_uses_saved_list(orders_db):
+    """تصدير الحملة القديمة = قائمة العملاء المحفوظة معها"""
+
+    campaign = _baseline_campaign()
+    contacts = list(iter_campaign_contacts(campaign))
+    assert contacts == [('عميل 3', '0500000003'), ('عميل 4', '0500000004')]
+    print("✓ التصدير من القائمة المحفوظة")
+
+
+def test_segments_info_single_query(orders_db):
+    """معلومات جميع الأجمهور المحفوظة بدون إعادة بنائها"""
+
+    assert database.get_segments_info() == {}
+    campaign = _baseline_campaign()
+    ensure_campaign_segment(campaign)
+    info = database.get_segments_info()
+    assert set(info) == {1}
+    assert info[1]['members_count'] == 2
+    assert info[1]['filters'] is None
+    print("✓ معلومات الأجمهور")
+
+
+def test_frame_filters_match_sql(orders_db):
+    """فلاتر الـ DataFrame (تبويب الفلترة) = نفس فلاتر SQL (جمهور الحملة المحفوظ)"""
+
+    bulk_upsert_orders([
+        dict(_order(5, 900, ''), **{'المدينة': 'Jeddah', ' طريقة الدفع': 'تحويل'}),
+        dict(_order(6, None, '0500000006'), **{'المدينة': 'Riyadh', 'حالة الطلب': 'ملغي'}),
+        dict(_order(7, 150, '0500000002'), **{'المدينة': ''}),
+    ])
+    df = load_orders_frame()
+    assert get_filter_options(df) == {'cities': ['Abha', 'Jeddah', 'Riyadh'],
+                                      'statuses': ['مكتمل', 'ملغي'], 'payments': ['تحويل', 'مدى']}
+    assert segment_metrics(df) == database.get_orders_summary()
+
+    for filters in ({},
+                    {'min_amount': 0},
+                    {'min_amount': 150, 'inclusive': False},
+                    {'min_amount': 150, 'max_amount': 600, 'inclusive': True},
+                    {'max_amount': 300, 'inclusive': False},
+                    {'cities': ['Abha', 'Riyadh']},
+                    {'statuses': ['ملغي']},
+                    {'payments': ['تحويل'], 'min_amount': 100}):
+        segment = segment_orders(df, **filters)
+        assert segment['contacts'] == database.query_orders(**filters), filters
+        assert segment['metrics'] == database.get_orders_summary(**filters), filters
+    print("✓ نفس النتائج في الذاكرة وفي SQLite")